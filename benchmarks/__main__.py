@@ -0,0 +1,93 @@
+"""
+Runs benchmarks and writes their results as JSON.
+
+    python -m benchmarks [--quick] [--output FILE] [SUITE ...]
+
+Results of different commits can be compared by running the same suites
+with the same options on the same machine.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from typing import Callable, Dict, Optional, Tuple
+
+from . import codec, crypto, forwarding, memory, objects
+from .common import Results, print_results
+
+
+Suite = Callable[[], Results]
+
+# suite name to (full run, quick run)
+SUITES: Dict[str, Tuple[Suite, Suite]] = {
+    "codec": (codec.run, lambda: codec.run(2000)),
+    "crypto": (crypto.run, lambda: crypto.run(200)),
+    "forwarding": (
+        forwarding.run,
+        lambda: forwarding.run((1000, 10000), ((16, 4), (64, 8))),
+    ),
+    "memory": (memory.run, lambda: memory.run((10000,))),
+    "objects": (objects.run, objects.run),
+}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True, check=True, text=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "suites", nargs="*", choices=[[], *SUITES], metavar="SUITE",
+        help=f"suites to run, all by default: {', '.join(SUITES)}",
+    )
+    parser.add_argument(
+        "-o", "--output", help="file to write JSON results to, '-' for stdout"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="run smaller workloads"
+    )
+    args = parser.parse_args()
+    results: Dict[str, Results] = {}
+    for name in args.suites or SUITES:
+        full, quick = SUITES[name]
+        print(f"# {name}", file=sys.stderr)
+        started = time.perf_counter()
+        results[name] = quick() if args.quick else full()
+        elapsed = time.perf_counter() - started
+        print(f"# {name} done in {elapsed:.1f}s", file=sys.stderr)
+        if args.output != "-":
+            print_results(results[name])
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "quick": args.quick,
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
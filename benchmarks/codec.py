@@ -0,0 +1,73 @@
+"""
+Encoding and decoding throughput of DefaultCodec per message type.
+
+Run with `python -m benchmarks.codec`.
+"""
+
+from __future__ import annotations
+
+from typing import Dict
+
+from qorp.codecs import DEFAULT_CODEC, LAZY_CODEC
+from qorp.encryption import Ed25519PrivateKey, X25519PrivateKey
+from qorp.messages import NetworkData, NetworkMessage, RouteError, RouteRequest
+from qorp.messages import RouteResponse
+from qorp.nodes import KnownNode
+
+from .common import Results, print_results, throughput
+
+
+COUNT = 20000
+
+
+def messages() -> Dict[str, NetworkMessage]:
+    source_key = Ed25519PrivateKey.generate()
+    source = KnownNode(source_key.public_key())
+    destination = KnownNode(Ed25519PrivateKey.generate().public_key())
+    exchange_key = X25519PrivateKey.generate().public_key()
+    payload = b"\x00"*1024
+    result: Dict[str, NetworkMessage] = {
+        "NetworkData": NetworkData(
+            source, destination, b"\x00"*12, len(payload), payload
+        ),
+        "RouteRequest": RouteRequest(source, destination, exchange_key),
+        "RouteResponse": RouteResponse(
+            source, destination, exchange_key, exchange_key
+        ),
+        "RouteError": RouteError(source, destination, source, destination),
+    }
+    for message in result.values():
+        message.sign(source_key)
+    return result
+
+
+def run(count: int = COUNT) -> Results:
+    results: Results = {}
+    for name, message in messages().items():
+
+        def encode() -> None:
+            # drop cached encoding, so message is encoded again
+            message.cache_encoding(None, b"")
+            DEFAULT_CODEC.encode(message)
+
+        encoded = DEFAULT_CODEC.encode(message)
+        results[name] = {
+            "bytes": len(encoded),
+            "encode_per_s": throughput(encode, count),
+            "decode_per_s": throughput(lambda: DEFAULT_CODEC.decode(encoded), count),
+            "lazy_decode_per_s": throughput(
+                lambda: LAZY_CODEC.decode(encoded), count
+            ),
+            "decode_head_per_s": throughput(
+                lambda: DEFAULT_CODEC.decode_head(encoded), count
+            ),
+        }
+    return results
+
+
+def main() -> None:
+    print_results(run())
+
+
+if __name__ == "__main__":
+    main()
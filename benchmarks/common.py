@@ -0,0 +1,61 @@
+"""
+Helpers shared by benchmarks.
+"""
+
+from __future__ import annotations
+
+import timeit
+import tracemalloc
+
+from typing import Callable, Dict, Union
+
+from qorp.frontend import Frontend
+from qorp.messages import FrontendData
+from qorp.router import Router
+
+
+Result = Dict[str, Union[int, float]]
+Results = Dict[str, Result]
+
+
+class NullFrontend(Frontend):
+    """
+    Frontend of benchmarked routers, it drops all received data.
+    """
+
+    def __init__(self, router: Router) -> None:
+        self.router = router
+
+    def message_callback(self, message: FrontendData) -> None:
+        pass
+
+
+def throughput(function: Callable[[], object], number: int) -> float:
+    """
+    Returns calls of `function` per second, the best of five runs.
+    """
+    return number / min(timeit.repeat(function, number=number, repeat=5))
+
+
+def allocated(function: Callable[[], object]) -> int:
+    """
+    Returns count of bytes allocated by `function` and still alive after it.
+    Result of function is kept alive until measurement is done.
+    """
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = function()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return after - before
+
+
+def print_results(results: Results) -> None:
+    for name, result in results.items():
+        values = ", ".join(
+            f"{key}={value:.6g}" if isinstance(value, float)
+            else f"{key}={value}"
+            for key, value in result.items()
+        )
+        print(f"{name:<40}{values}")
@@ -0,0 +1,63 @@
+"""
+Throughput of messages' signatures and sessions' encryption.
+
+Run with `python -m benchmarks.crypto`.
+"""
+
+from __future__ import annotations
+
+from qorp.encryption import ChaCha20Poly1305, Ed25519PrivateKey
+from qorp.encryption import X25519PrivateKey
+from qorp.messages import NetworkData
+from qorp.nodes import KnownNode
+from qorp.sessions import SessionInfo
+from qorp.verification import SignatureCache
+
+from .common import Results, print_results, throughput
+
+
+COUNT = 2000
+PAYLOAD_SIZES = (64, 1024, 16384)
+
+
+def run(count: int = COUNT) -> Results:
+    results: Results = {}
+    private_key = Ed25519PrivateKey.generate()
+    node = KnownNode(private_key.public_key())
+    payload = b"\x00"*1024
+    message = NetworkData(node, node, b"\x00"*12, len(payload), payload)
+    message.sign(private_key)
+    cache = SignatureCache(types=(NetworkData,))
+    cache.verify(message)
+    results["signature"] = {
+        "sign_per_s": throughput(lambda: message.sign(private_key), count),
+        "verify_per_s": throughput(message.verify, count),
+        "cached_verify_per_s": throughput(lambda: cache.verify(message), count),
+    }
+    own_key = X25519PrivateKey.generate()
+    peer_key = X25519PrivateKey.generate().public_key()
+    results["handshake"] = {
+        "keygen_per_s": throughput(X25519PrivateKey.generate, count),
+        "exchange_per_s": throughput(
+            lambda: ChaCha20Poly1305(own_key.exchange(peer_key)), count
+        ),
+    }
+    session = SessionInfo(ChaCha20Poly1305(ChaCha20Poly1305.generate_key()))
+    for size in PAYLOAD_SIZES:
+        data = b"\x00"*size
+        rate = throughput(
+            lambda: session.key.encrypt(session.next_nonce(), data, None),
+            count
+        )
+        results[f"encrypt_{size}"] = {
+            "per_s": rate, "mb_per_s": rate * size / 1e6
+        }
+    return results
+
+
+def main() -> None:
+    print_results(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Forwarding of data through route tables of different sizes and route
+discovery floods over in-memory network of routers.
+
+Run with `python -m benchmarks.forwarding`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+from itertools import cycle, permutations
+
+from typing import Callable, Iterable, List, Sequence, Tuple
+
+from qorp.encryption import Ed25519PrivateKey
+from qorp.messages import NetworkData, NetworkMessage
+from qorp.nodes import KnownNode, Neighbour
+from qorp.router import Router
+from qorp.routing import IndexedMessagesForwarder, MessagesForwarder
+from qorp.simulation import LinkConfig, Simulation
+
+from .common import NullFrontend, Result, Results, print_results
+from .common import throughput
+
+
+TABLE_SIZES = (1000, 10000, 100000)
+LOOKUPS = 20000
+# (nodes, concurrent requests)
+FLOODS = ((16, 4), (64, 8), (256, 16))
+SEED = 0
+
+
+class Sink(Neighbour):
+    """
+    Neighbour which drops everything sent to it.
+    """
+
+    def send(self, message: NetworkMessage) -> None:
+        pass
+
+
+def make_nodes(count: int) -> List[KnownNode]:
+    return [
+        KnownNode(Ed25519PrivateKey.generate().public_key())
+        for _ in range(count)
+    ]
+
+
+def route_pairs(size: int) -> Iterable[Tuple[KnownNode, KnownNode]]:
+    """
+    Returns `size` distinct pairs of nodes, nodes are shared between pairs.
+    """
+    count = 2
+    while count * (count - 1) < size:
+        count += 1
+    pairs = permutations(make_nodes(count), 2)
+    return (pair for pair, _ in zip(pairs, range(size)))
+
+
+def handle_data(
+    size: int,
+    forwarder_factory: Callable[[Router], MessagesForwarder],
+    lookups: int = LOOKUPS,
+) -> Result:
+    """
+    Measures handle_data of data messages with known routes in forwarder
+    holding `size` routes.
+    """
+    router = Router(
+        Ed25519PrivateKey.generate(),
+        frontend_factory=NullFrontend,
+        forwarder_factory=forwarder_factory,
+    )
+    forwarder = router.forwarder
+    directions = [Sink(node.public_key) for node in make_nodes(8)]
+    messages = []
+    for i, (source, destination) in enumerate(route_pairs(size)):
+        source_direction = directions[i % len(directions)]
+        destination_direction = directions[(i + 1) % len(directions)]
+        forwarder.routes[(source, destination)] = (
+            source_direction, destination_direction
+        )
+        if i % max(size // 1000, 1) == 0:
+            data = NetworkData(source, destination, b"\x00"*12, 1, b"\x00")
+            messages.append((source_direction, data))
+    items = cycle(messages)
+
+    def lookup() -> None:
+        source, data = next(items)
+        forwarder.handle_data(source, data)
+
+    return {
+        "routes": len(forwarder.routes) - 1,
+        "handle_data_per_s": throughput(lookup, lookups),
+    }
+
+
+def topology(
+    count: int, rng: random.Random, degree: int = 4
+) -> List[Tuple[int, int]]:
+    """
+    Ring of `count` nodes with random chords, mean degree is about `degree`.
+    """
+    edges = {(i, (i + 1) % count) for i in range(count)}
+    while len(edges) < count * degree // 2:
+        first, second = rng.sample(range(count), 2)
+        if (second, first) not in edges:
+            edges.add((first, second))
+    return sorted(edges)
+
+
+async def flood(
+    count: int, requests: int, seed: int = SEED, timeout: float = 30
+) -> Result:
+    """
+    Starts `requests` concurrent route discoveries between random routers of
+    connected network and waits until data sent along them is delivered.
+    """
+    edges = topology(count, random.Random(seed))
+    simulation = Simulation(
+        count, edges, LinkConfig(latency=0), seed=seed, trace_memory=True
+    )
+    result = await simulation.discover(
+        simulation.random_pairs(requests), b"\x00"*64, timeout
+    )
+    report = simulation.report()
+    rreqs = report["RouteRequest_messages"]
+    return {
+        "nodes": count,
+        "links": len(edges),
+        "requests": requests,
+        "delivered": result["delivered"],
+        "seconds": result["convergence"],
+        "rreq_messages": rreqs,
+        "rreq_per_request": rreqs / requests,
+        "control_bytes": result["control_bytes"],
+        "bytes_per_node": report["bytes_per_node"],
+    }
+
+
+def run(
+    table_sizes: Sequence[int] = TABLE_SIZES,
+    floods: Sequence[Tuple[int, int]] = FLOODS,
+) -> Results:
+    results: Results = {}
+    for size in table_sizes:
+        results[f"handle_data_{size}"] = handle_data(size, MessagesForwarder)
+        results[f"handle_data_indexed_{size}"] = handle_data(
+            size, IndexedMessagesForwarder
+        )
+    for count, requests in floods:
+        results[f"rreq_flood_{count}"] = asyncio.run(flood(count, requests))
+    return results
+
+
+def main() -> None:
+    print_results(run())
+
+
+if __name__ == "__main__":
+    main()
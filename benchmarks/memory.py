@@ -0,0 +1,78 @@
+"""
+Memory used per route and per session.
+
+Run with `python -m benchmarks.memory`.
+
+Memory is measured with tracemalloc, so memory of cipher contexts allocated
+by OpenSSL is not counted.
+"""
+
+from __future__ import annotations
+
+from typing import Sequence, Type
+
+from qorp.encryption import ChaCha20Poly1305
+from qorp.nodes import Neighbour
+from qorp.sessions import SessionInfo, SessionTable
+from qorp.tables import IndexedRouteTable, RouteTable
+
+from .common import Result, Results, allocated, print_results
+from .forwarding import make_nodes, route_pairs
+
+
+SIZES = (10000, 100000)
+
+
+def route_memory(table_type: Type[RouteTable], size: int) -> Result:
+    pairs = list(route_pairs(size))
+    directions = [Neighbour(node.public_key) for node in make_nodes(8)]
+    approximate = 0
+
+    def fill() -> RouteTable:
+        nonlocal approximate
+        table = table_type()
+        for i, pair in enumerate(pairs):
+            table[pair] = (
+                directions[i % len(directions)],
+                directions[(i + 1) % len(directions)],
+            )
+        approximate = table.approximate_bytes
+        return table
+
+    return {
+        "routes": size,
+        "bytes_per_route": allocated(fill) / size,
+        "approximate_bytes_per_route": approximate / size,
+    }
+
+
+def session_memory(size: int) -> Result:
+    nodes = make_nodes(size)
+    keys = [ChaCha20Poly1305.generate_key() for _ in range(size)]
+
+    def fill() -> SessionTable:
+        table = SessionTable(capacity=None)
+        for node, key in zip(nodes, keys):
+            table[node] = SessionInfo(ChaCha20Poly1305(key))
+        return table
+
+    return {"sessions": size, "bytes_per_session": allocated(fill) / size}
+
+
+def run(sizes: Sequence[int] = SIZES) -> Results:
+    results: Results = {}
+    for size in sizes:
+        results[f"routes_{size}"] = route_memory(RouteTable, size)
+        results[f"routes_indexed_{size}"] = route_memory(
+            IndexedRouteTable, size
+        )
+    results[f"sessions_{sizes[0]}"] = session_memory(sizes[0])
+    return results
+
+
+def main() -> None:
+    print_results(run())
+
+
+if __name__ == "__main__":
+    main()
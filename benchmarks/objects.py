@@ -0,0 +1,78 @@
+"""
+Per-object memory and construction time of messages and nodes.
+
+Run with `python -m benchmarks.objects`.
+"""
+
+from __future__ import annotations
+
+import timeit
+import tracemalloc
+
+from typing import Callable, Dict, List
+
+from qorp.encryption import Ed25519PrivateKey, X25519PrivateKey
+from qorp.messages import NetworkData, RouteRequest, RouteResponse, RouteError
+from qorp.nodes import KnownNode, Node, Neighbour
+
+
+COUNT = 10000
+
+
+def object_size(factory: Callable[[], object], count: int = COUNT) -> float:
+    """
+    Returns mean count of bytes allocated for one object made by `factory`.
+    Factory should reuse fields' values, so only object itself is measured.
+    """
+    objects: List[object] = []
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    objects.extend(factory() for _ in range(count))
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / count
+
+
+def construction_time(factory: Callable[[], object], count: int = COUNT) -> float:
+    """
+    Returns mean time of object construction in microseconds.
+    """
+    return min(timeit.repeat(factory, number=count, repeat=5)) / count * 1e6
+
+
+def factories() -> Dict[str, Callable[[], object]]:
+    key = Ed25519PrivateKey.generate().public_key()
+    node = KnownNode(key)
+    exchange_key = X25519PrivateKey.generate().public_key()
+    nonce, payload = b"\x00"*12, b"\x00"*64
+    return {
+        "Node": lambda: Node(node.address),
+        "KnownNode": lambda: KnownNode(key),
+        "KnownNode.from_address": lambda: KnownNode.from_address(node.address),
+        "Neighbour": lambda: Neighbour(key),
+        "NetworkData": lambda: NetworkData(node, node, nonce, 64, payload),
+        "RouteRequest": lambda: RouteRequest(node, node, exchange_key),
+        "RouteResponse": lambda: RouteResponse(node, node, exchange_key, exchange_key),
+        "RouteError": lambda: RouteError(node, node, node, node),
+    }
+
+
+def run() -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, factory in factories().items():
+        results[name] = {
+            "bytes": object_size(factory),
+            "construction_us": construction_time(factory),
+        }
+    return results
+
+
+def main() -> None:
+    print(f"{'type':<24}{'bytes':>10}{'init, us':>12}")
+    for name, result in run().items():
+        size, time = result["bytes"], result["construction_us"]
+        print(f"{name:<24}{size:>10.1f}{time:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Selection of connection for messages sent to neighbour with several links.
+"""
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from itertools import count
+
+from typing import Iterator, Sequence
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .queues import QueueItem
+    from .transports import Connection
+
+
+# encoded frame starts with 32-byte source and destination addresses
+FLOW_KEY_LENGTH = 64
+
+
+def flow_key(item: QueueItem) -> int:
+    """
+    Returns hash of item's (source, destination) pair. Messages and raw
+    frames of the same flow have equal keys.
+    """
+    if isinstance(item, tuple):
+        frame, _ = item
+        return hash(bytes(frame[:FLOW_KEY_LENGTH]))
+    return hash(item.source.address + item.destination.address)
+
+
+class ConnectionSelector(ABC):
+    """
+    Strategy of choosing one of neighbour's connections for item.
+    Connections passed to `select` are never empty.
+    """
+
+    @abstractmethod
+    def select(
+        self,
+        connections: Sequence[Connection],  # type: ignore
+        item: QueueItem
+    ) -> Connection:  # type: ignore
+        pass
+
+
+class FirstConnection(ConnectionSelector):
+    """
+    Sends everything through the first connection, others are spare.
+    """
+
+    def select(
+        self,
+        connections: Sequence[Connection],  # type: ignore
+        item: QueueItem
+    ) -> Connection:  # type: ignore
+        return connections[0]
+
+
+class RoundRobin(ConnectionSelector):
+    """
+    Cycles through connections. Messages of one flow may be reordered.
+    """
+
+    _counter: Iterator[int]
+
+    def __init__(self) -> None:
+        self._counter = count()
+
+    def select(
+        self,
+        connections: Sequence[Connection],  # type: ignore
+        item: QueueItem
+    ) -> Connection:  # type: ignore
+        return connections[next(self._counter) % len(connections)]
+
+
+class LeastQueued(ConnectionSelector):
+    """
+    Chooses connection with the least count of pending bytes.
+    """
+
+    def select(
+        self,
+        connections: Sequence[Connection],  # type: ignore
+        item: QueueItem
+    ) -> Connection:  # type: ignore
+        if len(connections) == 1:
+            return connections[0]
+        return min(connections, key=lambda connection: connection.pending)
+
+
+class LowestRTT(ConnectionSelector):
+    """
+    Chooses connection with the lowest round-trip time estimate.
+    Connections with unknown RTT are chosen only if all RTTs are unknown.
+
+    TCP connections sample kernel's RTT estimate on Linux. RTT of other
+    connections is unknown unless caller feeds samples (e.g. measured by
+    application-level pings) to `Connection.update_rtt`.
+    """
+
+    def select(
+        self,
+        connections: Sequence[Connection],  # type: ignore
+        item: QueueItem
+    ) -> Connection:  # type: ignore
+        best = connections[0]
+        for connection in connections[1:]:
+            rtt = connection.rtt
+            if rtt is not None and (best.rtt is None or rtt < best.rtt):
+                best = connection
+        return best
+
+
+class FlowHash(ConnectionSelector):
+    """
+    Chooses connection by hash of (source, destination) pair, so messages
+    of one flow keep their order while flows are spread over connections.
+    """
+
+    def select(
+        self,
+        connections: Sequence[Connection],  # type: ignore
+        item: QueueItem
+    ) -> Connection:  # type: ignore
+        if len(connections) == 1:
+            return connections[0]
+        return connections[flow_key(item) % len(connections)]
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from concurrent.futures import Executor
+
+from typing import Callable, Deque, Generic, List, Optional, Tuple, TypeVar
+
+
+Job = TypeVar("Job")
+Context = TypeVar("Context")
+Result = TypeVar("Result")
+
+
+class BatchExecutor(Generic[Job, Context, Result]):
+    """
+    Collects jobs into micro-batches and runs `worker` over them in executor.
+
+    Batch is sent to executor when it reaches `batch_size` jobs or when its
+    oldest job waits for `max_latency` seconds. Results are passed to
+    `callback` on the event loop together with job's context strictly in
+    order of submission, even if executor completes batches out of order.
+
+    If `worker` fails, the failure is passed to the loop's exception handler
+    and jobs of the batch are counted in `dropped`, their contexts don't get
+    results.
+
+    `worker` and jobs must be picklable to be used with process pool.
+    """
+
+    worker: Callable[[List[Job]], List[Result]]
+    callback: Callable[[Context, Result], None]
+    executor: Optional[Executor]
+    batch_size: int
+    max_latency: float
+    dropped: int
+    _jobs: List[Job]
+    _contexts: List[Context]
+    _inflight: Deque[Tuple[List[Context], asyncio.Future[List[Result]]]]
+    _timer: Optional[asyncio.TimerHandle]
+
+    def __init__(
+        self,
+        worker: Callable[[List[Job]], List[Result]],
+        callback: Callable[[Context, Result], None],
+        executor: Optional[Executor] = None,
+        batch_size: int = 64,
+        max_latency: float = 0.001,
+    ) -> None:
+        if batch_size < 1:
+            raise ValueError("Batch size must be positive")
+        self.worker = worker
+        self.callback = callback
+        self.executor = executor
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.dropped = 0
+        self._jobs = []
+        self._contexts = []
+        self._inflight = deque()
+        self._timer = None
+
+    @property
+    def pending(self) -> int:
+        """
+        Count of submitted jobs which results are not delivered yet.
+        """
+        inflight = sum(len(contexts) for contexts, _ in self._inflight)
+        return len(self._jobs) + inflight
+
+    def submit(self, job: Job, context: Context) -> None:
+        self._jobs.append(job)
+        self._contexts.append(context)
+        if len(self._jobs) >= self.batch_size:
+            self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.max_latency, self.flush)
+
+    def submit_result(self, context: Context, result: Result) -> None:
+        """
+        Passes already known result to `callback` keeping submission order.
+        """
+        if not self._jobs and not self._inflight:
+            self.callback(context, result)
+            return
+        self.flush()
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[List[Result]] = loop.create_future()
+        future.set_result([result])
+        self._inflight.append(([context], future))
+
+    def flush(self) -> None:
+        """
+        Sends collected jobs to executor without waiting for a full batch.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._jobs:
+            return
+        jobs, contexts = self._jobs, self._contexts
+        self._jobs, self._contexts = [], []
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self.worker, jobs)
+        self._inflight.append((contexts, future))
+        future.add_done_callback(self._deliver)
+
+    def _deliver(self, _: asyncio.Future[List[Result]]) -> None:
+        inflight = self._inflight
+        while inflight and inflight[0][1].done():
+            contexts, future = inflight.popleft()
+            if future.cancelled():
+                self.dropped += len(contexts)
+                continue
+            exception = future.exception()
+            if exception is not None:
+                self.dropped += len(contexts)
+                loop = future.get_loop()
+                loop.call_exception_handler({
+                    "message": "Batch worker failed",
+                    "exception": exception,
+                    "future": future,
+                })
+                continue
+            for context, result in zip(contexts, future.result()):
+                self.callback(context, result)
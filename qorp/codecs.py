@@ -2,12 +2,11 @@ from __future__ import annotations
 from abc import ABC, abstractmethod
 
 from typing import ClassVar, Dict, Generic, List, Tuple, Type, TypeVar, Union
-from typing import overload
-from typing_extensions import Literal
 
-from .encryption import Ed25519PublicKey, X25519PublicKey, pubkey_to_bytes
+from .encryption import X25519PublicKey
+from .messages import Buffer
 from .messages import NetworkData, RouteError, RouteRequest, RouteResponse
-from .nodes import Node, KnownNode, NodeAddress
+from .nodes import Node, KnownNode, NodeAddress, NodesRegistry, NODES
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -17,6 +16,7 @@ if TYPE_CHECKING:
 CHACHA_NONCE_LENGTH = 12
 PUBKEY_LENGTH = 32
 SIGNATURE_LENGTH = 64
+HEAD_LENGTH = 2*PUBKEY_LENGTH + 1
 
 Encoded = TypeVar("Encoded")
 
@@ -51,13 +51,20 @@ class DefaultCodec(MessagesCodec[bytes]):
         label: type for type, label in type_label.items()
     }
 
+    def __init__(self, lazy: bool = False, nodes: NodesRegistry = NODES) -> None:
+        self.lazy = lazy
+        self.nodes = nodes
+
     def encode(self, message: NetworkMessage) -> bytes:
-        fields: List[bytes]
+        cached = message.cached_encoding(self)
+        if cached is not None:
+            return cached
+        fields: List[Buffer]
         MessageType = type(message)
         if isinstance(message, NetworkData):
             fields = [
-                pubkey_to_bytes(message.source.public_key),
-                pubkey_to_bytes(message.destination.public_key),
+                message.source.address,
+                message.destination.address,
                 self.type_label[MessageType],
                 message.nonce,
                 message.length.to_bytes(2, "big"),
@@ -65,93 +72,149 @@ class DefaultCodec(MessagesCodec[bytes]):
                 message.payload,
             ]
         elif isinstance(message, RouteRequest):
-            if isinstance(message.destination, KnownNode):
-                dst_field = pubkey_to_bytes(message.destination.public_key)
-                dst_type = b"\x00"
-            else:
-                dst_field = message.destination.address
-                dst_type = b"\x01"
+            unknown_dst = not isinstance(message.destination, KnownNode)
+            dst_type = b"\x01" if unknown_dst else b"\x00"
             fields = [
-                pubkey_to_bytes(message.source.public_key),
-                dst_field,
+                message.source.address,
+                message.destination.address,
                 self.type_label[MessageType],
                 dst_type,
-                pubkey_to_bytes(message.public_key),
+                message.public_key_bytes,
                 message.signature,
             ]
         elif isinstance(message, RouteResponse):
             fields = [
-                pubkey_to_bytes(message.source.public_key),
-                pubkey_to_bytes(message.destination.public_key),
+                message.source.address,
+                message.destination.address,
                 self.type_label[MessageType],
-                pubkey_to_bytes(message.requester_key),
-                pubkey_to_bytes(message.public_key),
+                message.requester_key_bytes,
+                message.public_key_bytes,
                 message.signature,
             ]
         elif isinstance(message, RouteError):
             fields = [
-                pubkey_to_bytes(message.source.public_key),
-                pubkey_to_bytes(message.destination.public_key),
+                message.source.address,
+                message.destination.address,
                 self.type_label[MessageType],
-                pubkey_to_bytes(message.route_source.public_key),
-                pubkey_to_bytes(message.route_destination.public_key),
+                message.route_source.address,
+                message.route_destination.address,
                 message.signature,
             ]
         else:
             raise TypeError(f"Unknown message type: {MessageType.__name__}")
         raw = b"".join(fields)
+        message.cache_encoding(self, raw)
         return raw
 
-    def decode(self, encoded: bytes) -> NetworkMessage:
+    def decode_head(
+        self, encoded: Buffer
+    ) -> Tuple[NodeAddress, NodeAddress, Type[NetworkMessage]]:
+        """
+        Decodes only source address, destination address and type of message.
+        """
+        if len(encoded) < HEAD_LENGTH:
+            raise ValueError("Message is shorter than its head")
+        source = NodeAddress(bytes(encoded[:PUBKEY_LENGTH]))
+        destination = NodeAddress(bytes(encoded[PUBKEY_LENGTH:2*PUBKEY_LENGTH]))
+        type_label = bytes(encoded[2*PUBKEY_LENGTH:HEAD_LENGTH])
+        MessageType = self.label_type.get(type_label)
+        if MessageType is None:
+            raise ValueError(f"Unknown message type label: {type_label!r}")
+        return source, destination, MessageType
+
+    def data_signature(self, encoded: Buffer) -> Tuple[bytes, bytes]:
+        """
+        Returns signature and signed data of encoded NetworkData message
+        without decoding it.
+        """
+        nonce_start = HEAD_LENGTH
+        signature_start = nonce_start + CHACHA_NONCE_LENGTH + 2
+        payload_start = signature_start + SIGNATURE_LENGTH
+        if len(encoded) < payload_start:
+            raise ValueError("Message is shorter than NetworkData")
+        view = memoryview(encoded)
+        signature = bytes(view[signature_start:payload_start])
+        signed_data = b"".join((
+            view[:2*PUBKEY_LENGTH],
+            view[nonce_start:signature_start],
+            view[payload_start:],
+        ))
+        return signature, signed_data
+
+    def decode(self, encoded: Buffer) -> NetworkMessage:
+        """
+        Decodes message from bytes-like object.
+
+        Nodes are interned in `nodes` registry.
+        In lazy mode nodes' public keys are parsed on demand and `nonce`,
+        `payload` and `signature` fields are memoryviews over `encoded`, so
+        `encoded` must not be changed while decoded message is in use.
+        """
         message: NetworkMessage
         fields: Union[
-            Tuple[KnownNode, KnownNode, bytes, int, bytes],
+            Tuple[KnownNode, KnownNode, Buffer, int, Buffer],
             Tuple[KnownNode, Union[Node, KnownNode], X25519PublicKey],
             Tuple[KnownNode, KnownNode, X25519PublicKey, X25519PublicKey],
             Tuple[KnownNode, KnownNode, KnownNode, KnownNode],
         ]
-        source_, destination_, type_label, body = split(encoded, *self.head_scheme)
+        data: Buffer = memoryview(encoded) if self.lazy else bytes(encoded)
+        source_, destination_, type_label_, body = split(data, *self.head_scheme)
+        type_label = bytes(type_label_)
         MessageType = self.label_type.get(type_label)
         if MessageType is None:
             raise ValueError(f"Unknown message type label: {type_label!r}")
         body_scheme = self.body_schemes[MessageType]
         raw_fields = split(body, *body_scheme)
+        decode_node = self._decode_node
         if MessageType is NetworkData:
-            source, destination = _decode_sorce_destination(source_, destination_)
+            source, destination = decode_node(source_), decode_node(destination_)
             nonce, length_, signature, payload = raw_fields
             length = int.from_bytes(length_, "big")
             fields = source, destination, nonce, length, payload
         elif MessageType is RouteRequest:
             dst_type, pubkey_, signature = raw_fields
             unknown_dst = bool(dst_type[0])
-            source, rdestination = _decode_sorce_destination(source_, destination_, unknown_dst)  # noqa
-            pubkey = X25519PublicKey.from_public_bytes(pubkey_)
+            source = decode_node(source_)
+            rdestination: Union[Node, KnownNode]
+            if unknown_dst:
+                rdestination = Node(NodeAddress(bytes(destination_)))
+            else:
+                rdestination = decode_node(destination_)
+            pubkey = X25519PublicKey.from_public_bytes(bytes(pubkey_))
             fields = source, rdestination, pubkey
         elif MessageType is RouteResponse:
-            source, destination = _decode_sorce_destination(source_, destination_)
+            source, destination = decode_node(source_), decode_node(destination_)
             requester_pubkey_, pubkey_, signature = raw_fields
-            requester_pubkey = X25519PublicKey.from_public_bytes(requester_pubkey_)
-            pubkey = X25519PublicKey.from_public_bytes(pubkey_)
+            requester_pubkey = X25519PublicKey.from_public_bytes(bytes(requester_pubkey_))
+            pubkey = X25519PublicKey.from_public_bytes(bytes(pubkey_))
             fields = source, destination, requester_pubkey, pubkey
         elif MessageType is RouteError:
-            source, destination = _decode_sorce_destination(source_, destination_)
+            source, destination = decode_node(source_), decode_node(destination_)
             route_src_, route_dst_, signature = raw_fields
-            route_src_key = Ed25519PublicKey.from_public_bytes(route_src_)
-            route_dst_key = Ed25519PublicKey.from_public_bytes(route_dst_)
-            route_src = KnownNode(route_src_key)
-            route_dst = KnownNode(route_dst_key)
+            route_src = decode_node(route_src_)
+            route_dst = decode_node(route_dst_)
             fields = source, destination, route_src, route_dst
         else:
             raise ValueError(f"Unknown message type: {MessageType.__name__}")
         message = MessageType(*fields)
         message.set_signature(signature)
+        if isinstance(data, bytes):
+            message.cache_encoding(self, data)
         return message
 
+    def _decode_node(self, raw: Buffer) -> KnownNode:
+        node = self.nodes.get(NodeAddress(bytes(raw)))
+        if not self.lazy:
+            # key parsing also validates it
+            node.public_key
+        return node
+
 
 DEFAULT_CODEC = DefaultCodec()
+LAZY_CODEC = DefaultCodec(lazy=True)
 
 
-def split(source: bytes, *lengths: int) -> List[bytes]:
+def split(source: Buffer, *lengths: int) -> List[Buffer]:
     start = 0
     chunks = []
     for length in lengths:
@@ -163,32 +226,3 @@ def split(source: bytes, *lengths: int) -> List[bytes]:
         chunk = source[start:]
         chunks.append(chunk)
     return chunks
-
-
-@overload
-def _decode_sorce_destination(
-    src: bytes, dst: bytes
-) -> Tuple[KnownNode, KnownNode]: ...
-@overload  # noqa: E302
-def _decode_sorce_destination(
-    src: bytes, dst: bytes, unknown_dst: Literal[False] = False
-) -> Tuple[KnownNode, KnownNode]: ...
-@overload  # noqa: E302
-def _decode_sorce_destination(
-    src: bytes, dst: bytes, unknown_dst: Literal[True] = True
-) -> Tuple[KnownNode, Node]: ...
-@overload  # noqa: E302
-def _decode_sorce_destination(
-    src: bytes, dst: bytes, unknown_dst: bool = False
-) -> Union[Tuple[KnownNode, Node], Tuple[KnownNode, KnownNode]]: ...
-def _decode_sorce_destination(    # noqa: E302
-    src: bytes, dst: bytes, unknown_dst: bool = False
-) -> Union[Tuple[KnownNode, Node], Tuple[KnownNode, KnownNode]]:
-    src_key = Ed25519PublicKey.from_public_bytes(src)
-    source = KnownNode(src_key)
-    if unknown_dst:
-        destination = Node(NodeAddress(dst))
-    else:
-        dst_key = Ed25519PublicKey.from_public_bytes(dst)
-        destination = KnownNode(dst_key)
-    return source, destination
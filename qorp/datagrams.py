@@ -0,0 +1,424 @@
+"""
+Datagram transport (UDP).
+
+Messages sent to same peer during one event loop iteration are packed into
+as few datagrams as possible. Each message in datagram is prefixed with its
+2-byte big-endian length.
+"""
+
+from __future__ import annotations
+
+import asyncio
+
+from typing import Callable, List, MutableMapping, Optional, Tuple, cast
+
+from .codecs import DEFAULT_CODEC, DefaultCodec, MessagesCodec
+from .messages import Buffer
+from .tables import ExpiringTable
+from .transports import Connection, Protocol, Server
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .messages import NetworkMessage
+
+
+UDPAddress = Tuple[str, int]
+
+LENGTH_SIZE = 2
+DEFAULT_MTU = 1400
+# maximal payload of UDP datagram over IPv4
+MAX_DATAGRAM_SIZE = 65507
+
+
+class UDPProtocol(Protocol[UDPAddress, bytes]):
+
+    alias = "udp"
+    mtu: int
+
+    def __init__(self, host: str, port: int, mtu: int = DEFAULT_MTU) -> None:
+        if not LENGTH_SIZE < mtu <= MAX_DATAGRAM_SIZE:
+            raise ValueError(f"Invalid MTU: {mtu}")
+        self.address = (host, port)
+        self.mtu = mtu
+
+    def connect(
+        self, codec: MessagesCodec[bytes] = DEFAULT_CODEC
+    ) -> DatagramConnection:
+        """
+        Creates connection to protocol's address. Endpoint is opened in
+        background, messages sent before it is opened are kept until then.
+        """
+        endpoint = DatagramEndpoint(self)
+        connection = DatagramConnection(self, codec, endpoint, None)
+        endpoint.connections[None] = connection
+        loop = asyncio.get_running_loop()
+        loop.create_task(endpoint.open(remote_addr=self.address))
+        return connection
+
+    def listen(
+        self,
+        callback: Callable[[UDPAddress, Connection[UDPProtocol, bytes]], None],
+        codec: MessagesCodec[bytes] = DEFAULT_CODEC
+    ) -> DatagramServer:
+        """
+        Starts to receive datagrams on protocol's address. Connection is
+        created for each new peer.
+        """
+        server = DatagramServer(self, callback, codec)
+        loop = asyncio.get_running_loop()
+        loop.create_task(server.endpoint.open(local_addr=self.address))
+        return server
+
+
+Connections = MutableMapping[Optional[UDPAddress], "DatagramConnection"]
+
+
+class PeersTable(ExpiringTable[Optional[UDPAddress], "DatagramConnection"]):
+    """
+    Connections of server's peers. Connections of peers which sent nothing
+    for `ttl` seconds or least recently active ones are closed.
+    """
+
+    def _dropped(
+        self, key: Optional[UDPAddress], value: DatagramConnection
+    ) -> None:
+        value._closed()
+
+
+class DatagramEndpoint(asyncio.DatagramProtocol):
+    """
+    asyncio protocol which dispatches datagrams to connections by peer's
+    address. Connected endpoint keeps its only connection by `None` key.
+    """
+
+    protocol: UDPProtocol
+    connections: Connections
+    on_new_peer: Optional[Callable[[UDPAddress], Optional[DatagramConnection]]]
+    transport: Optional[asyncio.DatagramTransport]
+    paused: bool
+    _opened: Optional[asyncio.Future[None]]
+    _drain_waiters: List[asyncio.Future[None]]
+
+    def __init__(
+        self,
+        protocol: UDPProtocol,
+        on_new_peer: Optional[Callable[[UDPAddress], Optional[DatagramConnection]]] = None,
+        connections: Optional[Connections] = None,
+    ) -> None:
+        self.protocol = protocol
+        self.connections = {} if connections is None else connections
+        self.on_new_peer = on_new_peer
+        self.transport = None
+        self.paused = False
+        self._opened = None
+        self._drain_waiters = []
+
+    async def open(
+        self,
+        local_addr: Optional[UDPAddress] = None,
+        remote_addr: Optional[UDPAddress] = None
+    ) -> None:
+        opened = self.opened_future()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.create_datagram_endpoint(
+                lambda: self, local_addr=local_addr, remote_addr=remote_addr
+            )
+        except OSError as exc:
+            self.connection_lost(exc)
+            if not opened.done():
+                opened.set_exception(exc)
+
+    def opened_future(self) -> asyncio.Future[None]:
+        if self._opened is None:
+            loop = asyncio.get_running_loop()
+            self._opened = loop.create_future()
+        return self._opened
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+        else:
+            self.connection_lost(None)
+
+    async def drain(self) -> None:
+        """
+        Waits until socket's send buffer is flushed below high-water mark.
+        """
+        if not self.paused:
+            return
+        loop = asyncio.get_running_loop()
+        waiter: asyncio.Future[None] = loop.create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = cast(asyncio.DatagramTransport, transport)
+        opened = self.opened_future()
+        if not opened.done():
+            opened.set_result(None)
+        for connection in self.connections.values():
+            connection._flush()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.transport = None
+        connections = list(self.connections.values())
+        self.connections.clear()
+        for connection in connections:
+            connection._closed()
+        self._wake_drain_waiters(exc or ConnectionResetError("Endpoint closed"))
+
+    def pause_writing(self) -> None:
+        self.paused = True
+
+    def resume_writing(self) -> None:
+        self.paused = False
+        self._wake_drain_waiters(None)
+
+    def _wake_drain_waiters(self, exc: Optional[Exception]) -> None:
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
+
+    def datagram_received(self, data: bytes, addr: UDPAddress) -> None:
+        connection = self.connections.get(addr)
+        if connection is None:
+            connection = self.connections.get(None)
+        if connection is None and self.on_new_peer is not None:
+            connection = self.on_new_peer(addr)
+        if connection is not None:
+            connection._datagram_received(data)
+
+    def error_received(self, exc: Exception) -> None:
+        # ICMP errors (e.g. port unreachable) are not fatal for datagrams
+        pass
+
+
+class DatagramConnection(Connection[UDPProtocol, bytes]):
+    """
+    Connection with one peer over datagram endpoint.
+
+    Received messages are passed to `handler`. If `raw_handler` is set, it
+    gets encoded messages as memoryviews over received datagram instead and
+    no decoding happens. Malformed messages are counted and skipped.
+    """
+
+    endpoint: DatagramEndpoint
+    peer: Optional[UDPAddress]
+    handler: Optional[Callable[[NetworkMessage], None]]
+    raw_handler: Optional[Callable[[Buffer], None]]
+    closed: bool
+    datagrams_sent: int
+    frames_sent: int
+    bytes_sent: int
+    frames_received: int
+    bytes_received: int
+    datagrams_received: int
+    malformed: int
+    _outbox: List[Buffer]
+    _outbox_size: int
+    _flush_scheduled: bool
+
+    def __init__(
+        self,
+        protocol: UDPProtocol,
+        codec: MessagesCodec[bytes],
+        endpoint: DatagramEndpoint,
+        peer: Optional[UDPAddress],
+        handler: Optional[Callable[[NetworkMessage], None]] = None,
+    ) -> None:
+        self.protocol = protocol
+        self.codec = codec
+        self.endpoint = endpoint
+        self.peer = peer
+        self.handler = handler
+        self.raw_handler = None
+        self.closed = False
+        self.datagrams_sent = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.datagrams_received = 0
+        self.malformed = 0
+        self._outbox = []
+        self._outbox_size = 0
+        self._flush_scheduled = False
+
+    @property
+    def pending(self) -> int:
+        """
+        Count of bytes which are sent but not written to socket yet.
+        """
+        size = self._outbox_size
+        transport = self.endpoint.transport
+        if transport is not None:
+            # selector datagram transports buffer writes like stream ones
+            buffered = cast(asyncio.WriteTransport, transport)
+            size += buffered.get_write_buffer_size()
+        return size
+
+    def send(self, message: NetworkMessage) -> None:
+        self._write(self.codec.encode(message))
+
+    def send_raw(self, frame: Buffer, codec: MessagesCodec[bytes]) -> None:
+        if codec is self.codec:
+            self._write(frame)
+        else:
+            super().send_raw(bytes(frame), codec)
+
+    def callback(self, message: NetworkMessage) -> None:
+        if self.handler is not None:
+            self.handler(message)
+
+    async def opened(self) -> None:
+        await self.endpoint.opened_future()
+
+    async def drain(self) -> None:
+        if self.closed:
+            raise ConnectionResetError("Connection is closed")
+        await self.endpoint.drain()
+
+    def close(self) -> None:
+        self.endpoint.connections.pop(self.peer, None)
+        if self.peer is None:
+            self.endpoint.close()
+        self._closed()
+
+    def _write(self, frame: Buffer) -> None:
+        if self.closed:
+            raise ConnectionResetError("Connection is closed")
+        if LENGTH_SIZE + len(frame) > MAX_DATAGRAM_SIZE:
+            raise ValueError(f"Message is too long: {len(frame)} bytes")
+        self._outbox.append(frame)
+        self._outbox_size += LENGTH_SIZE + len(frame)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop = asyncio.get_running_loop()
+            loop.call_soon(self._flush)
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        transport = self.endpoint.transport
+        if transport is None or not self._outbox:
+            return
+        outbox = self._outbox
+        self._outbox = []
+        self.frames_sent += len(outbox)
+        self.bytes_sent += self._outbox_size
+        self._outbox_size = 0
+        mtu = self.protocol.mtu
+        parts: List[Buffer] = []
+        size = 0
+        for frame in outbox:
+            frame_size = LENGTH_SIZE + len(frame)
+            if parts and size + frame_size > mtu:
+                transport.sendto(b"".join(parts), self.peer)
+                self.datagrams_sent += 1
+                parts.clear()
+                size = 0
+            parts.append(len(frame).to_bytes(LENGTH_SIZE, "big"))
+            parts.append(frame)
+            size += frame_size
+        if parts:
+            transport.sendto(b"".join(parts), self.peer)
+            self.datagrams_sent += 1
+
+    def _closed(self) -> None:
+        self.closed = True
+        self._outbox.clear()
+        self._outbox_size = 0
+
+    def _datagram_received(self, data: bytes) -> None:
+        codec = self.codec
+        decode: Callable[[Buffer], NetworkMessage]
+        if isinstance(codec, DefaultCodec):
+            decode = codec.decode
+        else:
+            decode = lambda frame: codec.decode(bytes(frame))  # noqa: E731
+        self.datagrams_received += 1
+        view = memoryview(data)
+        offset, end = 0, len(data)
+        while end - offset >= LENGTH_SIZE:
+            length = int.from_bytes(view[offset:offset+LENGTH_SIZE], "big")
+            offset += LENGTH_SIZE
+            if offset + length > end:
+                # truncated datagram
+                return
+            frame = view[offset:offset+length]
+            offset += length
+            self.frames_received += 1
+            self.bytes_received += LENGTH_SIZE + length
+            if self.raw_handler is not None:
+                self.raw_handler(frame)
+                continue
+            try:
+                message = decode(frame)
+            except ValueError:
+                # one broken message doesn't spoil the rest of datagram
+                self.malformed += 1
+                continue
+            self.callback(message)
+
+
+class DatagramServer(Server[UDPProtocol, bytes]):
+    """
+    Server which creates connection for each new peer. At most `MAX_PEERS`
+    connections are kept, connections of peers idle for `PEER_IDLE_TIMEOUT`
+    seconds or least recently active ones are closed.
+    """
+
+    callback: Callable[[UDPAddress, Connection[UDPProtocol, bytes]], None]
+    endpoint: DatagramEndpoint
+    MAX_PEERS: Optional[int] = 1024
+    PEER_IDLE_TIMEOUT: Optional[float] = 300
+
+    def __init__(
+        self,
+        protocol: UDPProtocol,
+        callback: Callable[[UDPAddress, Connection[UDPProtocol, bytes]], None],
+        codec: MessagesCodec[bytes]
+    ) -> None:
+        self.protocol = protocol
+        self.callback = callback
+        self.codec = codec
+        self.endpoint = DatagramEndpoint(
+            protocol, self._new_peer,
+            PeersTable(self.MAX_PEERS, self.PEER_IDLE_TIMEOUT),
+        )
+
+    @property
+    def address(self) -> Optional[UDPAddress]:
+        """
+        Local address of server's socket.
+        """
+        if self.endpoint.transport is None:
+            return None
+        address: UDPAddress = self.endpoint.transport.get_extra_info("sockname")
+        return address
+
+    async def started(self) -> None:
+        await self.endpoint.opened_future()
+
+    def close(self) -> None:
+        self.endpoint.close()
+
+    def connection_callback(
+        self,
+        address: UDPAddress,
+        connection: Connection[UDPProtocol, bytes]
+    ) -> None:
+        self.callback(address, connection)
+
+    def _new_peer(self, address: UDPAddress) -> DatagramConnection:
+        connection = DatagramConnection(
+            self.protocol, self.codec, self.endpoint, address
+        )
+        self.endpoint.connections[address] = connection
+        self.connection_callback(address, connection)
+        return connection
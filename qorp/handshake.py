@@ -0,0 +1,150 @@
+"""
+Ephemeral keys of sessions' handshakes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from concurrent.futures import Executor
+
+from typing import Deque, Dict, List, Optional, Union
+
+from .encryption import X25519PrivateKey, X25519PublicKey, pubkey_to_bytes
+
+
+class EphemeralKey:
+    """
+    X25519 keypair with serialized public key.
+    """
+
+    __slots__ = ("private_key", "public_key", "public_bytes")
+
+    private_key: X25519PrivateKey
+    public_key: X25519PublicKey
+    public_bytes: bytes
+
+    def __init__(self, private_key: X25519PrivateKey) -> None:
+        self.private_key = private_key
+        self.public_key = private_key.public_key()
+        self.public_bytes = pubkey_to_bytes(self.public_key)
+
+    @classmethod
+    def generate(cls) -> EphemeralKey:
+        return cls(X25519PrivateKey.generate())
+
+
+def generate_keys(count: int) -> List[EphemeralKey]:
+    return [EphemeralKey.generate() for _ in range(count)]
+
+
+class KeyPool:
+    """
+    Pool of pre-generated ephemeral keys refilled in executor.
+
+    When count of keys drops below `low_water`, the pool is refilled up to
+    `high_water` keys by a single background job. If the pool is empty, key
+    is generated on the spot, so `take` never waits. Keys are never reused.
+
+    Keys are generated by OpenSSL which releases GIL, so thread pool
+    (default one if None) is enough.
+    """
+
+    low_water: int
+    high_water: int
+    executor: Optional[Executor]
+    hits: int
+    misses: int
+    _keys: Deque[EphemeralKey]
+    _refill: Optional[asyncio.Future[List[EphemeralKey]]]
+
+    def __init__(
+        self,
+        low_water: int = 16,
+        high_water: int = 64,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        if not 0 <= low_water <= high_water:
+            raise ValueError("Watermarks must satisfy 0 <= low <= high")
+        self.low_water = low_water
+        self.high_water = high_water
+        self.executor = executor
+        self.hits = 0
+        self.misses = 0
+        self._keys = deque()
+        self._refill = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def take(self) -> EphemeralKey:
+        keys = self._keys
+        if keys:
+            self.hits += 1
+            key = keys.popleft()
+        else:
+            self.misses += 1
+            key = EphemeralKey.generate()
+        if len(keys) < self.low_water:
+            self.refill()
+        return key
+
+    def refill(self) -> None:
+        """
+        Starts background generation of missing keys. Does nothing if it is
+        already started or there is no running event loop.
+        """
+        if self._refill is not None:
+            return
+        count = self.high_water - len(self._keys)
+        if count <= 0:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._refill = loop.run_in_executor(self.executor, generate_keys, count)
+        self._refill.add_done_callback(self._refilled)
+
+    def _refilled(self, future: asyncio.Future[List[EphemeralKey]]) -> None:
+        self._refill = None
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            future.get_loop().call_exception_handler({
+                "message": "Ephemeral keys generation failed",
+                "exception": exception,
+                "future": future,
+            })
+            return
+        room = self.high_water - len(self._keys)
+        self._keys.extend(future.result()[:room])
+
+
+class HandshakeStats:
+    """
+    Counters and total durations (in seconds) of handshakes' steps.
+    """
+
+    __slots__ = (
+        "exchanges", "exchange_time", "signatures", "signing_time",
+        "repeated_requests",
+    )
+
+    exchanges: int
+    exchange_time: float
+    signatures: int
+    signing_time: float
+    # requests answered with response of existing session
+    repeated_requests: int
+
+    def __init__(self) -> None:
+        self.exchanges = 0
+        self.exchange_time = 0.0
+        self.signatures = 0
+        self.signing_time = 0.0
+        self.repeated_requests = 0
+
+    def as_dict(self) -> Dict[str, Union[int, float]]:
+        return {name: getattr(self, name) for name in self.__slots__}
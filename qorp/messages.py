@@ -5,15 +5,81 @@ Module for definitions of each message type's structure.
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
-from typing import Optional, Union
+from dataclasses import MISSING, dataclass, field, fields
+from typing import ClassVar, Dict, List, Optional, Set, Type, TypeVar, Union
 
 from .encryption import Ed25519PrivateKey, X25519PublicKey, ChaCha20Poly1305
 from .encryption import InvalidSignature
 from .encryption import pubkey_to_bytes
 from .nodes import KnownNode, Node
+from .queues import BULK, CONTROL
 
 
+Buffer = Union[bytes, bytearray, memoryview]
+MessageType = TypeVar("MessageType", bound="Message")
+
+
+def slotted(cls: Type[MessageType]) -> Type[MessageType]:
+    """
+    Recreates dataclass with `__slots__` for its fields.
+
+    It is a replacement for `dataclass(slots=True)` which is not available
+    before Python 3.10. Must be applied over `dataclass` decorator.
+    """
+    inherited: Set[str] = set()
+    for base in cls.__mro__[1:]:
+        inherited.update(getattr(base, "__slots__", ()))
+    names = [f.name for f in fields(cls)]
+    namespace = dict(cls.__dict__)
+    for name in names:
+        # drop defaults, otherwise they will shadow slots
+        namespace.pop(name, None)
+    namespace.pop("__dict__", None)
+    namespace.pop("__weakref__", None)
+    namespace["__slots__"] = tuple(
+        name for name in names if name not in inherited
+    )
+    # dataclass relies on class attributes for defaults of non-init fields,
+    # so __init__ have to be replaced
+    namespace["__init__"] = _slots_init(cls)
+    slotted_cls: Type[MessageType] = type(cls.__name__, cls.__bases__, namespace)
+    return slotted_cls
+
+
+def _slots_init(cls: Type[Message]) -> object:
+    """
+    Makes __init__ which sets values of all fields directly to slots. It is
+    also faster than __init__ of frozen or `__setattr__`-overriding classes.
+    """
+    params = []
+    lines = []
+    namespace: Dict[str, object] = {"set": object.__setattr__}
+    for f in fields(cls):
+        if f.default_factory is not MISSING:
+            raise TypeError(f"Field {f.name!r} with default factory")
+        default = f"default_{f.name}"
+        if f.default is not MISSING:
+            namespace[default] = f.default
+        if f.init:
+            has_default = f.default is not MISSING
+            params.append(f"{f.name}={default}" if has_default else f.name)
+            value = f.name
+        elif f.default is not MISSING:
+            value = default
+        else:
+            continue
+        lines.append(f"    set(self, {f.name!r}, {value})")
+    if hasattr(cls, "__post_init__"):
+        lines.append("    self.__post_init__()")
+    lines.append("    pass")
+    source = f"def __init__(self, {', '.join(params)}):\n" + "\n".join(lines)
+    exec(source, namespace)
+    init = namespace["__init__"]
+    setattr(init, "__qualname__", f"{cls.__qualname__}.__init__")
+    return init
+
+
+@slotted
 @dataclass
 class Message(ABC):
     """
@@ -23,41 +89,127 @@ class Message(ABC):
 
     source: Node
     destination: Node
-    signature: Optional[bytes]
+    signature: Optional[Buffer]
 
 
+@slotted
 @dataclass
 class FrontendData(Message):
 
     source: Node
     destination: Node
     payload: bytes
-    signature: Optional[bytes] = field(init=False, default=None)
+    signature: Optional[Buffer] = field(init=False, default=None)
 
 
+@slotted
 @dataclass
 class NetworkMessage(Message, ABC):
+    """
+    Base class for messages which are transferred over the network.
+
+    Signed data, encoded form and raw bytes of keys are computed once and
+    kept until any public field of message is reassigned.
+    """
+
+    # priority class in neighbours' outbound queues
+    priority: ClassVar[int] = CONTROL
+    source: KnownNode
+    _signed_data: Optional[bytes] = field(
+        init=False, default=None, repr=False, compare=False
+    )
+    _encoded: Optional[bytes] = field(
+        init=False, default=None, repr=False, compare=False
+    )
+    _encoded_by: Optional[object] = field(
+        init=False, default=None, repr=False, compare=False
+    )
+    _keys_bytes: Optional[Dict[str, bytes]] = field(
+        init=False, default=None, repr=False, compare=False
+    )
+
+    def __setattr__(self, name: str, value: object) -> None:
+        object.__setattr__(self, name, value)
+        if name[0] == "_":
+            return
+        object.__setattr__(self, "_encoded", None)
+        if name != "signature":
+            object.__setattr__(self, "_signed_data", None)
+            object.__setattr__(self, "_keys_bytes", None)
 
     @property
     def signed(self) -> bool:
         return hasattr(self, "signature") and getattr(self, "signature")
 
-    def set_signature(self, signature: bytes) -> None:
+    def set_signature(self, signature: Buffer) -> None:
         self.signature = signature
 
+    def signed_data(self) -> bytes:
+        """
+        Returns bytes which are covered by message's signature.
+        """
+        data = self._signed_data
+        if data is None:
+            data = b"".join(self._signed_fields())
+            self._signed_data = data
+        return data
+
     @abstractmethod
+    def _signed_fields(self) -> List[Buffer]:
+        pass
+
+    def cached_encoding(self, codec: object) -> Optional[bytes]:
+        """
+        Returns message encoded by `codec` if it was encoded (or decoded)
+        by this codec earlier.
+        """
+        if self._encoded_by is codec:
+            return self._encoded
+        return None
+
+    def cache_encoding(self, codec: object, encoded: bytes) -> None:
+        self._encoded = encoded
+        self._encoded_by = codec
+
+    def cache_key_bytes(self, name: str, raw: bytes) -> None:
+        """
+        Sets already serialized value of public key field `name`.
+        """
+        keys_bytes = self._keys_bytes
+        if keys_bytes is None:
+            keys_bytes = self._keys_bytes = {}
+        keys_bytes[name] = raw
+
+    def _key_bytes(self, name: str, key: X25519PublicKey) -> bytes:
+        keys_bytes = self._keys_bytes
+        if keys_bytes is None:
+            keys_bytes = self._keys_bytes = {}
+        raw = keys_bytes.get(name)
+        if raw is None:
+            raw = keys_bytes[name] = pubkey_to_bytes(key)
+        return raw
+
     def sign(self, source_signing_key: Ed25519PrivateKey) -> None:
         """
         Signs message. Signature will be placed to `signature` attribute.
         """
+        self.signature = source_signing_key.sign(self.signed_data())
 
-    @abstractmethod
     def verify(self) -> bool:
         """
         Verify a message's signature.
         """
+        signature = getattr(self, "signature", None)
+        if signature is None:
+            return False
+        try:
+            self.source.public_key.verify(signature, self.signed_data())
+        except InvalidSignature:
+            return False
+        return True
 
 
+@slotted
 @dataclass
 class NetworkData(NetworkMessage):
     """
@@ -65,13 +217,14 @@ class NetworkData(NetworkMessage):
     that typically represents some higher-layer protocol message.
     """
 
+    priority: ClassVar[int] = BULK
     source: KnownNode
     destination: KnownNode
     # TODO: do something with this source of bugs
-    signature: bytes = field(init=False, default=None)  # type: ignore
-    nonce: bytes
+    signature: Buffer = field(init=False, default=None)  # type: ignore
+    nonce: Buffer
     length: int
-    payload: bytes
+    payload: Buffer
 
     def decrypt(self, key: ChaCha20Poly1305) -> bytes:
         """
@@ -79,35 +232,17 @@ class NetworkData(NetworkMessage):
         """
         return key.decrypt(self.nonce, self.payload, None)
 
-    def sign(self, source_signing_key: Ed25519PrivateKey) -> None:
-        fields = [
-            pubkey_to_bytes(self.source.public_key),
-            pubkey_to_bytes(self.destination.public_key),
+    def _signed_fields(self) -> List[Buffer]:
+        return [
+            self.source.address,
+            self.destination.address,
             self.nonce,
             self.length.to_bytes(2, "big"),
             self.payload,
         ]
-        message = b"".join(fields)
-        self.signature = source_signing_key.sign(message)
-
-    def verify(self) -> bool:
-        if getattr(self, "signature", None) is None:
-            return False
-        fields = [
-            pubkey_to_bytes(self.source.public_key),
-            pubkey_to_bytes(self.destination.public_key),
-            self.nonce,
-            self.length.to_bytes(2, "big"),
-            self.payload,
-        ]
-        message = b"".join(fields)
-        try:
-            self.source.public_key.verify(self.signature, message)
-        except InvalidSignature:
-            return False
-        return True
 
 
+@slotted
 @dataclass
 class RouteRequest(NetworkMessage):
     """
@@ -127,7 +262,11 @@ class RouteRequest(NetworkMessage):
     destination: Union[Node, KnownNode]
     public_key: X25519PublicKey
     # TODO: do something with this source of bugs
-    signature: bytes = field(init=False, default=None)  # type: ignore
+    signature: Buffer = field(init=False, default=None)  # type: ignore
+
+    @property
+    def public_key_bytes(self) -> bytes:
+        return self._key_bytes("public_key", self.public_key)
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, RouteRequest):
@@ -135,42 +274,18 @@ class RouteRequest(NetworkMessage):
         return all((
             self.source == other.source,
             self.destination == other.destination,
-            pubkey_to_bytes(self.public_key) == pubkey_to_bytes(other.public_key),
+            self.public_key_bytes == other.public_key_bytes,
         ))
 
-    def sign(self, source_signing_key: Ed25519PrivateKey) -> None:
-        if isinstance(self.destination, KnownNode):
-            dst_field = pubkey_to_bytes(self.destination.public_key)
-        else:
-            dst_field = self.destination.address
-        fields = [
-            pubkey_to_bytes(self.source.public_key),
-            dst_field,
-            pubkey_to_bytes(self.public_key),
-        ]
-        message = b"".join(fields)
-        self.signature = source_signing_key.sign(message)
-
-    def verify(self) -> bool:
-        if getattr(self, "signature", None) is None:
-            return False
-        if isinstance(self.destination, KnownNode):
-            dst_field = pubkey_to_bytes(self.destination.public_key)
-        else:
-            dst_field = self.destination.address
-        fields = [
-            pubkey_to_bytes(self.source.public_key),
-            dst_field,
-            pubkey_to_bytes(self.public_key),
+    def _signed_fields(self) -> List[Buffer]:
+        return [
+            self.source.address,
+            self.destination.address,
+            self.public_key_bytes,
         ]
-        message = b"".join(fields)
-        try:
-            self.source.public_key.verify(self.signature, message)
-        except InvalidSignature:
-            return False
-        return True
 
 
+@slotted
 @dataclass
 class RouteResponse(NetworkMessage):
     """
@@ -182,7 +297,15 @@ class RouteResponse(NetworkMessage):
     requester_key: X25519PublicKey  # to prevent replay attack in route search process
     public_key: X25519PublicKey
     # TODO: do something with this source of bugs
-    signature: bytes = field(init=False, default=None)  # type: ignore
+    signature: Buffer = field(init=False, default=None)  # type: ignore
+
+    @property
+    def requester_key_bytes(self) -> bytes:
+        return self._key_bytes("requester_key", self.requester_key)
+
+    @property
+    def public_key_bytes(self) -> bytes:
+        return self._key_bytes("public_key", self.public_key)
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, RouteResponse):
@@ -190,37 +313,20 @@ class RouteResponse(NetworkMessage):
         return all((
             self.source == other.source,
             self.destination == other.destination,
-            pubkey_to_bytes(self.requester_key) == pubkey_to_bytes(other.requester_key),
-            pubkey_to_bytes(self.public_key) == pubkey_to_bytes(other.public_key),
+            self.requester_key_bytes == other.requester_key_bytes,
+            self.public_key_bytes == other.public_key_bytes,
         ))
 
-    def sign(self, source_signing_key: Ed25519PrivateKey) -> None:
-        fields = [
-            pubkey_to_bytes(self.source.public_key),
-            pubkey_to_bytes(self.destination.public_key),
-            pubkey_to_bytes(self.requester_key),
-            pubkey_to_bytes(self.public_key),
-        ]
-        message = b"".join(fields)
-        self.signature = source_signing_key.sign(message)
-
-    def verify(self) -> bool:
-        if getattr(self, "signature", None) is None:
-            return False
-        fields = [
-            pubkey_to_bytes(self.source.public_key),
-            pubkey_to_bytes(self.destination.public_key),
-            pubkey_to_bytes(self.requester_key),
-            pubkey_to_bytes(self.public_key),
+    def _signed_fields(self) -> List[Buffer]:
+        return [
+            self.source.address,
+            self.destination.address,
+            self.requester_key_bytes,
+            self.public_key_bytes,
         ]
-        message = b"".join(fields)
-        try:
-            self.source.public_key.verify(self.signature, message)
-        except InvalidSignature:
-            return False
-        return True
 
 
+@slotted
 @dataclass
 class RouteError(NetworkMessage):
     """
@@ -236,30 +342,12 @@ class RouteError(NetworkMessage):
     route_source: KnownNode
     route_destination: KnownNode
     # TODO: do something with this source of bugs
-    signature: bytes = field(init=False, default=None)  # type: ignore
-
-    def sign(self, source_signing_key: Ed25519PrivateKey) -> None:
-        fields = [
-            pubkey_to_bytes(self.source.public_key),
-            pubkey_to_bytes(self.destination.public_key),
-            pubkey_to_bytes(self.route_source.public_key),
-            pubkey_to_bytes(self.route_destination.public_key),
-        ]
-        message = b"".join(fields)
-        self.signature = source_signing_key.sign(message)
-
-    def verify(self) -> bool:
-        if getattr(self, "signature", None) is None:
-            return False
-        fields = [
-            pubkey_to_bytes(self.source.public_key),
-            pubkey_to_bytes(self.destination.public_key),
-            pubkey_to_bytes(self.route_source.public_key),
-            pubkey_to_bytes(self.route_destination.public_key),
+    signature: Buffer = field(init=False, default=None)  # type: ignore
+
+    def _signed_fields(self) -> List[Buffer]:
+        return [
+            self.source.address,
+            self.destination.address,
+            self.route_source.address,
+            self.route_destination.address,
         ]
-        message = b"".join(fields)
-        try:
-            self.source.public_key.verify(self.signature, message)
-        except InvalidSignature:
-            return False
-        return True
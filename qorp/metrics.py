@@ -0,0 +1,601 @@
+"""
+Metrics of router, forwarder and transports.
+
+Metrics are disabled by default. `instrument` enables them for router:
+hot paths of its forwarder update counters and latency histograms, state
+kept by router anyway (tables, queues, caches' counters) is read only when
+snapshot is taken. Disabled metrics cost one attribute check per message.
+"""
+
+from __future__ import annotations
+
+from functools import partial
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Type
+from typing import TypeVar, Union
+
+from .messages import NetworkData, NetworkMessage, RouteError, RouteRequest
+from .messages import RouteResponse
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .nodes import Neighbour
+    from .queues import SendQueue
+    from .router import Router
+
+
+Labels = Tuple[Tuple[str, str], ...]
+Number = Union[int, float]
+Snapshot = Dict[str, Union[Number, Dict[str, Number]]]
+
+MESSAGE_TYPES: Tuple[Type[NetworkMessage], ...] = (
+    NetworkData, RouteRequest, RouteResponse, RouteError
+)
+QUANTILES = (0.5, 0.9, 0.99)
+# aliases of protocols which connections' traffic is exported
+TRANSPORTS = ("tcp", "unix", "udp")
+
+
+def format_labels(labels: Labels, extra: Labels = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """
+    Monotonic counter. If `function` is given, value is read from it.
+    """
+
+    __slots__ = ("name", "labels", "value", "function")
+
+    kind = "counter"
+
+    name: str
+    labels: Labels
+    value: Number
+    function: Optional[Callable[[], Number]]
+
+    def __init__(
+        self,
+        name: str,
+        labels: Labels = (),
+        function: Optional[Callable[[], Number]] = None,
+    ) -> None:
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.function = function
+
+    def inc(self, amount: Number = 1) -> None:
+        self.value += amount
+
+    def get(self) -> Number:
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class Gauge(Counter):
+    """
+    Value which may go up and down.
+    """
+
+    __slots__ = ()
+
+    kind = "gauge"
+
+    def set(self, value: Number) -> None:
+        self.value = value
+
+    def dec(self, amount: Number = 1) -> None:
+        self.value -= amount
+
+
+class Histogram:
+    """
+    Histogram of values (e.g. latencies in seconds) with bounded relative
+    error in the manner of HdrHistogram.
+
+    Values are counted in units of `unit`. Values below 2**`precision` units
+    are counted exactly, larger ones fall into buckets which width is about
+    1/2**(`precision`-1) of their values. Buckets are allocated on demand.
+    """
+
+    __slots__ = ("name", "labels", "unit", "precision", "count", "sum", "max",
+                 "_buckets")
+
+    kind = "summary"
+
+    name: str
+    labels: Labels
+    unit: float
+    precision: int
+    count: int
+    sum: float
+    max: float
+    _buckets: Dict[int, int]
+
+    def __init__(
+        self,
+        name: str,
+        labels: Labels = (),
+        unit: float = 1e-6,
+        precision: int = 7,
+    ) -> None:
+        if precision < 1:
+            raise ValueError("Precision must be positive")
+        self.name = name
+        self.labels = labels
+        self.unit = unit
+        self.precision = precision
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._buckets = {}
+
+    def record(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        units = int(value / self.unit)
+        precision = self.precision
+        if units >> precision:
+            shift = units.bit_length() - precision
+            index = (shift << (precision - 1)) + (units >> shift)
+        else:
+            index = max(units, 0)
+        buckets = self._buckets
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns upper bound of bucket holding `q`-quantile of values.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                return min(self._upper_bound(index) * self.unit, self.max)
+        return self.max
+
+    def reset(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._buckets.clear()
+
+    def _upper_bound(self, index: int) -> int:
+        precision = self.precision
+        if not index >> precision:
+            return index
+        shift = (index >> (precision - 1)) - 1
+        sub = index - (shift << (precision - 1))
+        return ((sub + 1) << shift) - 1
+
+
+Metric = Union[Counter, Histogram]
+C = TypeVar("C", bound=Counter)
+
+
+class Registry:
+    """
+    Named metrics. Metrics with the same name and different labels form
+    a family, like in Prometheus.
+    """
+
+    _metrics: Dict[Tuple[str, Labels], Metric]
+    _help: Dict[str, str]
+
+    def __init__(self) -> None:
+        self._metrics = {}
+        self._help = {}
+
+    def __len__(self) -> int:
+        return len(self._metrics)
+
+    def counter(
+        self,
+        name: str,
+        help: str = "",
+        labels: Optional[Dict[str, str]] = None,
+        function: Optional[Callable[[], Number]] = None,
+    ) -> Counter:
+        return self._register(Counter, name, help, labels, function)
+
+    def gauge(
+        self,
+        name: str,
+        help: str = "",
+        labels: Optional[Dict[str, str]] = None,
+        function: Optional[Callable[[], Number]] = None,
+    ) -> Gauge:
+        return self._register(Gauge, name, help, labels, function)
+
+    def histogram(
+        self,
+        name: str,
+        help: str = "",
+        labels: Optional[Dict[str, str]] = None,
+    ) -> Histogram:
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = Histogram(name, key[1])
+            self._help.setdefault(name, help)
+        elif not isinstance(metric, Histogram):
+            raise ValueError(f"Metric {name} is already registered")
+        return metric
+
+    def snapshot(self) -> Snapshot:
+        """
+        Returns current values by metric names with labels. Histograms are
+        represented by dicts of their count, sum, max and quantiles.
+        """
+        result: Snapshot = {}
+        for metric in self._metrics.values():
+            name = metric.name + format_labels(metric.labels)
+            if isinstance(metric, Histogram):
+                summary: Dict[str, Number] = {
+                    "count": metric.count, "sum": metric.sum, "max": metric.max
+                }
+                for q in QUANTILES:
+                    summary[f"p{round(q * 100)}"] = metric.quantile(q)
+                result[name] = summary
+            else:
+                result[name] = metric.get()
+        return result
+
+    def prometheus(self) -> str:
+        """
+        Returns metrics in Prometheus text exposition format. Histograms
+        are exposed as summaries.
+        """
+        families: Dict[str, List[Metric]] = {}
+        for metric in self._metrics.values():
+            families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name, metrics in families.items():
+            help = self._help.get(name)
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metrics[0].kind}")
+            for metric in metrics:
+                lines.extend(self._samples(metric))
+        return "\n".join(lines) + "\n"
+
+    def _register(
+        self,
+        kind: Type[C],
+        name: str,
+        help: str,
+        labels: Optional[Dict[str, str]],
+        function: Optional[Callable[[], Number]],
+    ) -> C:
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            registered = kind(name, key[1], function)
+            self._metrics[key] = registered
+            self._help.setdefault(name, help)
+            return registered
+        if type(metric) is not kind:
+            raise ValueError(f"Metric {name} is already registered")
+        assert isinstance(metric, kind)
+        if function is not None:
+            metric.function = function
+        return metric
+
+    @staticmethod
+    def _samples(metric: Metric) -> Iterable[str]:
+        name, labels = metric.name, metric.labels
+        if isinstance(metric, Histogram):
+            for q in QUANTILES:
+                value = metric.quantile(q)
+                yield f"{name}{format_labels(labels, (('quantile', str(q)),))} {value!r}"
+            yield f"{name}_sum{format_labels(labels)} {metric.sum!r}"
+            yield f"{name}_count{format_labels(labels)} {metric.count}"
+        else:
+            yield f"{name}{format_labels(labels)} {metric.get()!r}"
+
+
+class ForwarderMetrics:
+    """
+    Metrics updated by MessagesForwarder on its hot paths.
+    """
+
+    received: Dict[Type[NetworkMessage], Counter]
+    latency: Dict[Type[NetworkMessage], Histogram]
+    verify_failures: Counter
+    raw_relayed: Counter
+    rerr_emitted: Counter
+    rreq_propagated: Counter
+    rreq_fanout: Counter
+    rreq_timeouts: Counter
+
+    def __init__(self, registry: Registry) -> None:
+        self.received = {}
+        self.latency = {}
+        for MessageType in MESSAGE_TYPES:
+            labels = {"type": MessageType.__name__}
+            self.received[MessageType] = registry.counter(
+                "qorp_messages_received_total",
+                "Messages passed to forwarder, before verification.",
+                labels,
+            )
+            self.latency[MessageType] = registry.histogram(
+                "qorp_message_handling_seconds",
+                "Time of handling verified message by forwarder.",
+                labels,
+            )
+        self.verify_failures = registry.counter(
+            "qorp_verify_failures_total",
+            "Messages dropped because of invalid signature.",
+            {"stage": "inline"},
+        )
+        self.raw_relayed = registry.counter(
+            "qorp_raw_relayed_total",
+            "NetworkData frames relayed without decoding.",
+        )
+        self.rerr_emitted = registry.counter(
+            "qorp_route_errors_emitted_total",
+            "RouteError messages sent for data with unknown route.",
+        )
+        self.rreq_propagated = registry.counter(
+            "qorp_rreq_propagated_total",
+            "RouteRequest messages relayed to neighbours.",
+        )
+        self.rreq_fanout = registry.counter(
+            "qorp_rreq_fanout_total",
+            "Copies of RouteRequest messages sent to neighbours.",
+        )
+        self.rreq_timeouts = registry.counter(
+            "qorp_rreq_timeouts_total",
+            "Relayed RouteRequest messages left without response.",
+        )
+
+    def handled(self, MessageType: Type[NetworkMessage], seconds: float) -> None:
+        latency = self.latency.get(MessageType)
+        if latency is not None:
+            latency.record(seconds)
+
+
+def instrument(router: Router, registry: Optional[Registry] = None) -> Registry:
+    """
+    Enables metrics of router, its forwarder and neighbours' transports.
+    Returns registry holding them.
+    """
+    if registry is None:
+        registry = Registry()
+    forwarder = router.forwarder
+    forwarder.metrics = ForwarderMetrics(registry)
+
+    def batch_rejected() -> int:
+        verifier = forwarder.verifier
+        return 0 if verifier is None else verifier.rejected
+
+    registry.counter(
+        "qorp_verify_failures_total",
+        labels={"stage": "batch"}, function=batch_rejected
+    )
+
+    def batch_dropped() -> int:
+        verifier = forwarder.verifier
+        return 0 if verifier is None else verifier.dropped
+
+    def crypto_dropped() -> int:
+        crypto = router.crypto
+        return 0 if crypto is None else crypto.dropped
+
+    registry.counter(
+        "qorp_batch_dropped_total",
+        "Jobs lost because batch worker failed.",
+        {"stage": "verify"}, batch_dropped,
+    )
+    registry.counter(
+        "qorp_batch_dropped_total", labels={"stage": "crypto"},
+        function=crypto_dropped,
+    )
+    registry.counter(
+        "qorp_rreq_duplicates_total",
+        "RouteRequest messages dropped as already seen.",
+        function=lambda: forwarder.seen_requests.hits,
+    )
+    for result in ("hits", "misses"):
+        def cache_lookups(result: str = result) -> int:
+            cache = forwarder.signature_cache
+            return 0 if cache is None else int(getattr(cache, result))
+
+        registry.counter(
+            "qorp_signature_cache_total",
+            "Lookups of signature verification cache.",
+            {"result": result}, cache_lookups,
+        )
+    gauges: Dict[str, Tuple[str, Callable[[], Number]]] = {
+        "qorp_routes": (
+            "Known routes.", lambda: len(forwarder.routes)
+        ),
+        "qorp_directions": (
+            "Known directions to nodes.", lambda: len(forwarder.directions)
+        ),
+        "qorp_pending_requests": (
+            "Relayed RouteRequest messages waiting for response.",
+            lambda: sum(map(len, forwarder.pending_requests.values())),
+        ),
+        "qorp_timers": (
+            "Timers scheduled in forwarder's wheel.",
+            lambda: len(forwarder.timers),
+        ),
+        "qorp_sessions": (
+            "Established sessions.", lambda: len(router.sessions)
+        ),
+        "qorp_halfopened_sessions": (
+            "Sessions waiting for RouteResponse.",
+            lambda: len(router.halfopened),
+        ),
+        "qorp_pending_data": (
+            "Messages waiting for route discovery.",
+            lambda: sum(map(len, router.pending_data.values())),
+        ),
+        "qorp_ephemeral_keys": (
+            "Pre-generated handshake keys.", lambda: len(router.keys)
+        ),
+        "qorp_neighbours": (
+            "Neighbours of router.", lambda: len(forwarder.neighbours) - 1
+        ),
+        "qorp_connections": (
+            "Connections to neighbours.",
+            lambda: sum(len(n.connections) for n in _neighbours(router)),
+        ),
+        "qorp_send_queue_depth": (
+            "Messages queued to neighbours.",
+            lambda: sum(queue.depth for queue in _queues(router)),
+        ),
+        "qorp_send_pending_bytes": (
+            "Bytes sent to neighbours but not written yet.",
+            lambda: sum(n.pending for n in _neighbours(router)),
+        ),
+    }
+    for name, (help, function) in gauges.items():
+        registry.gauge(name, help, function=function)
+    counters: Dict[str, Tuple[str, Callable[[], Number]]] = {
+        "qorp_send_queue_dropped_total": (
+            "Messages dropped by send queues of neighbours.",
+            _Accumulated(partial(_queues, router), "dropped"),
+        ),
+        "qorp_pending_data_dropped_total": (
+            "Messages dropped while waiting for route discovery.",
+            lambda: router.dropped_data,
+        ),
+        "qorp_sessions_evicted_total": (
+            "Sessions evicted over capacity.", lambda: router.sessions.evicted
+        ),
+        "qorp_sessions_expired_total": (
+            "Idle sessions forgotten.", lambda: router.sessions.expired
+        ),
+        "qorp_sessions_rekeyed_total": (
+            "Sessions replaced by new ones.", lambda: router.sessions.rekeyed
+        ),
+        "qorp_ephemeral_keys_missed_total": (
+            "Handshake keys generated on the event loop.",
+            lambda: router.keys.misses,
+        ),
+    }
+    for name, (help, function) in counters.items():
+        registry.counter(name, help, function=function)
+    for transport in TRANSPORTS:
+        for direction in ("sent", "received"):
+            registry.counter(
+                "qorp_transport_frames_total",
+                "Frames passed through connections to neighbours.",
+                {"transport": transport, "direction": direction},
+                _Accumulated(
+                    partial(_connections, router, transport),
+                    f"frames_{direction}",
+                ),
+            )
+            registry.counter(
+                "qorp_transport_bytes_total",
+                "Bytes of frames passed through connections to neighbours.",
+                {"transport": transport, "direction": direction},
+                _Accumulated(
+                    partial(_connections, router, transport),
+                    f"bytes_{direction}",
+                ),
+            )
+    for direction in ("sent", "received"):
+        registry.counter(
+            "qorp_transport_datagrams_total",
+            "Datagrams passed through connections to neighbours.",
+            {"transport": "udp", "direction": direction},
+            _Accumulated(
+                partial(_connections, router, "udp"), f"datagrams_{direction}"
+            ),
+        )
+    for transport in TRANSPORTS:
+        registry.counter(
+            "qorp_transport_malformed_total",
+            "Malformed frames skipped by connections to neighbours.",
+            {"transport": transport},
+            _Accumulated(
+                partial(_connections, router, transport), "malformed"
+            ),
+        )
+    handshakes = router.handshakes
+    registry.counter(
+        "qorp_handshake_steps_total", "Steps of handshakes.",
+        {"step": "exchange"}, lambda: handshakes.exchanges,
+    )
+    registry.counter(
+        "qorp_handshake_steps_total", labels={"step": "sign"},
+        function=lambda: handshakes.signatures,
+    )
+    registry.counter(
+        "qorp_handshake_seconds_total", "Time spent in handshakes' steps.",
+        {"step": "exchange"}, lambda: handshakes.exchange_time,
+    )
+    registry.counter(
+        "qorp_handshake_seconds_total", labels={"step": "sign"},
+        function=lambda: handshakes.signing_time,
+    )
+    return registry
+
+
+def _neighbours(router: Router) -> Iterable[Neighbour]:
+    return (n for n in router.forwarder.neighbours if n is not router)
+
+
+def _queues(router: Router) -> Iterable[SendQueue]:
+    return (n.queue for n in _neighbours(router) if n.has_queue)
+
+
+def _connections(router: Router, transport: str) -> Iterable[object]:
+    return (
+        connection
+        for neighbour in _neighbours(router)
+        for connection in neighbour.connections
+        if connection.protocol.alias == transport
+    )
+
+
+class _Accumulated:
+    """
+    Sums counter of objects (connections, queues) which exist now and of
+    ones which existed at previous call. Objects which are gone since then
+    are folded into the total with their final counts, so the total never
+    decreases when a connection is lost or a neighbour leaves. Objects
+    which don't keep the counter are skipped.
+    """
+
+    __slots__ = ("objects", "counter", "retired", "_seen")
+
+    objects: Callable[[], Iterable[object]]
+    counter: str
+    retired: int
+    # objects by ids, references keep ids unique and final counts readable
+    _seen: Dict[int, object]
+
+    def __init__(
+        self, objects: Callable[[], Iterable[object]], counter: str
+    ) -> None:
+        self.objects = objects
+        self.counter = counter
+        self.retired = 0
+        self._seen = {}
+
+    def __call__(self) -> int:
+        counter = self.counter
+        current = {id(item): item for item in self.objects()}
+        for key, item in self._seen.items():
+            if key not in current:
+                self.retired += getattr(item, counter, 0)
+        self._seen = current
+        return self.retired + sum(
+            getattr(item, counter, 0) for item in current.values()
+        )
@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import List, NewType
+from typing import List, NewType, Optional
+from weakref import WeakValueDictionary
 
 from .encryption import Ed25519PublicKey, pubkey_to_bytes
+from .balancing import ConnectionSelector, FlowHash
+from .queues import BULK, HIGH_WATER, SendQueue
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
+    from .codecs import MessagesCodec
+    from .messages import Buffer
+    from .queues import QueueItem
     from .transports import Connection
     from .messages import NetworkMessage
 
@@ -26,9 +32,13 @@ class Node:
     Node's address is a derivate from Ed25519 public key.
     """
 
+    __slots__ = ("address",)
+
     address: NodeAddress
 
     def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
         if isinstance(other, Node):
             return self.address == other.address
         return NotImplemented
@@ -45,29 +55,204 @@ class Node:
 
 
 class KnownNode(Node):
+    """
+    Node with known public key.
+
+    Node's address is the raw public key, so node might be created from an
+    address only (see `from_address`). In that case the key is parsed on the
+    first access to `public_key`.
+    """
+
+    __slots__ = ("_public_key", "__weakref__")
 
-    public_key: Ed25519PublicKey
+    _public_key: Optional[Ed25519PublicKey]
 
     def __init__(self, public_key: Ed25519PublicKey):
-        self.public_key = public_key
-        super().__init__(address_from_pubkey(public_key))
+        # Node is frozen, so fields are set bypassing its __setattr__
+        object.__setattr__(self, "_public_key", public_key)
+        object.__setattr__(self, "address", address_from_pubkey(public_key))
+
+    @classmethod
+    def from_address(cls, address: NodeAddress) -> KnownNode:
+        """
+        Creates node from its address without parsing the public key.
+        """
+        node = cls.__new__(cls)
+        object.__setattr__(node, "_public_key", None)
+        object.__setattr__(node, "address", address)
+        return node
+
+    @property
+    def public_key(self) -> Ed25519PublicKey:
+        public_key = self._public_key
+        if public_key is None:
+            public_key = Ed25519PublicKey.from_public_bytes(self.address)
+            object.__setattr__(self, "_public_key", public_key)
+        return public_key
+
+
+class NodesRegistry:
+    """
+    Registry which interns known nodes by their addresses.
+
+    Registry keeps nodes only while they are used somewhere else (e.g. in
+    routing tables or messages), so it does not grow on its own. All users
+    of the registry share single node object with single parsed public key
+    for each address.
+    """
+
+    _nodes: WeakValueDictionary[NodeAddress, KnownNode]
+
+    def __init__(self) -> None:
+        self._nodes = WeakValueDictionary()
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, address: object) -> bool:
+        return address in self._nodes
+
+    def get(self, address: NodeAddress) -> KnownNode:
+        """
+        Returns node with given address, creates it if there is no such one.
+        """
+        node = self._nodes.get(address)
+        if node is None:
+            node = KnownNode.from_address(address)
+            self._nodes[address] = node
+        return node
+
+    def add(self, node: KnownNode) -> KnownNode:
+        """
+        Registers node if there is no node with same address yet.
+        Returns registered node.
+        """
+        registered = self._nodes.setdefault(node.address, node)
+        return registered
+
+
+NODES = NodesRegistry()
+# selectors are stateless, so neighbours share the default one
+DEFAULT_SELECTOR: ConnectionSelector = FlowHash()
 
 
 class Neighbour(KnownNode):
     """
     Neighbour is the node with which there is a direct 'connection'.
     Listeners and transporters are sets of unidirectional links.
+
+    Outbound queue is created on the first send to congested link and
+    selector is shared by neighbours which don't set their own one, so idle
+    neighbours cost little memory.
     """
 
+    __slots__ = ("connections", "_queue", "_selector")
+
     connections: List[Connection]  # type: ignore
+    _queue: Optional[SendQueue]
+    _selector: Optional[ConnectionSelector]
 
-    def __init__(self, public_key: Ed25519PublicKey):
+    def __init__(
+        self,
+        public_key: Ed25519PublicKey,
+        selector: Optional[ConnectionSelector] = None
+    ):
         super().__init__(public_key)
-        self.connections = []
+        object.__setattr__(self, "connections", [])
+        object.__setattr__(self, "_queue", None)
+        object.__setattr__(self, "_selector", selector)
+
+    @property
+    def queue(self) -> SendQueue:
+        queue = self._queue
+        if queue is None:
+            queue = SendQueue(self)
+            object.__setattr__(self, "_queue", queue)
+        return queue
+
+    @property
+    def has_queue(self) -> bool:
+        """
+        Tells whether outbound queue is created already.
+        """
+        return self._queue is not None
+
+    @property
+    def selector(self) -> ConnectionSelector:
+        selector = self._selector
+        if selector is None:
+            return DEFAULT_SELECTOR
+        return selector
+
+    @selector.setter
+    def selector(self, selector: ConnectionSelector) -> None:
+        object.__setattr__(self, "_selector", selector)
+
+    @property
+    def pending(self) -> int:
+        """
+        Count of bytes which are sent to neighbour but not written yet
+        through the least loaded connection.
+        """
+        if not self.connections:
+            return 0
+        return min(connection.pending for connection in self.connections)
 
     def send(self, message: NetworkMessage) -> None:
         """
-        Sends message to neighbour using one of neighbour's transporters.
+        Sends message to neighbour through outbound queue.
+        """
+        queue = self._queue
+        if queue is None:
+            if self.pending < HIGH_WATER:
+                self._transmit(message)
+                return
+            queue = self.queue
+        queue.put_nowait(message, message.priority)
+
+    def send_raw(self, frame: Buffer, codec: MessagesCodec[bytes]) -> None:
+        """
+        Sends already encoded message to neighbour.
+        """
+        queue = self._queue
+        if queue is None:
+            if self.pending < HIGH_WATER:
+                self._transmit((frame, codec))
+                return
+            queue = self.queue
+        # only network data is forwarded without decoding
+        queue.put_nowait((frame, codec), BULK)
+
+    async def drain(self) -> None:
+        """
+        Waits until the least loaded connection is ready to accept more data.
+        """
+        if not self.connections:
+            raise ConnectionResetError("Neighbour has no connections")
+        connection = min(self.connections, key=lambda c: c.pending)
+        await connection.drain()
+
+    def _transmit(self, item: QueueItem) -> None:
+        """
+        Writes queued item to connection chosen by selector.
+
+        Connections which fail to send are considered lost: they are removed
+        and item is sent through another one.
         """
-        # TODO?: Replace this with some connection selecting procedure
-        self.connections[0].send(message)
+        connections = self.connections
+        while connections:
+            if len(connections) == 1:
+                connection = connections[0]
+            else:
+                connection = self.selector.select(connections, item)
+            try:
+                if isinstance(item, tuple):
+                    frame, codec = item
+                    connection.send_raw(frame, codec)
+                else:
+                    connection.send(item)
+            except ConnectionError:
+                connections.remove(connection)
+            else:
+                return
+        raise ConnectionResetError("Neighbour has no connections")
@@ -0,0 +1,116 @@
+"""
+Session encryption off the event loop.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import Executor
+
+from typing import Callable, List, Optional, Tuple
+
+from .batching import BatchExecutor
+from .encryption import ChaCha20Poly1305, InvalidTag
+from .messages import Buffer
+
+
+# (session key, nonce, data, True to encrypt or False to decrypt)
+AEADJob = Tuple[ChaCha20Poly1305, Buffer, Buffer, bool]
+AEADCallback = Callable[[Optional[bytes]], None]
+
+
+def run_aead(job: AEADJob) -> Optional[bytes]:
+    """
+    Encrypts or decrypts data. Returns None if data can't be decrypted.
+    """
+    key, nonce, data, encrypt = job
+    if encrypt:
+        return key.encrypt(bytes(nonce), bytes(data), None)
+    try:
+        return key.decrypt(bytes(nonce), bytes(data), None)
+    except InvalidTag:
+        return None
+
+
+def run_aead_batch(jobs: List[AEADJob]) -> List[Optional[bytes]]:
+    return [run_aead(job) for job in jobs]
+
+
+class CryptoOffload:
+    """
+    Runs ChaCha20-Poly1305 operations of sessions in executor in batches.
+
+    Results are passed to callbacks on the event loop in order of submission,
+    so order of packets within each session is kept. Payloads shorter than
+    `inline_threshold` bytes are processed on the event loop right away when
+    nothing is queued before them, as handing them off costs more than the
+    cipher itself.
+
+    Session keys are cipher objects which can't be pickled, so executor must
+    be a thread pool (default one if None).
+    """
+
+    inline_threshold: int
+    offloaded: int
+    inlined: int
+    _batches: BatchExecutor[AEADJob, AEADCallback, Optional[bytes]]
+
+    def __init__(
+        self,
+        executor: Optional[Executor] = None,
+        batch_size: int = 64,
+        max_latency: float = 0.0005,
+        inline_threshold: int = 512,
+    ) -> None:
+        self.inline_threshold = inline_threshold
+        self.offloaded = 0
+        self.inlined = 0
+        self._batches = BatchExecutor(
+            run_aead_batch, self._done, executor, batch_size, max_latency
+        )
+
+    @property
+    def pending(self) -> int:
+        return self._batches.pending
+
+    @property
+    def dropped(self) -> int:
+        """
+        Count of jobs lost because batch worker failed.
+        """
+        return self._batches.dropped
+
+    def encrypt(
+        self,
+        key: ChaCha20Poly1305,
+        nonce: Buffer,
+        data: Buffer,
+        callback: AEADCallback
+    ) -> None:
+        self._submit((key, nonce, data, True), callback)
+
+    def decrypt(
+        self,
+        key: ChaCha20Poly1305,
+        nonce: Buffer,
+        data: Buffer,
+        callback: AEADCallback
+    ) -> None:
+        """
+        Decrypts data, callback gets None if data is forged or corrupted.
+        """
+        self._submit((key, nonce, data, False), callback)
+
+    def flush(self) -> None:
+        self._batches.flush()
+
+    def _submit(self, job: AEADJob, callback: AEADCallback) -> None:
+        if len(job[2]) < self.inline_threshold:
+            self.inlined += 1
+            self._batches.submit_result(callback, run_aead(job))
+        else:
+            self.offloaded += 1
+            self._batches.submit(job, callback)
+
+    @staticmethod
+    def _done(callback: AEADCallback, result: Optional[bytes]) -> None:
+        callback(result)
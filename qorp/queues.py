@@ -0,0 +1,175 @@
+"""
+Outbound queues of neighbours.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+
+from typing import Deque, List, Optional, Tuple, Union
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .codecs import MessagesCodec
+    from .messages import Buffer, NetworkMessage
+    from .nodes import Neighbour
+
+
+# priority classes, lower value goes first
+CONTROL = 0
+BULK = 1
+PRIORITIES = (CONTROL, BULK)
+
+# overflow policies
+DROP_NEWEST = "drop-newest"
+DROP_OLDEST = "drop-oldest"
+RAISE = "raise"
+POLICIES = (DROP_NEWEST, DROP_OLDEST, RAISE)
+
+# delay between checks of link which is congested but can't be drained
+POLL_INTERVAL = 0.001
+# pending bytes of neighbour's link from which it is considered congested
+HIGH_WATER = 0x10000
+
+# message or raw frame with codec it is encoded with
+QueueItem = Union["NetworkMessage", Tuple["Buffer", "MessagesCodec[bytes]"]]
+
+
+class SendQueue:
+    """
+    Bounded outbound queue of neighbour with priority classes.
+
+    While neighbour's link is not congested, items are transmitted
+    immediately. Otherwise they are queued and pumped by background task as
+    link drains, control messages go ahead of bulk data.
+
+    Each priority class holds at most `maxsize` items. `put_nowait` handles
+    overflow according to `policy`: drops new item (DROP_NEWEST), drops the
+    oldest item of the same class (DROP_OLDEST) or raises `asyncio.QueueFull`
+    (RAISE). Producers which prefer backpressure to drops should await `put`.
+    """
+
+    neighbour: Neighbour
+    maxsize: int
+    policy: str
+    high_water: int
+    dropped: int
+    _classes: Tuple[Deque[QueueItem], ...]
+    _putters: List[asyncio.Future[None]]
+    _pump_task: Optional[asyncio.Task[None]]
+
+    def __init__(
+        self,
+        neighbour: Neighbour,
+        maxsize: int = 1024,
+        policy: str = DROP_NEWEST,
+        high_water: int = HIGH_WATER,
+    ) -> None:
+        if maxsize < 1:
+            raise ValueError("Queue size must be positive")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.neighbour = neighbour
+        self.maxsize = maxsize
+        self.policy = policy
+        self.high_water = high_water
+        self.dropped = 0
+        self._classes = tuple(deque() for _ in PRIORITIES)
+        self._putters = []
+        self._pump_task = None
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._classes)
+
+    @property
+    def depth(self) -> int:
+        """
+        Count of queued items.
+        """
+        return len(self)
+
+    @property
+    def depths(self) -> Tuple[int, ...]:
+        """
+        Count of queued items per priority class.
+        """
+        return tuple(len(items) for items in self._classes)
+
+    @property
+    def congested(self) -> bool:
+        return self.neighbour.pending >= self.high_water
+
+    def full(self, priority: int) -> bool:
+        return len(self._classes[priority]) >= self.maxsize
+
+    def put_nowait(self, item: QueueItem, priority: int) -> None:
+        if not len(self) and not self.congested:
+            self.neighbour._transmit(item)
+            return
+        items = self._classes[priority]
+        if len(items) >= self.maxsize:
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return
+            elif self.policy == DROP_OLDEST:
+                items.popleft()
+                self.dropped += 1
+            else:
+                raise asyncio.QueueFull()
+        items.append(item)
+        self._start_pump()
+
+    async def put(self, item: QueueItem, priority: int) -> None:
+        """
+        Waits until there is a room for item in its priority class.
+        """
+        loop = asyncio.get_running_loop()
+        while self.full(priority):
+            waiter: asyncio.Future[None] = loop.create_future()
+            self._putters.append(waiter)
+            await waiter
+        self.put_nowait(item, priority)
+
+    def clear(self) -> None:
+        """
+        Drops all queued items.
+        """
+        for items in self._classes:
+            self.dropped += len(items)
+            items.clear()
+        self._wake_putters()
+
+    def _pop(self) -> QueueItem:
+        for items in self._classes:
+            if items:
+                return items.popleft()
+        raise IndexError("pop from empty queue")
+
+    def _start_pump(self) -> None:
+        if self._pump_task is None:
+            loop = asyncio.get_running_loop()
+            self._pump_task = loop.create_task(self._pump())
+
+    async def _pump(self) -> None:
+        try:
+            while len(self):
+                while len(self) and not self.congested:
+                    self.neighbour._transmit(self._pop())
+                self._wake_putters()
+                if not len(self):
+                    break
+                await self.neighbour.drain()
+                if self.congested:
+                    await asyncio.sleep(POLL_INTERVAL)
+        except (ConnectionError, IndexError):
+            # link is lost, nothing can be sent to neighbour
+            self.clear()
+        finally:
+            self._pump_task = None
+
+    def _wake_putters(self) -> None:
+        waiters, self._putters = self._putters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
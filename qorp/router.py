@@ -1,33 +1,49 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, field
+import time
+from collections import deque
+from functools import partial
 
-from typing import Callable, Dict, Union
+from typing import Callable, Deque, Dict, Optional, Union
 
-from .encryption import Ed25519PrivateKey, Ed25519PublicKey, X25519PrivateKey
-from .encryption import ChaCha20Poly1305
+from .encryption import Ed25519PrivateKey, Ed25519PublicKey
+from .encryption import ChaCha20Poly1305, X25519PublicKey
 from .frontend import Frontend
+from .handshake import EphemeralKey, HandshakeStats, KeyPool
 from .messages import NetworkMessage, FrontendData
 from .messages import NetworkData, RouteRequest, RouteResponse, RouteError
-from .nodes import Node, KnownNode, Neighbour
+from .nodes import Node, KnownNode, Neighbour, NODES
+from .offload import CryptoOffload, run_aead
+from .sessions import SessionInfo, SessionTable, nonce_counter
+from .tables import ExpiringTable
 from .routing import MessagesForwarder
 
 
-@dataclass
-class SessionInfo:
-
-    key: ChaCha20Poly1305
-    counter: int = field(init=False, default=0)
-
-
 class Router(Neighbour):
 
     private_key: Ed25519PrivateKey
     public_key: Ed25519PublicKey
     frontend: Frontend
     forwarder: MessagesForwarder
-    sessions: Dict[KnownNode, SessionInfo]
-    halfopened: Dict[Node, X25519PrivateKey]
+    sessions: SessionTable
+    halfopened: ExpiringTable[Node, EphemeralKey]
+    keys: KeyPool
+    handshakes: HandshakeStats
+    pending_data: Dict[Node, Deque[FrontendData]]
+    dropped_data: int
+    # sessions' encryption is done on the event loop if it is None
+    crypto: Optional[CryptoOffload] = None
+    # count of messages kept per destination while route is discovered
+    PENDING_LIMIT: int = 256
+    SESSIONS_CAPACITY: Optional[int] = 4096
+    SESSION_IDLE_TIMEOUT: Optional[float] = 600
+    REKEY_PACKETS: Optional[int] = 1 << 32
+    REKEY_INTERVAL: Optional[float] = 3600
+    # replaced session is still accepted for this time after rekeying
+    REKEY_GRACE: float = 30
+    # ephemeral keys kept ready for handshakes
+    KEYS_LOW_WATER: int = 16
+    KEYS_HIGH_WATER: int = 64
 
     def __init__(
         self,
@@ -44,57 +60,206 @@ class Router(Neighbour):
             self.frontend = frontend_factory(self)
         else:
             raise TypeError("Missing 'frontend' or 'frontend_factory' argument.")
-        self.sessions = {}
-        self.halfopened = {}
+        self.sessions = SessionTable(
+            self.SESSIONS_CAPACITY, self.SESSION_IDLE_TIMEOUT,
+            self.REKEY_PACKETS, self.REKEY_INTERVAL, self.REKEY_GRACE
+        )
+        self.keys = KeyPool(self.KEYS_LOW_WATER, self.KEYS_HIGH_WATER)
+        self.pending_data = {}
+        self.dropped_data = 0
         self.forwarder = forwarder_factory(self)
+        # half-opened sessions live as long as their route requests
+        self.halfopened = ExpiringTable(
+            self.SESSIONS_CAPACITY, self.forwarder.RREQ_TIMEOUT
+        )
+        self.handshakes = HandshakeStats()
 
     def send(self, message: Union[NetworkMessage, FrontendData]) -> None:
         """
         Handle messages from MessageForwarder or Frontend.
         """
         if isinstance(message, FrontendData):
-            if message.source != self.address:
-                pass
-            if message.destination in self.sessions:
-                pass
-            elif message.destination in self.halfopened:
-                pass
-            else:
-                pass
+            if message.source != self:
+                return
+            destination = message.destination
+            session = self.sessions.get(destination)  # type: ignore
+            if session is not None:
+                if self.sessions.needs_rekey(session):
+                    if destination not in self.halfopened:
+                        # old session is used until the new one is opened
+                        self._request_route(destination)
+                self._send_data(message, self.sessions.sending(session))
+                return
+            self._enqueue_data(message)
+            if message.destination not in self.halfopened:
+                self._request_route(message.destination)
         elif isinstance(message, NetworkData):
-            session = self.sessions[message.source]
-            data = session.key.decrypt(message.nonce, message.payload, None)
-            frontend_msg = FrontendData(message.source, message.destination, data)
-            self.frontend.message_callback(frontend_msg)
+            session = self.sessions.get(message.source)
+            if session is None:
+                return
+            counter = nonce_counter(bytes(message.nonce))
+            if not session.replay.check(counter):
+                previous = self.sessions.previous(session)
+                if previous is None or not previous.replay.check(counter):
+                    return
+            callback = partial(self._decrypted, message, session, counter)
+            if self.crypto is not None:
+                self.crypto.decrypt(
+                    session.key, message.nonce, message.payload, callback
+                )
+            else:
+                key, nonce, payload = session.key, message.nonce, message.payload
+                callback(run_aead((key, nonce, payload, False)))
         elif isinstance(message, RouteRequest):
-            private_key = X25519PrivateKey.generate()
-            public_key = private_key.public_key()
+            if message.destination != self:
+                return
+            session = self.sessions.get(message.source)
+            response = None if session is None else session.response
+            if response is not None and (
+                response.requester_key_bytes == message.public_key_bytes
+            ):
+                # request is repeated after forwarders forgot it (e.g. it is
+                # delayed on a slower path), the same response keeps session
+                # of both sides the same without new exchange and signing
+                self.handshakes.repeated_requests += 1
+                self.forwarder.message_callback(self, response)
+                return
             source_public_key = message.public_key
-            raw_encryption_key = private_key.exchange(source_public_key)
-            # NOTE: there is no need to cut 32-bytes shared secret because
-            #       ChaCha20 uses exactly 32-bytes long key
-            encryption_key = ChaCha20Poly1305(raw_encryption_key)
+            ephemeral = self.keys.take()
+            encryption_key = self._exchange(ephemeral, source_public_key)
             session = SessionInfo(encryption_key)
             # TODO: check that there is no existed route info for request
             #       source (it might allow replay attacks)
             self.sessions[message.source] = session
-            response = RouteResponse(self, message.source, source_public_key, public_key)
-            response.sign(self.private_key)
+            response = RouteResponse(
+                self, message.source, source_public_key, ephemeral.public_key
+            )
+            response.cache_key_bytes("requester_key", message.public_key_bytes)
+            response.cache_key_bytes("public_key", ephemeral.public_bytes)
+            self._sign(response)
+            session.response = response
             self.forwarder.message_callback(self, response)
         elif isinstance(message, RouteResponse):
-            private_key = self.halfopened[message.source]
-            public_key = private_key.public_key()
-            destination_public_key = message.public_key
-            raw_encryption_key = private_key.exchange(destination_public_key)
-            # NOTE: there is no need to cut 32-bytes shared secret because
-            #       ChaCha20 uses exactly 32-bytes long key
-            encryption_key = ChaCha20Poly1305(raw_encryption_key)
-            session = SessionInfo(encryption_key)
+            if message.destination != self:
+                return
+            request_key = self.halfopened.get(message.source)
+            if request_key is None or (
+                message.requester_key_bytes != request_key.public_bytes
+            ):
+                # response to unknown or outdated request
+                return
+            encryption_key = self._exchange(request_key, message.public_key)
+            session = SessionInfo(encryption_key, initiator=True)
             # TODO: check that there is no existed route info for request
             #       source (it might allow replay attacks)
             self.sessions[message.source] = session
+            del self.halfopened[message.source]
+            for pending in self.pending_data.pop(message.source, ()):
+                self._send_data(pending, session)
         elif isinstance(message, RouteError):
             if message.route_destination in self.sessions:
                 self.sessions.pop(message.route_destination)
         else:
             raise TypeError
+
+    def _enqueue_data(self, message: FrontendData) -> None:
+        """
+        Keeps message until route to its destination is discovered.
+        Oldest messages are dropped if there are too many of them.
+        """
+        pending = self.pending_data.get(message.destination)
+        if pending is None:
+            pending = deque(maxlen=self.PENDING_LIMIT)
+            self.pending_data[message.destination] = pending
+        elif len(pending) == pending.maxlen:
+            self.dropped_data += 1
+        pending.append(message)
+
+    def _request_route(self, destination: Node) -> None:
+        """
+        Starts route discovery. Concurrent sends to the same destination
+        share this request until it is answered or expired.
+        """
+        private_key = self.keys.take()
+        self.halfopened[destination] = private_key
+        request = RouteRequest(self, destination, private_key.public_key)
+        request.cache_key_bytes("public_key", private_key.public_bytes)
+        self._sign(request)
+
+        def expire() -> None:
+            current_key = self.halfopened.get(destination)
+            if current_key is private_key:
+                del self.halfopened[destination]
+            elif current_key is not None:
+                # request is repeated
+                return
+            dropped = self.pending_data.pop(destination, ())
+            self.dropped_data += len(dropped)
+
+        self.forwarder.timers.call_later(self.forwarder.RREQ_TIMEOUT, expire)
+        self.forwarder.message_callback(self, request)
+
+    def _exchange(
+        self, ephemeral: EphemeralKey, peer_key: X25519PublicKey
+    ) -> ChaCha20Poly1305:
+        start = time.perf_counter()
+        raw_encryption_key = ephemeral.private_key.exchange(peer_key)
+        # NOTE: there is no need to cut 32-bytes shared secret because
+        #       ChaCha20 uses exactly 32-bytes long key
+        encryption_key = ChaCha20Poly1305(raw_encryption_key)
+        handshakes = self.handshakes
+        handshakes.exchanges += 1
+        handshakes.exchange_time += time.perf_counter() - start
+        return encryption_key
+
+    def _sign(self, message: NetworkMessage) -> None:
+        start = time.perf_counter()
+        message.sign(self.private_key)
+        handshakes = self.handshakes
+        handshakes.signatures += 1
+        handshakes.signing_time += time.perf_counter() - start
+
+    def _send_data(self, message: FrontendData, session: SessionInfo) -> None:
+        destination = message.destination
+        if not isinstance(destination, KnownNode):
+            destination = NODES.get(destination.address)
+        nonce = session.next_nonce()
+        callback = partial(self._encrypted, destination, nonce)
+        if self.crypto is not None:
+            self.crypto.encrypt(session.key, nonce, message.payload, callback)
+        else:
+            callback(session.key.encrypt(nonce, message.payload, None))
+
+    def _encrypted(
+        self, destination: KnownNode, nonce: bytes, payload: Optional[bytes]
+    ) -> None:
+        assert payload is not None
+        data = NetworkData(self, destination, nonce, len(payload), payload)
+        data.sign(self.private_key)
+        self.forwarder.message_callback(self, data)
+
+    def _decrypted(
+        self,
+        message: NetworkData,
+        session: SessionInfo,
+        counter: int,
+        data: Optional[bytes]
+    ) -> None:
+        if data is None:
+            previous = self.sessions.previous(session)
+            if previous is None:
+                # payload is forged or encrypted with another session's key
+                return
+            # packet may be sent before peer has got the new session
+            key, nonce, payload = previous.key, message.nonce, message.payload
+            data = run_aead((key, nonce, payload, False))
+            if data is None:
+                return
+            session = previous
+        elif not session.confirmed:
+            # peer has got the new session, so it may be used for sending
+            session.confirmed = True
+        if not session.replay.accept(counter):
+            return
+        frontend_msg = FrontendData(message.source, message.destination, data)
+        self.frontend.message_callback(frontend_msg)
@@ -1,23 +1,33 @@
 from __future__ import annotations
 
 import asyncio
+import time
 from asyncio import Future
-from weakref import WeakKeyDictionary
 
-from typing import Callable, Dict, Optional, Set, Tuple, TypeVar
+from typing import Callable, ClassVar, Dict, Iterable, Optional, Set, Tuple
+from typing import Type
+from typing import TypeVar, Union
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
+    from .metrics import ForwarderMetrics
     from .router import Router
 
-from .messages import NetworkMessage
+from .codecs import DefaultCodec
+from .messages import Buffer, NetworkMessage
 from .messages import NetworkData, RouteRequest, RouteResponse, RouteError
 from .nodes import KnownNode, Node, Neighbour
+from .tables import ExpiringTable, IndexedRouteTable, RouteTable, SeenFilter
+from .timers import Timer, TimerWheel
 from .transports import Connection
+from .verification import BatchVerifier, SignatureCache, verify_signature
 
 
 RRepInfo = Tuple[Neighbour, RouteResponse]
-
-EMPTY_SET: Set[Future[RRepInfo]] = set()
+# (source address, destination address, ephemeral key bytes)
+RReqKey = Tuple[bytes, bytes, bytes]
+# (target address, requester's ephemeral key bytes)
+PendingKey = Tuple[bytes, bytes]
+HeldRequest = Tuple[Neighbour, RouteRequest]
 
 
 class MessagesForwarder:
@@ -25,24 +35,100 @@ class MessagesForwarder:
     router: Router
     broadcasters: Set[Connection]  # type: ignore
     neighbours: Set[Neighbour]
-    routes: Dict[Tuple[KnownNode, KnownNode], Tuple[Neighbour, Neighbour]]
-    directions: Dict[KnownNode, Neighbour]
+    routes: RouteTable
+    directions: ExpiringTable[KnownNode, Neighbour]
     pending_requests: Dict[Node, Set[Future[RRepInfo]]]
-    _requests_details: WeakKeyDictionary[Future[RRepInfo], RouteRequest]
+    # futures of the same request and neighbours it came from
+    _requests_index: Dict[PendingKey, Dict[Future[RRepInfo], Neighbour]]
+    # requests which wait for a request to the same target to be answered
+    _held_requests: Dict[Node, Dict[PendingKey, HeldRequest]]
+    seen_requests: SeenFilter[RReqKey]
+    verifier: Optional[BatchVerifier]
+    signature_cache: Optional[SignatureCache]
+    timers: TimerWheel
+    # enabled by metrics.instrument
+    metrics: Optional[ForwarderMetrics] = None
     RREQ_TIMEOUT: float = 10
+    SEEN_REQUESTS_CAPACITY: Optional[int] = 0x10000
+    ROUTES_CAPACITY: Optional[int] = 0x40000
+    ROUTE_IDLE_TIMEOUT: Optional[float] = 600
+    route_table_type: ClassVar[Type[RouteTable]] = RouteTable
+    RAW_VERIFY: bool = True
 
     def __init__(self, router: Router) -> None:
         self.router = router
         self.broadcasters = set()
         self.neighbours = {router}
-        self.routes = {(router, router): (router, router)}
-        self.directions = {router: router}
+        self.routes = self.route_table_type(
+            self.ROUTES_CAPACITY, self.ROUTE_IDLE_TIMEOUT
+        )
+        self.routes.pin((router, router), (router, router))
+        self.directions = ExpiringTable(
+            self.ROUTES_CAPACITY, self.ROUTE_IDLE_TIMEOUT
+        )
+        self.directions.pin(router, router)
         self.pending_requests = {}
-        self._requests_details = WeakKeyDictionary()
+        self._requests_index = {}
+        self._held_requests = {}
+        # duplicates are dropped for half of request's lifetime at least,
+        # later ones are deduplicated by pending requests
+        self.seen_requests = SeenFilter(
+            self.SEEN_REQUESTS_CAPACITY, self.RREQ_TIMEOUT / 2
+        )
+        self.verifier = None
+        self.signature_cache = SignatureCache()
+        self.timers = TimerWheel()
 
     def message_callback(self, source: Neighbour, msg: NetworkMessage) -> None:
-        if source != self.router and not msg.verify():
+        metrics = self.metrics
+        if metrics is not None:
+            received = metrics.received.get(type(msg))
+            if received is not None:
+                received.inc()
+        if source != self.router:
+            if self.verifier is not None:
+                self.verifier.submit(source, msg)
+                return
+            if not self.verify(msg):
+                if metrics is not None:
+                    metrics.verify_failures.inc()
+                return
+        self.dispatch(source, msg)
+
+    def verify(self, msg: NetworkMessage) -> bool:
+        if self.signature_cache is not None:
+            return self.signature_cache.verify(msg)
+        return msg.verify()
+
+    def verify_signed(
+        self,
+        MessageType: Type[NetworkMessage],
+        source: KnownNode,
+        signature: bytes,
+        data: bytes,
+    ) -> bool:
+        """
+        Verifies signature of message which is not decoded.
+        """
+        if self.signature_cache is not None:
+            return self.signature_cache.verify_signed(
+                MessageType, source.public_key, signature, data
+            )
+        return verify_signature(source.public_key, signature, data)
+
+    def dispatch(self, source: Neighbour, msg: NetworkMessage) -> None:
+        """
+        Passes verified message to its handler.
+        """
+        metrics = self.metrics
+        if metrics is None:
+            self._handle(source, msg)
             return
+        start = time.perf_counter()
+        self._handle(source, msg)
+        metrics.handled(type(msg), time.perf_counter() - start)
+
+    def _handle(self, source: Neighbour, msg: NetworkMessage) -> None:
         if isinstance(msg, NetworkData):
             self.handle_data(source, msg)
         elif isinstance(msg, RouteRequest):
@@ -54,6 +140,38 @@ class MessagesForwarder:
         else:
             raise TypeError
 
+    def frame_callback(
+        self, source: Neighbour, frame: Buffer, codec: DefaultCodec
+    ) -> None:
+        """
+        Handle encoded message.
+
+        NetworkData frames for already known routes are relayed to the next
+        hop as is. Signatures of such frames are checked only if `RAW_VERIFY`
+        is set. Any other frame is decoded and handled as usual.
+        """
+        src, dst, MessageType = codec.decode_head(frame)
+        if MessageType is NetworkData:
+            route_pair = codec.nodes.get(src), codec.nodes.get(dst)
+            directions = self.routes.get(route_pair)
+            if directions is not None and directions[1] is not self.router:
+                source_direction, destination_direction = directions
+                if source_direction != source:
+                    return
+                if self.RAW_VERIFY:
+                    signature, signed_data = codec.data_signature(frame)
+                    if not self.verify_signed(
+                        NetworkData, route_pair[0], signature, signed_data
+                    ):
+                        if self.metrics is not None:
+                            self.metrics.verify_failures.inc()
+                        return
+                destination_direction.send_raw(frame, codec)
+                if self.metrics is not None:
+                    self.metrics.raw_relayed.inc()
+                return
+        self.message_callback(source, codec.decode(frame))
+
     def handle_data(self, source: Neighbour, data: NetworkData) -> None:
         route_pair = data.source, data.destination
         directions = self.routes.get(route_pair)
@@ -61,6 +179,8 @@ class MessagesForwarder:
             rerr = RouteError(self.router, source, *route_pair)
             rerr.sign(self.router.private_key)
             source.send(rerr)
+            if self.metrics is not None:
+                self.metrics.rerr_emitted.inc()
             return
         source_direction, destination_direction = directions
         if source_direction == source:
@@ -68,67 +188,139 @@ class MessagesForwarder:
 
     def handle_rreq(self, source: Neighbour, request: RouteRequest) -> None:
         target = request.destination
-        if target in self.directions:
-            direction = self.directions[target]
-            direction.send(request)
+        key = (request.source.address, target.address, request.public_key_bytes)
+        if self.seen_requests.seen(key):
+            # the same request came by another path or is replayed
+            return
+        if target == self.router:
+            # route ends here, response will be sent back along it
+            requester = request.source
+            self.routes[(requester, self.router)] = (source, self.router)
+            self.routes[(self.router, requester)] = (self.router, source)
+            self.directions.setdefault(requester, source)
+            self.router.send(request)
+            return
+        direction = self.directions.get(target)  # type: ignore
+        if direction is not None:
+            self._propagate_rreq(source, request, (direction,))
         else:
             self._propagate_rreq(source, request)
 
     def handle_rrep(self, source: Neighbour, response: RouteResponse) -> None:
-        futures = self.pending_requests.get(response.source, EMPTY_SET)
-        to_remove = set()
-        for future in futures:
-            rreq = self._requests_details.get(future)
-            if rreq is None or rreq.public_key != response.requester_key:
-                # response not for this request
-                continue
-            to_remove.add(future)
-            future.set_result((source, response))
-        futures.difference_update(to_remove)
+        if source == self.router:
+            directions = self.routes.get((self.router, response.destination))
+            if directions is not None:
+                directions[1].send(response)
+            return
+        key = (response.source.address, response.requester_key_bytes)
+        waiters = self._requests_index.pop(key, None)
+        if waiters is None:
+            # response to unknown or expired request
+            return
+        for future in waiters:
+            if not future.done():
+                future.set_result((source, response))
+        # the same request may come by several paths if it is repeated,
+        # the first one is answered
+        back = next(iter(waiters.values()))
+        self._done_request(back, source, response)
 
     def handle_rerr(self, source: Neighbour, error: RouteError) -> None:
         src, dst = error.route_source, error.route_destination
         route_pair = (src, dst)
         directions = self.routes.get(route_pair)
         if directions and directions[1] == source:
-            self.routes.pop(route_pair)
+            self.routes.discard_pair(src, dst)
             source_direction = directions[0]
             source_direction.send(error)
-            if self.routes.get((dst, src)):
-                self.routes.pop((dst, src))
 
-    def _propagate_rreq(self, source: Neighbour, rreq: RouteRequest) -> None:
+    def _propagate_rreq(
+        self,
+        source: Neighbour,
+        rreq: RouteRequest,
+        directions: Optional[Iterable[Neighbour]] = None
+    ) -> None:
+        """
+        Sends request to `directions` (all neighbours by default) and waits
+        for response to it.
+        """
         target = rreq.destination
-        requests = self.pending_requests.setdefault(target, set())
         loop = asyncio.get_running_loop()
         future: Future[RRepInfo] = loop.create_future()
-        future.add_done_callback(self._done_request(target))
-        set_ttl(future, self.RREQ_TIMEOUT, self._forgot_rreq(rreq))
-        self._requests_details[future] = rreq
-        requests.add(future)
+        future.add_done_callback(
+            lambda future: self._discard_request(future, rreq)
+        )
+        set_ttl(
+            future, self.RREQ_TIMEOUT, self._forgot_rreq(rreq), self.timers
+        )
+        self.pending_requests.setdefault(target, set()).add(future)
+        key = (target.address, rreq.public_key_bytes)
+        self._requests_index.setdefault(key, {})[future] = source
         if self.is_unique_rreq(rreq, exclude=future):
-            for neighbour in self.neighbours:
-                if neighbour == source:
-                    continue
-                neighbour.send(rreq)
+            if directions is None:
+                directions = self.neighbours
+            self._send_rreq(source, rreq, directions)
+        else:
+            # sent once the target is found by the request being waited for
+            held = self._held_requests.setdefault(target, {})
+            held.setdefault(key, (source, rreq))
+
+    def _send_rreq(
+        self,
+        source: Neighbour,
+        rreq: RouteRequest,
+        directions: Iterable[Neighbour]
+    ) -> None:
+        sent = 0
+        for neighbour in directions:
+            if neighbour == source or neighbour == self.router:
+                continue
+            neighbour.send(rreq)
+            sent += 1
+        if self.metrics is not None:
+            self.metrics.rreq_propagated.inc()
+            self.metrics.rreq_fanout.inc(sent)
 
     def _forgot_rreq(
         self, rreq: RouteRequest
     ) -> Callable[[Future[RRepInfo]], None]:
         def callback(future: Future[RRepInfo]) -> None:
-            target = rreq.destination
-            futures = self.pending_requests.get(target, EMPTY_SET)
-            if future in futures:
-                futures.remove(future)
-                if not futures:
-                    self.pending_requests.pop(target)
+            self._discard_request(future, rreq)
+            if self.metrics is not None:
+                self.metrics.rreq_timeouts.inc()
         return callback
 
+    def _discard_request(
+        self, future: Future[RRepInfo], rreq: RouteRequest
+    ) -> None:
+        """
+        Removes future of request from pending requests and their index.
+        """
+        target = rreq.destination
+        futures = self.pending_requests.get(target)
+        if futures is not None:
+            futures.discard(future)
+            if not futures:
+                del self.pending_requests[target]
+                self._held_requests.pop(target, None)
+        key = (target.address, rreq.public_key_bytes)
+        waiters = self._requests_index.get(key)
+        if waiters is not None:
+            waiters.pop(future, None)
+            if not waiters:
+                del self._requests_index[key]
+                held = self._held_requests.get(target)
+                if held is not None:
+                    held.pop(key, None)
+
     def is_unique_rreq(
         self, rreq: RouteRequest, exclude: Optional[Future[RRepInfo]] = None
     ) -> bool:
-        target = rreq.destination
-        requests = self.pending_requests.get(target)
+        """
+        Tells whether there is no other request for the same target waiting
+        for response.
+        """
+        requests = self.pending_requests.get(rreq.destination)
         if not requests:
             # there is no requests for target
             return True
@@ -138,26 +330,33 @@ class MessagesForwarder:
         return False
 
     def _done_request(
-        self, target: Node
-    ) -> Callable[[Future[RRepInfo]], None]:
-        def callback(future: Future[RRepInfo]) -> None:
-            futures = self.pending_requests.get(target, EMPTY_SET)
-            if future in futures:
-                futures.remove(future)
-            if future.cancelled() or future.exception():
-                return
-            result = future.result()
-            direction, response = result
-            directions = (direction, direction)
-            self.routes[(response.destination, response.source)] = directions
-            self.routes[(response.source, response.destination)] = directions
-            self.directions.setdefault(response.source, direction)
-            for future in futures:
-                future.set_result(result)
-            for neighbour in self.neighbours:
-                if neighbour != direction:
-                    neighbour.send(response)
-        return callback
+        self, back: Neighbour, direction: Neighbour, response: RouteResponse
+    ) -> None:
+        """
+        Sets route between requester (request came from `back`) and its
+        target (response came from `direction`) and sends response back
+        along request's path. Requests held for the same target are sent
+        towards it.
+        """
+        requester, responder = response.destination, response.source
+        self.routes[(requester, responder)] = (back, direction)
+        self.routes[(responder, requester)] = (direction, back)
+        self.directions.setdefault(responder, direction)
+        back.send(response)
+        held = self._held_requests.pop(responder, None)
+        if held is None:
+            return
+        for source, rreq in held.values():
+            self._send_rreq(source, rreq, (direction,))
+
+
+class IndexedMessagesForwarder(MessagesForwarder):
+    """
+    Forwarder with compact integer-indexed route table. Pass it to Router as
+    `forwarder_factory` on relays which hold lots of routes.
+    """
+
+    route_table_type = IndexedRouteTable
 
 
 T = TypeVar("T")
@@ -166,18 +365,28 @@ T = TypeVar("T")
 def set_ttl(
     future: Future[T],
     ttl: float,
-    callback: Optional[Callable[[Future[T]], None]] = None
-) -> asyncio.TimerHandle:
+    callback: Optional[Callable[[Future[T]], None]] = None,
+    wheel: Optional[TimerWheel] = None
+) -> Union[asyncio.TimerHandle, Timer]:
+    """
+    Cancels future if it is not done in `ttl` seconds.
+    Timer is scheduled in `wheel` if it is given and cancelled as soon as
+    future is done.
+    """
 
     def kill() -> None:
+        if future.done():
+            return
         if callback is not None:
             callback(future)
-        if not future.done():
-            return
-        future.set_exception(
-            TimeoutError(f"Future {future} killed due to TTL expiration.")
-        )
+        # nothing awaits relayed requests, an exception would be unretrieved
+        future.cancel()
 
-    loop = asyncio.get_running_loop()
-    handle = loop.call_later(ttl, kill)
+    handle: Union[asyncio.TimerHandle, Timer]
+    if wheel is not None:
+        handle = wheel.call_later(ttl, kill)
+    else:
+        loop = asyncio.get_running_loop()
+        handle = loop.call_later(ttl, kill)
+    future.add_done_callback(lambda _: handle.cancel())
     return handle
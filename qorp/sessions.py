@@ -0,0 +1,222 @@
+"""
+End-to-end sessions of router.
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+import time
+from dataclasses import dataclass, field
+
+from typing import Dict, Optional
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .messages import RouteResponse
+
+from .encryption import ChaCha20Poly1305
+from .nodes import KnownNode
+from .tables import ExpiringTable
+
+
+# 4-byte per-session prefix and 8-byte counter
+NONCE = struct.Struct("!4sQ")
+NONCE_PREFIX_LENGTH = 4
+MAX_COUNTER = (1 << 64) - 1
+# top bit of prefix tells which side of session sent the packet, so both
+# sides never use the same nonce with shared key
+INITIATOR_BIT = 0x80
+
+
+def nonce_counter(nonce: bytes) -> int:
+    """
+    Extracts counter from nonce built by SessionInfo.next_nonce.
+    """
+    return int.from_bytes(nonce[NONCE_PREFIX_LENGTH:], "big")
+
+
+class ReplayWindow:
+    """
+    Sliding window replay filter over packet counters.
+
+    Window remembers which of the last `size` counters were received as bits
+    of single integer. Counters older than window are rejected.
+    """
+
+    __slots__ = ("size", "highest", "_bitmap")
+
+    size: int
+    highest: int
+    _bitmap: int
+
+    def __init__(self, size: int = 1024) -> None:
+        self.size = size
+        self.highest = -1
+        self._bitmap = 0
+
+    def check(self, counter: int) -> bool:
+        """
+        Tells whether counter may be accepted without marking it.
+        It is cheap enough to be called before decryption.
+        """
+        if counter > self.highest:
+            return True
+        offset = self.highest - counter
+        return offset < self.size and not self._bitmap >> offset & 1
+
+    def accept(self, counter: int) -> bool:
+        """
+        Marks counter as received. Returns False if it is a replay or too old.
+        Must be called only for authenticated packets.
+        """
+        if counter > self.highest:
+            shift = counter - self.highest
+            if shift >= self.size:
+                self._bitmap = 1
+            else:
+                mask = (1 << self.size) - 1
+                self._bitmap = (self._bitmap << shift | 1) & mask
+            self.highest = counter
+            return True
+        offset = self.highest - counter
+        if offset >= self.size or self._bitmap >> offset & 1:
+            return False
+        self._bitmap |= 1 << offset
+        return True
+
+
+@dataclass
+class SessionInfo:
+    """
+    Encryption state of session with remote node.
+
+    Nonces are built from random per-session prefix and counter of sent
+    packets, so no entropy is needed per packet.
+    """
+
+    key: ChaCha20Poly1305
+    initiator: bool = False
+    counter: int = field(init=False, default=0)
+    created: float = field(init=False, repr=False)
+    prefix: bytes = field(init=False, repr=False)
+    replay: ReplayWindow = field(init=False, repr=False)
+    # replaced session, its packets may still be in flight after rekeying
+    previous: Optional[SessionInfo] = field(
+        init=False, default=None, repr=False
+    )
+    # peer is known to have the key: initiator gets it from response,
+    # responder once a packet encrypted with it is received
+    confirmed: bool = field(init=False, repr=False)
+    # responder's signed response, repeated request is answered with it
+    response: Optional[RouteResponse] = field(
+        init=False, default=None, repr=False
+    )
+
+    def __post_init__(self) -> None:
+        self.created = time.monotonic()
+        prefix = bytearray(os.urandom(NONCE_PREFIX_LENGTH))
+        if self.initiator:
+            prefix[0] |= INITIATOR_BIT
+        else:
+            prefix[0] &= ~INITIATOR_BIT
+        self.prefix = bytes(prefix)
+        self.replay = ReplayWindow()
+        self.confirmed = self.initiator
+
+    def next_nonce(self) -> bytes:
+        counter = self.counter
+        if counter > MAX_COUNTER:
+            raise OverflowError("Session nonces are exhausted, rekey it")
+        self.counter = counter + 1
+        return NONCE.pack(self.prefix, counter)
+
+
+class SessionTable(ExpiringTable[KnownNode, SessionInfo]):
+    """
+    Router's sessions by remote node.
+
+    Sessions unused for `ttl` seconds are forgotten, least recently used ones
+    are evicted when there are more than `capacity` of them. Session should
+    be rekeyed after `rekey_packets` sent packets or `rekey_interval`
+    seconds since it was established. New session of the same node keeps
+    the replaced one as `previous` for `rekey_grace` seconds to handle
+    packets sent before rekeying.
+    """
+
+    rekey_packets: Optional[int]
+    rekey_interval: Optional[float]
+    rekey_grace: float
+    rekeyed: int
+
+    def __init__(
+        self,
+        capacity: Optional[int] = 4096,
+        ttl: Optional[float] = 600,
+        rekey_packets: Optional[int] = 1 << 32,
+        rekey_interval: Optional[float] = 3600,
+        rekey_grace: float = 30,
+    ) -> None:
+        super().__init__(capacity, ttl)
+        self.rekey_packets = rekey_packets
+        self.rekey_interval = rekey_interval
+        self.rekey_grace = rekey_grace
+        self.rekeyed = 0
+
+    def __setitem__(self, key: KnownNode, value: SessionInfo) -> None:
+        entry = self._entries.get(key)
+        if entry is not None and entry.value is not value:
+            self.rekeyed += 1
+            value.previous = entry.value
+            entry.value.previous = None
+        super().__setitem__(key, value)
+
+    def previous(self, session: SessionInfo) -> Optional[SessionInfo]:
+        """
+        Returns session replaced by `session` until its grace period ends.
+        """
+        previous = session.previous
+        if previous is None:
+            return None
+        if time.monotonic() - session.created >= self.rekey_grace:
+            session.previous = None
+            return None
+        return previous
+
+    def sending(self, session: SessionInfo) -> SessionInfo:
+        """
+        Returns session to encrypt packets to its node with. Responder keeps
+        using replaced session until the peer is seen using the new one, but
+        not beyond `rekey_packets` of the replaced session.
+        """
+        if not session.confirmed:
+            previous = self.previous(session)
+            if previous is not None and (
+                self.rekey_packets is None
+                or previous.counter < self.rekey_packets
+            ):
+                return previous
+        return session
+
+    def needs_rekey(self, session: SessionInfo) -> bool:
+        """
+        Tells whether current session of node should be replaced. It is
+        checked rather than session returned by `sending`: if they differ,
+        the replacement is established already and only waits for the peer,
+        while packets of the replaced one are bounded by `sending` itself.
+        """
+        if self.rekey_packets is not None:
+            if session.counter >= self.rekey_packets:
+                return True
+        if self.rekey_interval is not None:
+            if time.monotonic() - session.created >= self.rekey_interval:
+                return True
+        return False
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "live": len(self),
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "rekeyed": self.rekeyed,
+        }
@@ -0,0 +1,574 @@
+"""
+In-process simulation of large networks of routers.
+
+All routers of simulated network run in one event loop and are linked by
+in-memory links with configurable latency, jitter, loss and bandwidth.
+Topology is given as list of edges between nodes' indices, generators of
+common topologies are provided. Simulation is deterministic for the same
+seed as far as event loop scheduling is: nodes' keys, topology and losses
+on each link are derived from seed.
+
+Example:
+
+    simulation = Simulation(400, grid(20, 20), LinkConfig(latency=0.002))
+    result = await simulation.discover(simulation.random_pairs(50))
+    print(result, simulation.report())
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import random
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from typing import Sequence, Set, Tuple, Union
+
+from .codecs import DEFAULT_CODEC, MessagesCodec
+from .encryption import Ed25519PrivateKey
+from .frontend import Frontend
+from .messages import FrontendData, NetworkData, NetworkMessage
+from .nodes import Neighbour, Node
+from .router import Router
+from .routing import MessagesForwarder
+from .transports import Connection
+
+
+Edge = Tuple[int, int]
+Number = Union[int, float]
+
+# churn actions
+LINK_DOWN = "link-down"
+LINK_UP = "link-up"
+NODE_DOWN = "node-down"
+NODE_UP = "node-up"
+ACTIONS = (LINK_DOWN, LINK_UP, NODE_DOWN, NODE_UP)
+
+
+def grid(width: int, height: int) -> List[Edge]:
+    """
+    Rectangular grid, node (x, y) has index y*width + x.
+    """
+    edges = []
+    for y in range(height):
+        for x in range(width):
+            node = y*width + x
+            if x + 1 < width:
+                edges.append((node, node + 1))
+            if y + 1 < height:
+                edges.append((node, node + width))
+    return edges
+
+
+def random_geometric(count: int, radius: float, seed: int = 0) -> List[Edge]:
+    """
+    Nodes placed uniformly in unit square, linked if they are closer than
+    `radius`. Network is not guaranteed to be connected.
+    """
+    rng = random.Random(seed)
+    points = [(rng.random(), rng.random()) for _ in range(count)]
+    cells: Dict[Tuple[int, int], List[int]] = {}
+    for node, (x, y) in enumerate(points):
+        cells.setdefault((int(x / radius), int(y / radius)), []).append(node)
+    edges = []
+    for node, (x, y) in enumerate(points):
+        cell_x, cell_y = int(x / radius), int(y / radius)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other in cells.get((cell_x + dx, cell_y + dy), ()):
+                    if other <= node:
+                        continue
+                    other_x, other_y = points[other]
+                    if math.hypot(x - other_x, y - other_y) < radius:
+                        edges.append((node, other))
+    return edges
+
+
+def scale_free(count: int, links: int = 2, seed: int = 0) -> List[Edge]:
+    """
+    Barabási–Albert network: each new node is linked to `links` existing
+    nodes chosen with probability proportional to their degree.
+    """
+    if not 1 <= links < count:
+        raise ValueError("Count of links must be in [1, count)")
+    rng = random.Random(seed)
+    edges = [(node, links) for node in range(links)]
+    # every node appears here once per its link
+    ends = [node for edge in edges for node in edge]
+    for node in range(links + 1, count):
+        targets: Set[int] = set()
+        while len(targets) < links:
+            targets.add(rng.choice(ends))
+        for target in sorted(targets):
+            edges.append((target, node))
+            ends += (target, node)
+    return edges
+
+
+def read_edge_list(lines: Iterable[str]) -> List[Edge]:
+    """
+    Parses edge list with pair of node indices per line. Empty lines and
+    text after '#' are ignored.
+    """
+    edges = []
+    for number, line in enumerate(lines, 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        fields = line.split()
+        if len(fields) != 2:
+            raise ValueError(f"Line {number}: expected two node indices")
+        first, second = map(int, fields)
+        edges.append((first, second))
+    return edges
+
+
+def _edge_key(first: int, second: int) -> Edge:
+    """
+    Returns the same key for both directions of undirected edge.
+    """
+    return (first, second) if first < second else (second, first)
+
+
+@dataclass(frozen=True)
+class LinkConfig:
+    """
+    Properties of link, the same in both directions.
+
+    Delay of message is `latency` plus random jitter up to `jitter` seconds
+    plus time of its transmission if `bandwidth` (bits per second) is set.
+    Each message is lost with probability `loss`.
+    """
+
+    latency: float = 0.001
+    jitter: float = 0.0
+    loss: float = 0.0
+    bandwidth: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class ChurnEvent:
+    """
+    Change of network `at` seconds after events are scheduled. Link
+    actions need `peer`, node actions affect all links of `node`.
+    """
+
+    at: float
+    action: str
+    node: int
+    peer: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        if self.action not in ACTIONS:
+            raise ValueError(f"Unknown churn action: {self.action}")
+        if self.action in (LINK_DOWN, LINK_UP) and self.peer is None:
+            raise ValueError("Link action needs a peer")
+
+
+class TrafficStats:
+    """
+    Messages and bytes sent over all links by message type.
+    """
+
+    messages: Dict[str, int]
+    bytes: Dict[str, int]
+    lost: int
+
+    def __init__(self) -> None:
+        self.messages = {}
+        self.bytes = {}
+        self.lost = 0
+
+    @property
+    def control_messages(self) -> int:
+        return sum(
+            count for name, count in self.messages.items()
+            if name != NetworkData.__name__
+        )
+
+    @property
+    def control_bytes(self) -> int:
+        return sum(
+            size for name, size in self.bytes.items()
+            if name != NetworkData.__name__
+        )
+
+    def record(self, message: NetworkMessage, size: int) -> None:
+        name = type(message).__name__
+        self.messages[name] = self.messages.get(name, 0) + 1
+        self.bytes[name] = self.bytes.get(name, 0) + size
+
+    def as_dict(self) -> Dict[str, int]:
+        result = {
+            "control_messages": self.control_messages,
+            "control_bytes": self.control_bytes,
+            "lost": self.lost,
+        }
+        for name, count in self.messages.items():
+            result[f"{name}_messages"] = count
+            result[f"{name}_bytes"] = self.bytes[name]
+        return result
+
+
+class LinkProtocol:
+    """
+    Protocol of simulated links, address is index of peer node.
+    Links can't be connected or listened, they are made by Simulation.
+    """
+
+    alias = "simulated"
+
+    def __init__(self, address: int) -> None:
+        self.address = address
+
+
+class SimulatedConnection(Connection[LinkProtocol, bytes]):  # type: ignore
+    """
+    One direction of simulated link. Messages are passed to `receiver`
+    after link's delay. Messages sent while link is down are lost.
+    """
+
+    config: LinkConfig
+    receiver: Callable[[NetworkMessage], None]
+    traffic: TrafficStats
+    up: bool
+    _rng: random.Random
+    _busy_until: float
+
+    def __init__(
+        self,
+        protocol: LinkProtocol,
+        config: LinkConfig,
+        receiver: Callable[[NetworkMessage], None],
+        traffic: TrafficStats,
+        rng: random.Random,
+        codec: MessagesCodec[bytes] = DEFAULT_CODEC,
+    ) -> None:
+        self.protocol = protocol
+        self.codec = codec
+        self.config = config
+        self.receiver = receiver
+        self.traffic = traffic
+        self.up = True
+        self._rng = rng
+        self._busy_until = 0.0
+
+    def send(self, message: NetworkMessage) -> None:
+        config = self.config
+        size = len(self.codec.encode(message))
+        self.traffic.record(message, size)
+        if not self.up or config.loss and self._rng.random() < config.loss:
+            self.traffic.lost += 1
+            return
+        loop = asyncio.get_running_loop()
+        delay = config.latency
+        if config.jitter:
+            delay += self._rng.uniform(0, config.jitter)
+        if config.bandwidth:
+            now = loop.time()
+            start = max(now, self._busy_until)
+            self._busy_until = start + size * 8 / config.bandwidth
+            delay += self._busy_until - now
+        loop.call_later(delay, self._deliver, message)
+
+    def callback(self, message: NetworkMessage) -> None:
+        self.receiver(message)
+
+    def _deliver(self, message: NetworkMessage) -> None:
+        if not self.up:
+            self.traffic.lost += 1
+            return
+        self.callback(message)
+
+
+class Link:
+    """
+    Bidirectional link between two routers.
+    """
+
+    __slots__ = ("ends", "neighbours", "connections")
+
+    ends: Tuple[Router, Router]
+    # each end as neighbour of the other one
+    neighbours: Tuple[Neighbour, Neighbour]
+    connections: Tuple[SimulatedConnection, SimulatedConnection]
+
+    def __init__(
+        self,
+        ends: Tuple[Router, Router],
+        neighbours: Tuple[Neighbour, Neighbour],
+        connections: Tuple[SimulatedConnection, SimulatedConnection],
+    ) -> None:
+        self.ends = ends
+        self.neighbours = neighbours
+        self.connections = connections
+
+    @property
+    def up(self) -> bool:
+        return self.connections[0].up
+
+    def set_up(self, up: bool) -> None:
+        """
+        Brings link up or down. Routers learn about it at once: neighbour
+        is added to or removed from their forwarders.
+        """
+        if up == self.up:
+            return
+        for connection in self.connections:
+            connection.up = up
+        first, second = self.ends
+        first_neighbour, second_neighbour = self.neighbours
+        if up:
+            first.forwarder.neighbours.add(second_neighbour)
+            second.forwarder.neighbours.add(first_neighbour)
+        else:
+            first.forwarder.neighbours.discard(second_neighbour)
+            second.forwarder.neighbours.discard(first_neighbour)
+            for neighbour in self.neighbours:
+                if neighbour.has_queue:
+                    neighbour.queue.clear()
+
+
+class SimulationFrontend(Frontend):
+    """
+    Frontend which remembers when data from each source arrived last.
+    """
+
+    arrivals: Dict[Node, float]
+    received: int
+
+    def __init__(self, router: Router) -> None:
+        self.router = router
+        self.arrivals = {}
+        self.received = 0
+
+    def message_callback(self, message: FrontendData) -> None:
+        self.received += 1
+        self.arrivals[message.source] = asyncio.get_running_loop().time()
+
+
+class Simulation:
+    """
+    Network of `count` routers linked by `edges` of node indices.
+
+    `link` is config of all links or function returning config of link by
+    its edge. If `trace_memory` is set, memory allocated by the network while
+    it is built and still held after each discovery is traced, which slows
+    them down.
+    """
+
+    routers: List[Router]
+    # links by edges with the lesser index first
+    links: Dict[Edge, Link]
+    traffic: TrafficStats
+    seed: int
+    down: Set[int]
+    memory: Optional[int]
+    _rng: random.Random
+
+    def __init__(
+        self,
+        count: int,
+        edges: Iterable[Edge],
+        link: Union[LinkConfig, Callable[[Edge], LinkConfig]] = LinkConfig(),
+        seed: int = 0,
+        forwarder_factory: Callable[[Router], MessagesForwarder] = MessagesForwarder,
+        trace_memory: bool = False,
+    ) -> None:
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self.traffic = TrafficStats()
+        self.down = set()
+        self.memory = 0 if trace_memory else None
+        self.links = {}
+        self.routers = []
+        with self._traced():
+            for _ in range(count):
+                raw_key = self._rng.getrandbits(256).to_bytes(32, "big")
+                private_key = Ed25519PrivateKey.from_private_bytes(raw_key)
+                self.routers.append(Router(
+                    private_key,
+                    frontend_factory=SimulationFrontend,
+                    forwarder_factory=forwarder_factory,
+                ))
+            for index, edge in enumerate(edges):
+                config = link if isinstance(link, LinkConfig) else link(edge)
+                self._link(index, edge, config)
+
+    def __len__(self) -> int:
+        return len(self.routers)
+
+    def random_pairs(self, count: int) -> List[Edge]:
+        """
+        Returns `count` random (source, destination) pairs of nodes.
+        """
+        nodes = range(len(self.routers))
+        pairs = []
+        for _ in range(count):
+            source, destination = self._rng.sample(nodes, 2)
+            pairs.append((source, destination))
+        return pairs
+
+    async def discover(
+        self,
+        pairs: Sequence[Edge],
+        payload: bytes = b"\x00",
+        timeout: float = 10,
+    ) -> Dict[str, Number]:
+        """
+        Sends data from source to destination of each pair and waits until
+        it is delivered or `timeout` passes. Routes are discovered on the
+        way. Returns count of delivered messages, time of convergence (until
+        the last delivery) and control traffic it took. Routes, sessions and
+        other state left by discovery are added to traced `memory`.
+        """
+        with self._traced():
+            return await self._discover(pairs, payload, timeout)
+
+    async def _discover(
+        self, pairs: Sequence[Edge], payload: bytes, timeout: float
+    ) -> Dict[str, Number]:
+        loop = asyncio.get_running_loop()
+        control_before = self.traffic.control_messages
+        control_bytes_before = self.traffic.control_bytes
+        start = loop.time()
+        for source, destination in pairs:
+            router, target = self.routers[source], self.routers[destination]
+            router.send(FrontendData(router, target, payload))
+
+        def arrivals() -> List[float]:
+            result = []
+            for source, destination in pairs:
+                frontend = self.routers[destination].frontend
+                assert isinstance(frontend, SimulationFrontend)
+                arrival = frontend.arrivals.get(self.routers[source])
+                if arrival is not None and arrival >= start:
+                    result.append(arrival)
+            return result
+
+        deadline = start + timeout
+        while len(arrivals()) < len(pairs) and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        delivered = arrivals()
+        control = self.traffic.control_messages - control_before
+        return {
+            "requested": len(pairs),
+            "delivered": len(delivered),
+            "convergence": max(delivered, default=start) - start,
+            "control_messages": control,
+            "control_bytes": self.traffic.control_bytes - control_bytes_before,
+            "control_per_route": control / len(pairs) if pairs else 0,
+        }
+
+    def schedule(self, events: Iterable[ChurnEvent]) -> None:
+        """
+        Schedules churn events relative to current time.
+        """
+        loop = asyncio.get_running_loop()
+        for event in events:
+            loop.call_later(event.at, self.apply, event)
+
+    def apply(self, event: ChurnEvent) -> None:
+        if event.action == NODE_DOWN:
+            self.set_node_up(event.node, False)
+        elif event.action == NODE_UP:
+            self.set_node_up(event.node, True)
+        else:
+            assert event.peer is not None
+            self.set_link_up(event.node, event.peer, event.action == LINK_UP)
+
+    def set_link_up(self, first: int, second: int, up: bool) -> None:
+        link = self.links[_edge_key(first, second)]
+        if up and (first in self.down or second in self.down):
+            return
+        link.set_up(up)
+
+    def set_node_up(self, node: int, up: bool) -> None:
+        if up:
+            self.down.discard(node)
+        else:
+            self.down.add(node)
+        for (first, second), link in self.links.items():
+            if node not in (first, second):
+                continue
+            if up and (first in self.down or second in self.down):
+                continue
+            link.set_up(up)
+
+    def report(self) -> Dict[str, Number]:
+        """
+        Returns state of network and traffic sent so far.
+        """
+        count = len(self.routers)
+        result: Dict[str, Number] = {
+            "nodes": count,
+            "nodes_down": len(self.down),
+            "links": len(self.links),
+            "links_up": sum(link.up for link in self.links.values()),
+            "routes_per_node": sum(
+                len(router.forwarder.routes) - 1 for router in self.routers
+            ) / count,
+            "sessions": sum(len(router.sessions) for router in self.routers),
+        }
+        if self.memory is not None:
+            result["bytes_per_node"] = self.memory / count
+        result.update(self.traffic.as_dict())
+        return result
+
+    @contextmanager
+    def _traced(self) -> Iterator[None]:
+        """
+        Adds memory allocated in the block and still held after it to
+        `memory` if it is traced.
+        """
+        if self.memory is None:
+            yield
+            return
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            after, _ = tracemalloc.get_traced_memory()
+            if started:
+                tracemalloc.stop()
+            self.memory += after - before
+
+    def _link(self, index: int, edge: Edge, config: LinkConfig) -> None:
+        first_index, second_index = edge
+        key = _edge_key(first_index, second_index)
+        if first_index == second_index or key in self.links:
+            raise ValueError(f"Invalid or repeated edge: {edge}")
+        first, second = self.routers[first_index], self.routers[second_index]
+        # each end as seen by the other one
+        first_neighbour = Neighbour(first.public_key)
+        second_neighbour = Neighbour(second.public_key)
+        # losses of each link don't depend on traffic of others
+        rng = random.Random(f"{self.seed}:{index}")
+        to_second = SimulatedConnection(
+            LinkProtocol(second_index), config,
+            lambda message: second.forwarder.message_callback(
+                first_neighbour, message
+            ),
+            self.traffic, rng,
+        )
+        to_first = SimulatedConnection(
+            LinkProtocol(first_index), config,
+            lambda message: first.forwarder.message_callback(
+                second_neighbour, message
+            ),
+            self.traffic, rng,
+        )
+        second_neighbour.connections.append(to_second)
+        first_neighbour.connections.append(to_first)
+        first.forwarder.neighbours.add(second_neighbour)
+        second.forwarder.neighbours.add(first_neighbour)
+        self.links[key] = Link(
+            (first, second), (first_neighbour, second_neighbour),
+            (to_first, to_second),
+        )
@@ -0,0 +1,502 @@
+"""
+Stream transports (TCP and Unix sockets).
+
+Each message is sent as a frame: 4-byte big-endian length of encoded message
+followed by message itself.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import socket
+import struct
+from abc import abstractmethod
+
+from typing import Callable, Iterable, List, Optional, Tuple, TypeVar
+
+from .codecs import DEFAULT_CODEC, MessagesCodec
+from .messages import Buffer
+from .transports import Connection, Protocol, Server
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .messages import NetworkMessage
+
+
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_LENGTH = 0x20000
+READ_BUFFER_SIZE = 0x40000
+# smoothed RTT in microseconds within Linux `struct tcp_info`
+TCP_INFO_RTT = struct.Struct("=I")
+TCP_INFO_RTT_OFFSET = 68
+TCP_INFO_SIZE = 104
+# seconds between RTT samples of TCP connection
+RTT_SAMPLE_INTERVAL = 1.0
+
+Address = TypeVar("Address")
+
+
+def tcp_rtt(sock: Optional[socket.socket]) -> Optional[float]:
+    """
+    Returns kernel's smoothed RTT estimate of TCP socket in seconds or None
+    if it is unknown or unavailable (not Linux, not TCP socket).
+    """
+    option = getattr(socket, "TCP_INFO", None)
+    if option is None or sock is None:
+        return None
+    if sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, option, TCP_INFO_SIZE)
+    except OSError:
+        return None
+    if len(info) < TCP_INFO_RTT_OFFSET + TCP_INFO_RTT.size:
+        return None
+    rtt, = TCP_INFO_RTT.unpack_from(info, TCP_INFO_RTT_OFFSET)
+    return rtt / 1e6 if rtt else None
+
+
+class StreamProtocol(Protocol[Address, bytes]):
+    """
+    Base class for protocols which transfer messages over byte streams.
+    """
+
+    def connect(
+        self, codec: MessagesCodec[bytes] = DEFAULT_CODEC
+    ) -> StreamConnection:
+        """
+        Opens connection to protocol's address.
+
+        Connection is opened in background, messages sent before it is
+        opened will be written as soon as it happens.
+        """
+        connection = StreamConnection(self, codec)
+        loop = asyncio.get_running_loop()
+        loop.create_task(connection._open())
+        return connection
+
+    def listen(
+        self,
+        callback: Callable[[Address, Connection[StreamProtocol[Address], bytes]], None],
+        codec: MessagesCodec[bytes] = DEFAULT_CODEC
+    ) -> StreamServer[Address]:
+        """
+        Starts to accept connections on protocol's address.
+        """
+        server = StreamServer(self, callback, codec)
+        loop = asyncio.get_running_loop()
+        loop.create_task(server._start())
+        return server
+
+    @abstractmethod
+    async def open_transport(
+        self, factory: Callable[[], asyncio.BaseProtocol]
+    ) -> asyncio.BaseTransport:
+        pass
+
+    @abstractmethod
+    async def start_server(
+        self, factory: Callable[[], asyncio.BaseProtocol]
+    ) -> asyncio.AbstractServer:
+        pass
+
+
+class TCPProtocol(StreamProtocol[Tuple[str, int]]):
+
+    alias = "tcp"
+
+    def __init__(self, host: str, port: int) -> None:
+        self.address = (host, port)
+
+    async def open_transport(
+        self, factory: Callable[[], asyncio.BaseProtocol]
+    ) -> asyncio.BaseTransport:
+        loop = asyncio.get_running_loop()
+        host, port = self.address
+        transport, _ = await loop.create_connection(factory, host, port)
+        return transport
+
+    async def start_server(
+        self, factory: Callable[[], asyncio.BaseProtocol]
+    ) -> asyncio.AbstractServer:
+        loop = asyncio.get_running_loop()
+        host, port = self.address
+        return await loop.create_server(factory, host, port)
+
+
+class UnixProtocol(StreamProtocol[str]):
+
+    alias = "unix"
+
+    def __init__(self, path: str) -> None:
+        self.address = path
+
+    async def open_transport(
+        self, factory: Callable[[], asyncio.BaseProtocol]
+    ) -> asyncio.BaseTransport:
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_unix_connection(factory, self.address)
+        return transport
+
+    async def start_server(
+        self, factory: Callable[[], asyncio.BaseProtocol]
+    ) -> asyncio.AbstractServer:
+        loop = asyncio.get_running_loop()
+        return await loop.create_unix_server(factory, self.address)
+
+
+class StreamConnection(Connection[StreamProtocol, bytes]):  # type: ignore
+    """
+    Connection over stream transport.
+
+    Frames sent during one event loop iteration are written with single
+    `writelines` call. `send` never blocks, producers which care about
+    backpressure should await `drain` between sends.
+
+    Received messages are passed to `handler`. If `raw_handler` is set, it
+    gets encoded messages instead and no decoding happens. Frames which
+    can't be decoded are counted in `malformed` and skipped.
+
+    `rtt` of TCP connections is kernel's estimate sampled at most once per
+    `RTT_SAMPLE_INTERVAL` seconds while connection sends data.
+    """
+
+    handler: Optional[Callable[[NetworkMessage], None]]
+    raw_handler: Optional[Callable[[bytes], None]]
+    closed: bool
+    _transport: Optional[asyncio.WriteTransport]
+    _outbox: List[Buffer]
+    _outbox_size: int
+    _flush_scheduled: bool
+    _paused: bool
+    _drain_waiters: List[asyncio.Future[None]]
+    _opened: Optional[asyncio.Future[None]]
+    _next_rtt_sample: float
+    frames_sent: int
+    bytes_sent: int
+    frames_received: int
+    bytes_received: int
+    malformed: int
+
+    def __init__(
+        self,
+        protocol: StreamProtocol,  # type: ignore
+        codec: MessagesCodec[bytes],
+        handler: Optional[Callable[[NetworkMessage], None]] = None,
+    ) -> None:
+        self.protocol = protocol
+        self.codec = codec
+        self.handler = handler
+        self.raw_handler = None
+        self.closed = False
+        self._transport = None
+        self._outbox = []
+        self._outbox_size = 0
+        self._flush_scheduled = False
+        self._paused = False
+        self._drain_waiters = []
+        self._opened = None
+        self._next_rtt_sample = 0.0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.malformed = 0
+
+    @property
+    def pending(self) -> int:
+        """
+        Count of bytes which are sent but not written to socket yet.
+        """
+        size = self._outbox_size
+        if self._transport is not None:
+            size += self._transport.get_write_buffer_size()
+        return size
+
+    def send(self, message: NetworkMessage) -> None:
+        self._write(self.codec.encode(message))
+
+    def send_raw(self, frame: Buffer, codec: MessagesCodec[bytes]) -> None:
+        if codec is self.codec:
+            self._write(frame)
+        else:
+            super().send_raw(bytes(frame), codec)
+
+    def callback(self, message: NetworkMessage) -> None:
+        if self.handler is not None:
+            self.handler(message)
+
+    async def opened(self) -> None:
+        """
+        Waits until connection is opened.
+        """
+        await self._opened_future()
+
+    async def drain(self) -> None:
+        """
+        Waits until transport's write buffer is flushed below high-water mark.
+        """
+        if self.closed:
+            raise ConnectionResetError("Connection is closed")
+        if not self._paused:
+            return
+        loop = asyncio.get_running_loop()
+        waiter: asyncio.Future[None] = loop.create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+        self._connection_lost(None)
+
+    async def _open(self) -> None:
+        opened = self._opened_future()
+        try:
+            await self.protocol.open_transport(lambda: FramedStream(self))
+        except OSError as exc:
+            self._connection_lost(exc)
+            if not opened.done():
+                opened.set_exception(exc)
+
+    def _opened_future(self) -> asyncio.Future[None]:
+        if self._opened is None:
+            loop = asyncio.get_running_loop()
+            self._opened = loop.create_future()
+        return self._opened
+
+    def _connection_made(self, transport: asyncio.WriteTransport) -> None:
+        self._transport = transport
+        opened = self._opened_future()
+        if not opened.done():
+            opened.set_result(None)
+        if self._outbox:
+            self._flush()
+
+    def _connection_lost(self, exc: Optional[Exception]) -> None:
+        self.closed = True
+        self._transport = None
+        self._outbox.clear()
+        self._outbox_size = 0
+        self._wake_drain_waiters(exc or ConnectionResetError("Connection lost"))
+
+    def _write(self, frame: Buffer) -> None:
+        if self.closed:
+            raise ConnectionResetError("Connection is closed")
+        if len(frame) > MAX_FRAME_LENGTH:
+            raise ValueError(f"Frame is too long: {len(frame)} bytes")
+        self._outbox.append(FRAME_HEADER.pack(len(frame)))
+        self._outbox.append(frame)
+        self._outbox_size += FRAME_HEADER.size + len(frame)
+        if not self._flush_scheduled and self._transport is not None:
+            self._flush_scheduled = True
+            loop = asyncio.get_running_loop()
+            loop.call_soon(self._flush)
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        if self._transport is None or not self._outbox:
+            return
+        outbox = self._outbox
+        self._outbox = []
+        # each frame is preceded by its header
+        self.frames_sent += len(outbox) // 2
+        self.bytes_sent += self._outbox_size
+        self._outbox_size = 0
+        self._transport.writelines(outbox)
+        self._sample_rtt()
+
+    def _sample_rtt(self) -> None:
+        transport = self._transport
+        if transport is None:
+            return
+        now = asyncio.get_running_loop().time()
+        if now < self._next_rtt_sample:
+            return
+        self._next_rtt_sample = now + RTT_SAMPLE_INTERVAL
+        rtt = tcp_rtt(transport.get_extra_info("socket"))
+        if rtt is not None:
+            # kernel's estimate is smoothed already
+            self.rtt = rtt
+
+    def _pause_writing(self) -> None:
+        self._paused = True
+
+    def _resume_writing(self) -> None:
+        self._paused = False
+        self._wake_drain_waiters(None)
+
+    def _wake_drain_waiters(self, exc: Optional[Exception]) -> None:
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
+
+    def _frame_received(self, frame: bytes) -> None:
+        self.frames_received += 1
+        self.bytes_received += FRAME_HEADER.size + len(frame)
+        if self.raw_handler is not None:
+            self.raw_handler(frame)
+            return
+        try:
+            message = self.codec.decode(frame)
+        except ValueError:
+            # framing is intact, so the rest of stream is still readable
+            self.malformed += 1
+            return
+        self.callback(message)
+
+
+class FramedStream(asyncio.BufferedProtocol):
+    """
+    asyncio protocol which reads frames into reusable buffer.
+    """
+
+    connection: StreamConnection
+    on_made: Optional[Callable[[StreamConnection], None]]
+    _buffer: bytearray
+    _start: int
+    _end: int
+
+    def __init__(
+        self,
+        connection: StreamConnection,
+        on_made: Optional[Callable[[StreamConnection], None]] = None
+    ) -> None:
+        self.connection = connection
+        self.on_made = on_made
+        self._buffer = bytearray(READ_BUFFER_SIZE)
+        self._start = 0
+        self._end = 0
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert isinstance(transport, asyncio.WriteTransport)
+        self.connection._connection_made(transport)
+        if self.on_made is not None:
+            self.on_made(self.connection)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.connection._connection_lost(exc)
+
+    def pause_writing(self) -> None:
+        self.connection._pause_writing()
+
+    def resume_writing(self) -> None:
+        self.connection._resume_writing()
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._end == len(self._buffer):
+            self._reserve(self._end - self._start + 1)
+        return memoryview(self._buffer)[self._end:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self._end += nbytes
+        header_size = FRAME_HEADER.size
+        while self._end - self._start >= header_size:
+            start = self._start
+            length, = FRAME_HEADER.unpack_from(self._buffer, start)
+            if length > MAX_FRAME_LENGTH:
+                self.connection.close()
+                return
+            frame_end = start + header_size + length
+            if frame_end > self._end:
+                self._reserve(header_size + length)
+                return
+            frame = bytes(
+                memoryview(self._buffer)[start + header_size:frame_end]
+            )
+            self._start = frame_end
+            self.connection._frame_received(frame)
+            if self.connection.closed:
+                return
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _reserve(self, size: int) -> None:
+        """
+        Makes sure that `size` bytes fit in buffer starting from `_start`.
+        """
+        if len(self._buffer) - self._start >= size:
+            return
+        used = self._end - self._start
+        if len(self._buffer) >= size:
+            self._buffer[:used] = self._buffer[self._start:self._end]
+        else:
+            # buffer might be exported to transport at the moment, so it
+            # can't be resized in place
+            buffer = bytearray(size + READ_BUFFER_SIZE)
+            buffer[:used] = self._buffer[self._start:self._end]
+            self._buffer = buffer
+        self._start = 0
+        self._end = used
+
+
+class StreamServer(Server[StreamProtocol[Address], bytes]):
+
+    callback: Callable[[Address, Connection[StreamProtocol[Address], bytes]], None]
+    _server: Optional[asyncio.AbstractServer]
+    _started: Optional[asyncio.Future[None]]
+
+    def __init__(
+        self,
+        protocol: StreamProtocol[Address],
+        callback: Callable[[Address, Connection[StreamProtocol[Address], bytes]], None],
+        codec: MessagesCodec[bytes]
+    ) -> None:
+        self.protocol = protocol
+        self.callback = callback
+        self.codec = codec
+        self._server = None
+        self._started = None
+
+    @property
+    def sockets(self) -> List[socket.socket]:
+        sockets: Optional[Iterable[socket.socket]]
+        sockets = getattr(self._server, "sockets", None)
+        return list(sockets or ())
+
+    async def started(self) -> None:
+        """
+        Waits until server starts to accept connections.
+        """
+        await self._started_future()
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+
+    def connection_callback(
+        self,
+        address: Address,
+        connection: Connection[StreamProtocol[Address], bytes]
+    ) -> None:
+        self.callback(address, connection)
+
+    async def _start(self) -> None:
+        started = self._started_future()
+        try:
+            self._server = await self.protocol.start_server(self._accept)
+        except OSError as exc:
+            started.set_exception(exc)
+        else:
+            started.set_result(None)
+
+    def _started_future(self) -> asyncio.Future[None]:
+        if self._started is None:
+            loop = asyncio.get_running_loop()
+            self._started = loop.create_future()
+        return self._started
+
+    def _accept(self) -> FramedStream:
+        connection = StreamConnection(self.protocol, self.codec)
+        return FramedStream(connection, self._accepted)
+
+    def _accepted(self, connection: StreamConnection) -> None:
+        transport = connection._transport
+        assert transport is not None
+        address = transport.get_extra_info("peername")
+        self.connection_callback(address, connection)
@@ -0,0 +1,475 @@
+"""
+Bounded tables of forwarder's state.
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+from array import array
+from collections import OrderedDict
+
+from typing import Callable, Dict, Generic, Hashable, Iterator, List
+from typing import MutableMapping, Optional, Set, Tuple
+from typing import TypeVar
+
+from .nodes import KnownNode, Neighbour
+
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+RoutePair = Tuple[KnownNode, KnownNode]
+RouteDirections = Tuple[Neighbour, Neighbour]
+
+
+class Entry(Generic[V]):
+
+    __slots__ = ("value", "used")
+
+    value: V
+    used: float
+
+    def __init__(self, value: V, used: float) -> None:
+        self.value = value
+        self.used = used
+
+
+# entry with its 2-tuple key
+ENTRY_SIZE = sys.getsizeof(Entry(None, 0.0)) + sys.getsizeof((None, None))
+
+
+class ExpiringTable(MutableMapping[K, V]):
+    """
+    Mapping which forgets entries unused for `ttl` seconds and keeps at most
+    `capacity` of them evicting least recently used ones.
+
+    Lookups refresh entries, so entries are kept in order of their last use
+    and expired ones are always at the head. Expired entries are removed on
+    insertion, or can be removed explicitly with `expire`.
+
+    Pinned entries are kept regardless of limits.
+    """
+
+    capacity: Optional[int]
+    ttl: Optional[float]
+    evicted: int
+    expired: int
+    _entries: OrderedDict[K, Entry[V]]
+    _pinned: Dict[K, V]
+
+    def __init__(
+        self, capacity: Optional[int] = None, ttl: Optional[float] = None
+    ) -> None:
+        if capacity is not None and capacity < 1:
+            raise ValueError("Capacity must be positive")
+        self.capacity = capacity
+        self.ttl = ttl
+        self.evicted = 0
+        self.expired = 0
+        self._entries = OrderedDict()
+        self._pinned = {}
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._pinned)
+
+    def __iter__(self) -> Iterator[K]:
+        yield from self._pinned
+        yield from list(self._entries)
+
+    def __contains__(self, key: object) -> bool:
+        return self.get(key) is not None  # type: ignore
+
+    def __getitem__(self, key: K) -> V:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(  # type: ignore
+        self, key: K, default: Optional[V] = None
+    ) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return self._pinned.get(key, default)
+        now = time.monotonic()
+        if self.ttl is not None and now - entry.used > self.ttl:
+            del self._entries[key]
+            self.expired += 1
+            self._dropped(key, entry.value)
+            return default
+        entry.used = now
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def __setitem__(self, key: K, value: V) -> None:
+        if key in self._pinned:
+            self._pinned[key] = value
+            return
+        entries = self._entries
+        entries[key] = Entry(value, time.monotonic())
+        entries.move_to_end(key)
+        self.expire()
+        if self.capacity is not None:
+            while len(entries) > self.capacity:
+                evicted_key, entry = entries.popitem(last=False)
+                self.evicted += 1
+                self._dropped(evicted_key, entry.value)
+
+    def __delitem__(self, key: K) -> None:
+        if key in self._pinned:
+            del self._pinned[key]
+        else:
+            del self._entries[key]
+
+    def pin(self, key: K, value: V) -> None:
+        """
+        Sets entry which never expires and is never evicted.
+        """
+        self._entries.pop(key, None)
+        self._pinned[key] = value
+
+    def expire(self) -> int:
+        """
+        Removes expired entries, returns count of removed ones.
+        """
+        if self.ttl is None:
+            return 0
+        entries = self._entries
+        deadline = time.monotonic() - self.ttl
+        count = 0
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry.used >= deadline:
+                break
+            del entries[key]
+            count += 1
+            self._dropped(key, entry.value)
+        self.expired += count
+        return count
+
+    def _dropped(self, key: K, value: V) -> None:
+        """
+        Called for each entry which is expired or evicted.
+        """
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._pinned.clear()
+
+    @property
+    def approximate_bytes(self) -> int:
+        """
+        Approximate memory used by table itself. Keys and values shared with
+        other structures (e.g. nodes) are not counted.
+        """
+        size = sys.getsizeof(self._entries) + sys.getsizeof(self._pinned)
+        return size + len(self._entries) * ENTRY_SIZE
+
+
+class RouteTable(ExpiringTable[RoutePair, RouteDirections]):
+    """
+    Table of routes: (source, destination) pair to pair of directions.
+    """
+
+    def discard_pair(self, source: KnownNode, destination: KnownNode) -> None:
+        """
+        Removes routes of pair in both directions if they exist.
+        """
+        self.pop((source, destination), None)
+        self.pop((destination, source), None)
+
+
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+
+N = TypeVar("N", bound=KnownNode)
+
+
+class NodeIds(Generic[N]):
+    """
+    Maps nodes to small integer ids with reference counts. Ids are reused
+    when nothing refers to them. Nodes are told apart by `key` of them.
+    """
+
+    __slots__ = ("key", "ids", "nodes", "refs", "free")
+
+    key: Callable[[N], Hashable]
+    ids: Dict[Hashable, int]
+    nodes: List[Optional[N]]
+    refs: array[int]
+    free: List[int]
+
+    def __init__(self, key: Callable[[N], Hashable]) -> None:
+        self.key = key
+        self.ids = {}
+        self.nodes = []
+        self.refs = array("I")
+        self.free = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def acquire(self, node: N) -> int:
+        key = self.key(node)
+        node_id = self.ids.get(key)
+        if node_id is None:
+            if self.free:
+                node_id = self.free.pop()
+                self.nodes[node_id] = node
+            else:
+                node_id = len(self.nodes)
+                self.nodes.append(node)
+                self.refs.append(0)
+            self.ids[key] = node_id
+        self.refs[node_id] += 1
+        return node_id
+
+    def release(self, node_id: int) -> None:
+        refs = self.refs
+        refs[node_id] -= 1
+        if not refs[node_id]:
+            node = self.nodes[node_id]
+            assert node is not None
+            del self.ids[self.key(node)]
+            self.nodes[node_id] = None
+            self.free.append(node_id)
+
+    def clear(self) -> None:
+        self.ids.clear()
+        self.nodes.clear()
+        self.refs = array("I")
+        self.free.clear()
+
+    @property
+    def approximate_bytes(self) -> int:
+        return sum(map(sys.getsizeof, (
+            self.ids, self.nodes, self.refs, self.free
+        )))
+
+
+def _address(node: KnownNode) -> Hashable:
+    return node.address
+
+
+class IndexedRouteTable(RouteTable):
+    """
+    Compact route table for relays holding many routes.
+
+    Nodes are mapped to small integer ids, route is stored as single
+    dict[int, int] item: key packs ids of (source, destination) pair, value
+    packs ids of its directions. Node objects are kept once per node rather
+    than once per route, and ids are reused when no route refers to them.
+    Routes' ends are told apart by address, directions by identity, so
+    lookups return the same neighbour objects as RouteTable does.
+
+    Entries are kept in two generations instead of strict LRU order: lookup
+    moves entry to the current generation, and the previous generation is
+    dropped when current one is `ttl` seconds old or holds half of
+    `capacity`. So unused routes live between `ttl` and 2*`ttl` seconds.
+    """
+
+    _ends: NodeIds[KnownNode]
+    _directions: NodeIds[Neighbour]
+    _current: Dict[int, int]
+    _previous: Dict[int, int]
+    _rotated: float
+
+    def __init__(
+        self, capacity: Optional[int] = None, ttl: Optional[float] = None
+    ) -> None:
+        super().__init__(capacity, ttl)
+        self._ends = NodeIds(_address)
+        self._directions = NodeIds(id)
+        self._current = {}
+        self._previous = {}
+        self._rotated = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous) + len(self._pinned)
+
+    def __iter__(self) -> Iterator[RoutePair]:
+        yield from self._pinned
+        nodes = self._ends.nodes
+        for key in list(self._current) + list(self._previous):
+            source, destination = nodes[key >> ID_BITS], nodes[key & ID_MASK]
+            assert source is not None and destination is not None
+            yield source, destination
+
+    def get(  # type: ignore
+        self, key: RoutePair, default: Optional[RouteDirections] = None
+    ) -> Optional[RouteDirections]:
+        ttl = self.ttl
+        if ttl is not None and time.monotonic() - self._rotated >= ttl:
+            self.expire()
+        ids = self._ends.ids
+        source_id = ids.get(key[0].address)
+        destination_id = ids.get(key[1].address)
+        if source_id is None or destination_id is None:
+            return self._pinned.get(key, default)
+        packed = source_id << ID_BITS | destination_id
+        value = self._current.get(packed)
+        if value is None:
+            value = self._previous.pop(packed, None)
+            if value is None:
+                return self._pinned.get(key, default)
+            self._current[packed] = value
+        nodes = self._directions.nodes
+        return nodes[value >> ID_BITS], nodes[value & ID_MASK]  # type: ignore
+
+    def __setitem__(self, key: RoutePair, value: RouteDirections) -> None:
+        if key in self._pinned:
+            self._pinned[key] = value
+            return
+        ends, directions = self._ends, self._directions
+        packed = ends.acquire(key[0]) << ID_BITS | ends.acquire(key[1])
+        packed_directions = (
+            directions.acquire(value[0]) << ID_BITS
+            | directions.acquire(value[1])
+        )
+        old = self._current.pop(packed, None)
+        if old is None:
+            old = self._previous.pop(packed, None)
+        self._current[packed] = packed_directions
+        if old is not None:
+            self._release_entry(packed, old)
+        self.expire()
+        if self.capacity is not None:
+            if len(self._current) >= max(self.capacity // 2, 1):
+                self.evicted += self._rotate()
+
+    def __delitem__(self, key: RoutePair) -> None:
+        if key in self._pinned:
+            del self._pinned[key]
+            return
+        ids = self._ends.ids
+        source_id = ids.get(key[0].address)
+        destination_id = ids.get(key[1].address)
+        if source_id is None or destination_id is None:
+            raise KeyError(key)
+        packed = source_id << ID_BITS | destination_id
+        value = self._current.pop(packed, None)
+        if value is None:
+            value = self._previous.pop(packed, None)
+        if value is None:
+            raise KeyError(key)
+        self._release_entry(packed, value)
+
+    def pin(self, key: RoutePair, value: RouteDirections) -> None:
+        self.pop(key, None)
+        self._pinned[key] = value
+
+    def expire(self) -> int:
+        if self.ttl is None:
+            return 0
+        age = time.monotonic() - self._rotated
+        if age < self.ttl:
+            return 0
+        count = self._rotate()
+        if age >= 2 * self.ttl:
+            # previous generation is unused for `ttl` seconds as well
+            count += self._rotate()
+        self.expired += count
+        return count
+
+    def clear(self) -> None:
+        self._pinned.clear()
+        self._ends.clear()
+        self._directions.clear()
+        self._current.clear()
+        self._previous.clear()
+
+    @property
+    def approximate_bytes(self) -> int:
+        size = self._ends.approximate_bytes
+        size += self._directions.approximate_bytes
+        size += sum(map(sys.getsizeof, (
+            self._current, self._previous, self._pinned
+        )))
+        # packed keys and values are ints of 8-9 bytes
+        items = len(self._current) + len(self._previous)
+        return size + 2 * items * sys.getsizeof(1 << 60)
+
+    def _rotate(self) -> int:
+        """
+        Drops the previous generation, returns count of dropped routes.
+        """
+        dropped = self._previous
+        self._previous = self._current
+        self._current = {}
+        self._rotated = time.monotonic()
+        for packed, value in dropped.items():
+            self._release_entry(packed, value)
+        return len(dropped)
+
+    def _release_entry(self, packed: int, value: int) -> None:
+        ends, directions = self._ends, self._directions
+        ends.release(packed >> ID_BITS)
+        ends.release(packed & ID_MASK)
+        directions.release(value >> ID_BITS)
+        directions.release(value & ID_MASK)
+
+
+H = TypeVar("H", bound=Hashable)
+
+
+class SeenFilter(Generic[H]):
+    """
+    Bounded set of recently seen keys.
+
+    Keys are kept in two generations: the previous one is dropped when the
+    current one is `ttl` seconds old or holds half of `capacity` keys. So a
+    key is remembered for at least `ttl` seconds unless the filter is
+    flooded, and never for longer than 2*`ttl` seconds.
+    """
+
+    capacity: Optional[int]
+    ttl: float
+    hits: int
+    _current: Set[H]
+    _previous: Set[H]
+    _rotated: float
+
+    def __init__(self, capacity: Optional[int] = None, ttl: float = 10) -> None:
+        if capacity is not None and capacity < 2:
+            raise ValueError("Capacity must be at least 2")
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self._current = set()
+        self._previous = set()
+        self._rotated = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._current or key in self._previous
+
+    def seen(self, key: H) -> bool:
+        """
+        Tells whether key is seen recently and remembers it.
+        """
+        age = time.monotonic() - self._rotated
+        if age >= self.ttl:
+            self._rotate()
+            if age >= 2 * self.ttl:
+                self._previous.clear()
+        if key in self._current or key in self._previous:
+            self.hits += 1
+            return True
+        if self.capacity is not None:
+            if len(self._current) >= self.capacity // 2:
+                self._rotate()
+        self._current.add(key)
+        return False
+
+    def clear(self) -> None:
+        self._current.clear()
+        self._previous.clear()
+
+    def _rotate(self) -> None:
+        self._previous = self._current
+        self._current = set()
+        self._rotated = time.monotonic()
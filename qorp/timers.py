@@ -0,0 +1,147 @@
+"""
+Coarse timers shared by many short-lived objects.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import math
+
+from typing import Callable, Dict, List, Optional
+
+
+class Timer:
+    """
+    Handle of callback scheduled in TimerWheel.
+    """
+
+    __slots__ = ("wheel", "tick", "callback", "_active")
+
+    wheel: TimerWheel
+    tick: int
+    callback: Callable[[], None]
+    _active: bool
+
+    def __init__(
+        self, wheel: TimerWheel, tick: int, callback: Callable[[], None]
+    ) -> None:
+        self.wheel = wheel
+        self.tick = tick
+        self.callback = callback
+        self._active = True
+
+    def cancel(self) -> None:
+        """
+        Cancels callback if it is not called yet.
+        """
+        if self._active:
+            self._active = False
+            self.wheel._remove(self)
+
+
+class TimerWheel:
+    """
+    Bucket scheduler which rounds deadlines up to `resolution` seconds.
+
+    Timers expiring in the same tick share a bucket, so cancellation is O(1),
+    scheduling is O(1) for ticks which already have a bucket (O(log n) of
+    count of pending ticks otherwise) and the event loop holds a single
+    timer handle for the whole wheel instead of one per scheduled callback.
+    Callbacks never run early, but may run up to `resolution` seconds late.
+    """
+
+    resolution: float
+    _buckets: Dict[int, Dict[Timer, None]]
+    # heap of ticks of buckets
+    _ticks: List[int]
+    _count: int
+    _loop: Optional[asyncio.AbstractEventLoop]
+    _handle: Optional[asyncio.TimerHandle]
+    _next_tick: Optional[int]
+
+    def __init__(self, resolution: float = 0.05) -> None:
+        if resolution <= 0:
+            raise ValueError("Resolution must be positive")
+        self.resolution = resolution
+        self._buckets = {}
+        self._ticks = []
+        self._count = 0
+        self._loop = None
+        self._handle = None
+        self._next_tick = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> Timer:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # timers of closed loop can't fire anyway
+            self._reset(loop)
+        tick = math.ceil((loop.time() + delay) / self.resolution)
+        timer = Timer(self, tick, callback)
+        bucket = self._buckets.get(tick)
+        if bucket is None:
+            bucket = self._buckets[tick] = {}
+            heapq.heappush(self._ticks, tick)
+        bucket[timer] = None
+        self._count += 1
+        self._schedule_earlier(tick)
+        return timer
+
+    def _remove(self, timer: Timer) -> None:
+        self._count -= 1
+        bucket = self._buckets.get(timer.tick)
+        if bucket is not None:
+            # empty bucket is kept until its tick, so each tick is pushed to
+            # heap only once
+            bucket.pop(timer, None)
+
+    def _reset(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+        self._buckets.clear()
+        self._ticks.clear()
+        self._count = 0
+        self._loop = loop
+        self._handle = None
+        self._next_tick = None
+
+    def _schedule_earlier(self, tick: int) -> None:
+        """
+        Schedules run at `tick` unless the wheel runs earlier already.
+        """
+        if self._next_tick is None or tick < self._next_tick:
+            self._schedule(tick)
+
+    def _schedule(self, tick: int) -> None:
+        assert self._loop is not None
+        if self._handle is not None:
+            self._handle.cancel()
+        self._next_tick = tick
+        self._handle = self._loop.call_at(tick * self.resolution, self._run)
+
+    def _run(self) -> None:
+        assert self._loop is not None
+        self._handle = None
+        self._next_tick = None
+        buckets, ticks = self._buckets, self._ticks
+        now = self._loop.time()
+        while ticks and ticks[0] * self.resolution <= now:
+            for timer in buckets.pop(heapq.heappop(ticks)):
+                if not timer._active:
+                    # cancelled by callback of the same bucket
+                    continue
+                timer._active = False
+                self._count -= 1
+                try:
+                    timer.callback()
+                except Exception as exc:
+                    self._loop.call_exception_handler({
+                        "message": "Timer callback failed",
+                        "exception": exc,
+                    })
+        if ticks:
+            # callbacks may have scheduled the next run already
+            self._schedule_earlier(ticks[0])
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import Callable, ClassVar, Generic, TypeVar
+from typing import Callable, ClassVar, Generic, Optional, TypeVar
 
 from .codecs import MessagesCodec
 
@@ -45,6 +45,14 @@ class Connection(ABC, Generic[Proto, DataType]):
 
     protocol: Proto
     codec: MessagesCodec[DataType]
+    closed: bool = False
+    # smoothed round-trip time in seconds, None if it is unknown
+    rtt: Optional[float] = None
+    # traffic of connection, bytes are counted with framing
+    frames_sent: int = 0
+    bytes_sent: int = 0
+    frames_received: int = 0
+    bytes_received: int = 0
 
     @abstractmethod
     def send(self, message: NetworkMessage) -> None:
@@ -52,6 +60,36 @@ class Connection(ABC, Generic[Proto, DataType]):
         Sends message through specific connection.
         """
 
+    def send_raw(self, frame: DataType, codec: MessagesCodec[DataType]) -> None:
+        """
+        Sends already encoded message through specific connection.
+
+        Connections which share `codec` with the frame may write it as is.
+        Default implementation decodes the frame and sends the message.
+        """
+        self.send(codec.decode(frame))
+
+    @property
+    def pending(self) -> int:
+        """
+        Count of bytes which are sent but not written to the network yet.
+        """
+        return 0
+
+    async def drain(self) -> None:
+        """
+        Waits until connection is ready to accept more data.
+        """
+
+    def update_rtt(self, sample: float) -> None:
+        """
+        Updates round-trip time estimate with new measurement.
+        """
+        if self.rtt is None:
+            self.rtt = sample
+        else:
+            self.rtt += (sample - self.rtt) / 8
+
     @abstractmethod
     def callback(self, message: NetworkMessage) -> None:
         """
@@ -0,0 +1,238 @@
+"""
+Signature verification off the event loop.
+"""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from hashlib import blake2b
+
+from typing import Callable, Collection, List, Optional, Tuple, Type
+
+from .batching import BatchExecutor
+from .encryption import Ed25519PublicKey, InvalidSignature
+from .messages import NetworkMessage, RouteRequest, RouteResponse
+from .nodes import Neighbour
+
+
+# (signer's public key, signature, signed data)
+VerificationJob = Tuple[bytes, bytes, bytes]
+# (message type, digest of signed data, signature)
+CacheKey = Tuple[Type[NetworkMessage], bytes, bytes]
+VerificationContext = Tuple[Neighbour, NetworkMessage, Optional[CacheKey]]
+
+
+def verify_signature(
+    public_key: Ed25519PublicKey, signature: bytes, data: bytes
+) -> bool:
+    try:
+        public_key.verify(signature, data)
+    except InvalidSignature:
+        return False
+    return True
+
+
+def verify_signatures(jobs: List[VerificationJob]) -> List[bool]:
+    """
+    Verifies batch of Ed25519 signatures.
+
+    Jobs contain only bytes, so this function is suitable both for thread and
+    process pools.
+    """
+    results = []
+    for public_key, signature, data in jobs:
+        try:
+            key = Ed25519PublicKey.from_public_bytes(public_key)
+            key.verify(signature, data)
+        except (InvalidSignature, ValueError):
+            results.append(False)
+        else:
+            results.append(True)
+    return results
+
+
+class SignatureCache:
+    """
+    Bounded cache of signature verification results.
+
+    Results are kept for `ttl` seconds, least recently used ones are evicted
+    when cache holds `capacity` entries. Only messages of `types` are cached:
+    by default these are RouteRequest and RouteResponse messages, which are
+    flooded over the network and come to node many times.
+    """
+
+    capacity: int
+    ttl: float
+    types: Collection[Type[NetworkMessage]]
+    hits: int
+    misses: int
+    _results: OrderedDict[CacheKey, Tuple[float, bool]]
+
+    def __init__(
+        self,
+        capacity: int = 4096,
+        ttl: float = 60,
+        types: Collection[Type[NetworkMessage]] = (RouteRequest, RouteResponse),
+    ) -> None:
+        self.capacity = capacity
+        self.ttl = ttl
+        self.types = frozenset(types)
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def key(self, message: NetworkMessage) -> Optional[CacheKey]:
+        """
+        Returns cache key for message or None if message is not cacheable.
+        """
+        MessageType = type(message)
+        signature = getattr(message, "signature", None)
+        if MessageType not in self.types or signature is None:
+            return None
+        return self.signed_key(
+            MessageType, bytes(signature), message.signed_data()
+        )
+
+    def signed_key(
+        self, MessageType: Type[NetworkMessage], signature: bytes, data: bytes
+    ) -> Optional[CacheKey]:
+        """
+        Returns cache key for signature of `data` taken from message of
+        `MessageType` or None if such messages are not cached.
+        """
+        if MessageType not in self.types:
+            return None
+        digest = blake2b(data, digest_size=16).digest()
+        return MessageType, digest, signature
+
+    def get(self, key: CacheKey) -> Optional[bool]:
+        entry = self._results.get(key)
+        if entry is not None:
+            expires, valid = entry
+            if expires > time.monotonic():
+                self._results.move_to_end(key)
+                self.hits += 1
+                return valid
+            del self._results[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: CacheKey, valid: bool) -> None:
+        results = self._results
+        results[key] = (time.monotonic() + self.ttl, valid)
+        results.move_to_end(key)
+        while len(results) > self.capacity:
+            results.popitem(last=False)
+
+    def verify(self, message: NetworkMessage) -> bool:
+        """
+        Verifies message's signature using cached result if it is possible.
+        """
+        key = self.key(message)
+        if key is None:
+            return message.verify()
+        valid = self.get(key)
+        if valid is None:
+            valid = message.verify()
+            self.put(key, valid)
+        return valid
+
+    def verify_signed(
+        self,
+        MessageType: Type[NetworkMessage],
+        public_key: Ed25519PublicKey,
+        signature: bytes,
+        data: bytes,
+    ) -> bool:
+        """
+        Verifies signature of encoded message given as its signed data.
+        """
+        key = self.signed_key(MessageType, signature, data)
+        if key is None:
+            return verify_signature(public_key, signature, data)
+        valid = self.get(key)
+        if valid is None:
+            valid = verify_signature(public_key, signature, data)
+            self.put(key, valid)
+        return valid
+
+    def clear(self) -> None:
+        self._results.clear()
+
+
+class BatchVerifier:
+    """
+    Verification stage which checks messages' signatures in executor.
+
+    Messages with valid signatures are passed to `callback` on the event loop
+    in the same order as they were submitted. Messages with invalid or missing
+    signatures are dropped.
+
+    If `cache` is given, cached results are used instead of verification and
+    results of verification are stored to it.
+    """
+
+    callback: Callable[[Neighbour, NetworkMessage], None]
+    cache: Optional[SignatureCache]
+    rejected: int
+    _batches: BatchExecutor[VerificationJob, VerificationContext, bool]
+
+    def __init__(
+        self,
+        callback: Callable[[Neighbour, NetworkMessage], None],
+        executor: Optional[Executor] = None,
+        batch_size: int = 64,
+        max_latency: float = 0.001,
+        cache: Optional[SignatureCache] = None,
+    ) -> None:
+        self.callback = callback
+        self.cache = cache
+        self.rejected = 0
+        self._batches = BatchExecutor(
+            verify_signatures, self._verified,
+            executor, batch_size, max_latency
+        )
+
+    @property
+    def pending(self) -> int:
+        return self._batches.pending
+
+    @property
+    def dropped(self) -> int:
+        """
+        Count of jobs lost because batch worker failed.
+        """
+        return self._batches.dropped
+
+    def submit(self, source: Neighbour, message: NetworkMessage) -> None:
+        signature = getattr(message, "signature", None)
+        if signature is None:
+            self.rejected += 1
+            return
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(message)
+            if cache_key is not None:
+                valid = self.cache.get(cache_key)
+                if valid is not None:
+                    self._batches.submit_result((source, message, None), valid)
+                    return
+        job = (message.source.address, bytes(signature), message.signed_data())
+        self._batches.submit(job, (source, message, cache_key))
+
+    def flush(self) -> None:
+        self._batches.flush()
+
+    def _verified(self, context: VerificationContext, valid: bool) -> None:
+        source, message, cache_key = context
+        if self.cache is not None and cache_key is not None:
+            self.cache.put(cache_key, valid)
+        if valid:
+            self.callback(source, message)
+        else:
+            self.rejected += 1
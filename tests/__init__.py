@@ -2,12 +2,38 @@ import unittest
 
 from .test_messages import TestMessageSignVerify
 from .test_messages import TestDefaultCodec
+from .test_messages import TestSignatureCache
 from .test_router import TestMessagesForwarder
 from .test_router import TestRouter
+from .test_router import TestIndexedMessagesForwarder
+from .test_router import TestHandshake
+from .test_metrics import TestMetrics
+from .test_offload import TestCryptoOffload
+from .test_sessions import TestSessions
+from .test_simulation import TestSimulation
+from .test_tables import TestRouteTable
+from .test_timers import TestTimerWheel
+from .test_transports import TestStreamTransport
+from .test_transports import TestDatagramTransport
+from .test_transports import TestSendQueue
+from .test_transports import TestConnectionSelection
 
 
 tests = unittest.TestSuite()
 tests.addTest(unittest.makeSuite(TestMessageSignVerify))
 tests.addTest(unittest.makeSuite(TestDefaultCodec))
+tests.addTest(unittest.makeSuite(TestSignatureCache))
 tests.addTest(unittest.makeSuite(TestMessagesForwarder))
 tests.addTest(unittest.makeSuite(TestRouter))
+tests.addTest(unittest.makeSuite(TestIndexedMessagesForwarder))
+tests.addTest(unittest.makeSuite(TestTimerWheel))
+tests.addTest(unittest.makeSuite(TestCryptoOffload))
+tests.addTest(unittest.makeSuite(TestSessions))
+tests.addTest(unittest.makeSuite(TestHandshake))
+tests.addTest(unittest.makeSuite(TestMetrics))
+tests.addTest(unittest.makeSuite(TestRouteTable))
+tests.addTest(unittest.makeSuite(TestSimulation))
+tests.addTest(unittest.makeSuite(TestStreamTransport))
+tests.addTest(unittest.makeSuite(TestDatagramTransport))
+tests.addTest(unittest.makeSuite(TestSendQueue))
+tests.addTest(unittest.makeSuite(TestConnectionSelection))
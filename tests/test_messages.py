@@ -1,9 +1,11 @@
+import gc
 from unittest import TestCase
 
-from qorp.codecs import DEFAULT_CODEC
+from qorp.codecs import DEFAULT_CODEC, LAZY_CODEC, DefaultCodec
 from qorp.encryption import Ed25519PrivateKey, X25519PrivateKey
 from qorp.messages import NetworkData, RouteRequest, RouteResponse, RouteError
-from qorp.nodes import KnownNode
+from qorp.nodes import KnownNode, Neighbour, Node, NodesRegistry
+from qorp.verification import SignatureCache
 
 
 src_privkey = Ed25519PrivateKey.generate()
@@ -42,6 +44,20 @@ class TestMessageSignVerify(TestCase):
         self.rerr.sign(src_privkey)
         self.assertTrue(self.rerr.verify())
 
+    def test_slotted(self) -> None:
+        objects = [
+            self.data, self.rreq, self.rrep, self.rerr,
+            Node(src.address), src, Neighbour(src_pubkey),
+        ]
+        for obj in objects:
+            self.assertFalse(
+                hasattr(obj, "__dict__"),
+                f"{type(obj).__name__} instances have __dict__"
+            )
+        rreq = RouteRequest(src, dst, exchange_pubkey)
+        self.assertEqual(rreq, self.rreq)
+        self.assertIsNone(rreq.signature)
+
 
 class TestDefaultCodec(TestCase):
 
@@ -73,3 +89,92 @@ class TestDefaultCodec(TestCase):
         encoded = self.codec.encode(self.rerr)
         decoded = self.codec.decode(encoded)
         self.assertEqual(self.rerr, decoded)
+
+    def test_encoding_cache(self) -> None:
+        encoded = self.codec.encode(self.data)
+        self.assertIs(self.codec.encode(self.data), encoded)
+        decoded = self.codec.decode(encoded)
+        self.assertIs(self.codec.encode(decoded), encoded)
+        decoded.payload = b"\x01"
+        self.assertFalse(decoded.verify())
+        self.assertNotEqual(self.codec.encode(decoded), encoded)
+        decoded.payload = b"\x00"
+        self.assertTrue(decoded.verify())
+        self.assertEqual(self.codec.encode(decoded), encoded)
+
+    def test_lazy_decode(self) -> None:
+        for msg in self.data, self.rreq, self.rrep, self.rerr:
+            encoded = self.codec.encode(msg)
+            for buffer in encoded, bytearray(encoded), memoryview(encoded):
+                decoded = LAZY_CODEC.decode(buffer)
+                self.assertEqual(msg, decoded)
+                self.assertTrue(decoded.verify())
+
+    def test_lazy_decode_defers_keys(self) -> None:
+        encoded = self.codec.encode(self.data)
+        codec = DefaultCodec(lazy=True, nodes=NodesRegistry())
+        decoded = codec.decode(memoryview(encoded))
+        assert isinstance(decoded, NetworkData)
+        self.assertIsNone(decoded.source._public_key)
+        self.assertIsNone(decoded.destination._public_key)
+        self.assertIsInstance(decoded.payload, memoryview)
+        self.assertTrue(decoded.verify())
+        self.assertIsNotNone(decoded.source._public_key)
+        self.assertIsNone(decoded.destination._public_key)
+
+    def test_nodes_interning(self) -> None:
+        nodes = NodesRegistry()
+        codec = DefaultCodec(nodes=nodes)
+        encoded = self.codec.encode(self.rerr)
+        first = codec.decode(encoded)
+        second = codec.decode(encoded)
+        assert isinstance(first, RouteError)
+        assert isinstance(second, RouteError)
+        self.assertIs(first.source, second.source)
+        self.assertIs(first.source, first.route_source)
+        self.assertIs(first.destination, second.route_destination)
+        self.assertEqual(len(nodes), 2)
+        del first, second
+        gc.collect()
+        self.assertEqual(len(nodes), 0)
+
+
+class TestSignatureCache(TestCase):
+
+    def setUp(self) -> None:
+        self.rreq = RouteRequest(src, dst, exchange_pubkey)
+        self.rreq.sign(src_privkey)
+
+    def test_cache_hits(self) -> None:
+        cache = SignatureCache()
+        duplicate = RouteRequest(src, dst, exchange_pubkey)
+        duplicate.set_signature(self.rreq.signature)
+        self.assertTrue(cache.verify(self.rreq))
+        self.assertTrue(cache.verify(duplicate))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        forged = RouteRequest(src, src, exchange_pubkey)
+        forged.set_signature(self.rreq.signature)
+        self.assertFalse(cache.verify(forged))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_cache_limits(self) -> None:
+        cache = SignatureCache(capacity=1)
+        rrep = RouteResponse(src, dst, exchange_pubkey, exchange_pubkey)
+        rrep.sign(src_privkey)
+        cache.verify(self.rreq)
+        cache.verify(rrep)
+        self.assertEqual(len(cache), 1)
+        cache.verify(self.rreq)
+        self.assertEqual(cache.hits, 0)
+        cache = SignatureCache(ttl=0)
+        cache.verify(self.rreq)
+        cache.verify(self.rreq)
+        self.assertEqual(cache.hits, 0)
+
+    def test_cache_types(self) -> None:
+        cache = SignatureCache()
+        data = NetworkData(src, dst, b"\x00"*12, 1, b"\x00")
+        data.sign(src_privkey)
+        self.assertTrue(cache.verify(data))
+        self.assertTrue(cache.verify(data))
+        self.assertEqual(len(cache), 0)
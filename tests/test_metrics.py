@@ -0,0 +1,119 @@
+from unittest import TestCase
+
+from typing import List
+
+from qorp.datagrams import DatagramConnection, UDPProtocol
+from qorp.encryption import Ed25519PrivateKey
+from qorp.messages import FrontendData, NetworkMessage
+from qorp.metrics import Histogram, Registry, instrument
+from qorp.nodes import Neighbour
+from qorp.transports import Connection
+
+from tests.test_router import as_sync, get_test_router
+from tests.test_transports import get_messages
+from tests.utils import RecorderFrontend, link_routers, wait_for
+
+
+class TestMetrics(TestCase):
+
+    def test_histogram(self) -> None:
+        histogram = Histogram("latency")
+        for micros in range(1, 10001):
+            histogram.record(micros * 1e-6)
+        self.assertEqual(histogram.count, 10000)
+        self.assertAlmostEqual(histogram.max, 0.01)
+        for q in (0.5, 0.9, 0.99):
+            self.assertAlmostEqual(
+                histogram.quantile(q), q * 0.01, delta=q * 0.01 * 0.02
+            )
+        self.assertLess(len(histogram._buckets), 1000, "Buckets are too fine")
+
+    @as_sync
+    async def test_instrument(self) -> None:
+        first, last = get_test_router(), get_test_router()
+        self.assertIsNone(first.forwarder.metrics)
+        link_routers(first, last)
+        registry = instrument(last, Registry())
+        first.send(FrontendData(first, last, b"payload"))
+        frontend = last.frontend
+        assert isinstance(frontend, RecorderFrontend)
+        await wait_for(lambda: bool(frontend.received))
+        snapshot = registry.snapshot()
+        received = 'qorp_messages_received_total{type="%s"}'
+        self.assertEqual(snapshot[received % "RouteRequest"], 1)
+        self.assertEqual(snapshot[received % "NetworkData"], 1)
+        # response is passed to forwarder by router itself
+        self.assertEqual(snapshot[received % "RouteResponse"], 1)
+        latency = snapshot['qorp_message_handling_seconds{type="NetworkData"}']
+        assert isinstance(latency, dict)
+        self.assertEqual(latency["count"], 1)
+        self.assertEqual(snapshot["qorp_sessions"], 1)
+        self.assertEqual(snapshot["qorp_connections"], 1)
+        self.assertEqual(
+            snapshot['qorp_handshake_steps_total{step="exchange"}'], 1
+        )
+        text = registry.prometheus()
+        self.assertIn("# TYPE qorp_messages_received_total counter\n", text)
+        self.assertIn("# TYPE qorp_message_handling_seconds summary\n", text)
+        self.assertIn(
+            'qorp_message_handling_seconds_count{type="NetworkData"} 1\n', text
+        )
+        self.assertIn("qorp_sessions 1\n", text)
+
+    @as_sync
+    async def test_instrument_transports(self) -> None:
+        router = get_test_router()
+        registry = instrument(router, Registry())
+        received: List[NetworkMessage] = []
+
+        def on_connection(address: object, connection: Connection) -> None:  # type: ignore
+            assert isinstance(connection, DatagramConnection)
+            connection.handler = received.append
+
+        server = UDPProtocol("127.0.0.1", 0).listen(on_connection)
+        await server.started()
+        assert server.address is not None
+        client = UDPProtocol(*server.address[:2]).connect()
+        await client.opened()
+        neighbour = Neighbour(Ed25519PrivateKey.generate().public_key())
+        neighbour.connections.append(client)
+        router.forwarder.neighbours.add(neighbour)
+        messages = get_messages(5)
+        for message in messages:
+            neighbour.send(message)
+        await wait_for(lambda: len(received) == len(messages))
+        client.close()
+        server.close()
+        snapshot = registry.snapshot()
+        frames = 'qorp_transport_frames_total{direction="sent",transport="%s"}'
+        self.assertEqual(snapshot[frames % "udp"], len(messages))
+        self.assertEqual(snapshot[frames % "tcp"], 0)
+        self.assertEqual(
+            snapshot[
+                'qorp_transport_bytes_total{direction="sent",transport="udp"}'
+            ],
+            client.bytes_sent
+        )
+        self.assertEqual(
+            snapshot[
+                'qorp_transport_datagrams_total'
+                '{direction="sent",transport="udp"}'
+            ],
+            client.datagrams_sent
+        )
+        self.assertIn(
+            'qorp_transport_malformed_total{transport="udp"} 0\n',
+            registry.prometheus()
+        )
+        # lost connection and neighbour which left keep their counts
+        neighbour.connections.remove(client)
+        self.assertEqual(registry.snapshot()[frames % "udp"], len(messages))
+        router.forwarder.neighbours.discard(neighbour)
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot[frames % "udp"], len(messages))
+        self.assertEqual(
+            snapshot[
+                'qorp_transport_bytes_total{direction="sent",transport="udp"}'
+            ],
+            client.bytes_sent
+        )
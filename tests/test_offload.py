@@ -0,0 +1,56 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import patch
+
+from typing import Dict, List
+
+from qorp.codecs import CHACHA_NONCE_LENGTH
+from qorp.encryption import ChaCha20Poly1305
+from qorp.offload import CryptoOffload
+
+from tests.test_router import as_sync
+from tests.utils import wait_for
+
+
+class TestCryptoOffload(TestCase):
+
+    @as_sync
+    async def test_order(self) -> None:
+        key = ChaCha20Poly1305(ChaCha20Poly1305.generate_key())
+        nonce = b"\x00"*CHACHA_NONCE_LENGTH
+        payloads = [bytes([i])*(1 + 1000*(i % 3)) for i in range(30)]
+        encrypted: list[bytes | None] = []
+        decrypted: list[bytes | None] = []
+        with ThreadPoolExecutor(4) as executor:
+            crypto = CryptoOffload(executor, batch_size=4, inline_threshold=100)
+            for payload in payloads:
+                crypto.encrypt(key, nonce, payload, encrypted.append)
+            await wait_for(lambda: len(encrypted) == len(payloads))
+            for ciphertext in encrypted:
+                assert ciphertext is not None
+                crypto.decrypt(key, nonce, ciphertext, decrypted.append)
+            crypto.decrypt(key, nonce, b"\x00"*1000, decrypted.append)
+            await wait_for(lambda: len(decrypted) == len(payloads) + 1)
+        self.assertEqual(decrypted, payloads + [None], "Results are reordered")
+
+    @as_sync
+    async def test_worker_failure(self) -> None:
+        key = ChaCha20Poly1305(ChaCha20Poly1305.generate_key())
+        nonce = b"\x00"*CHACHA_NONCE_LENGTH
+        errors: List[Dict[str, object]] = []
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda _, context: errors.append(context))
+        encrypted: list[bytes | None] = []
+        failing = patch(
+            "qorp.offload.run_aead_batch", side_effect=RuntimeError("failed")
+        )
+        with ThreadPoolExecutor(1) as executor, failing:
+            crypto = CryptoOffload(executor, batch_size=4, inline_threshold=100)
+            for _ in range(4):
+                crypto.encrypt(key, nonce, b"\x00"*1000, encrypted.append)
+            await wait_for(lambda: not crypto.pending)
+        self.assertEqual(crypto.dropped, 4, "Lost results are not counted")
+        self.assertEqual(len(errors), 1, "Failure of batch is not reported")
+        crypto.encrypt(key, nonce, b"\x00", encrypted.append)
+        self.assertEqual(len(encrypted), 1)
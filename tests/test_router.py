@@ -1,19 +1,31 @@
 import asyncio
+import gc
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from unittest import TestCase
+from unittest.mock import patch
 
-from typing import Callable, Coroutine, TypeVar
+from typing import Callable, Coroutine, Iterable, List, Optional, Tuple
+from typing import TypeVar
 from typing_extensions import ParamSpec
 
 from qorp.codecs import CHACHA_NONCE_LENGTH, DEFAULT_CODEC
-from qorp.messages import NetworkData, RouteRequest, RouteError, RouteResponse
-from qorp.nodes import Neighbour
+from qorp.handshake import KeyPool
+from qorp.messages import FrontendData, NetworkData, RouteRequest, RouteError
+from qorp.messages import RouteResponse
+from qorp.nodes import KnownNode, Neighbour
+from qorp.offload import CryptoOffload
 from qorp.router import Router
+from qorp.routing import IndexedMessagesForwarder
+from qorp.tables import SeenFilter
+from qorp.timers import TimerWheel
+from qorp.verification import BatchVerifier, SignatureCache
 from qorp.encryption import Ed25519PrivateKey
 from qorp.encryption import X25519PrivateKey
 
 from tests.utils import RecorderFrontend, TestConnection, TestProtocol
-from tests.utils import NeignbourMock, RouterMock
+from tests.utils import NeignbourMock, RouterMock, link_routers, wait_for
 
 
 T = TypeVar("T")
@@ -33,21 +45,6 @@ def get_test_router() -> Router:
     return router
 
 
-def link_routers(first: Router, second: Router) -> None:
-    first_neighbour = Neighbour(first.public_key)
-    first_proto = TestProtocol()
-    first_neighbour_conn = TestConnection(first_proto, DEFAULT_CODEC, 0.01)
-    first_neighbour.connections.append(first_neighbour_conn)
-    second_neighbour = Neighbour(second.public_key)
-    second_proto = TestProtocol()
-    second_neighbour_conn = TestConnection(second_proto, DEFAULT_CODEC, 0.01)
-    second_neighbour.connections.append(second_neighbour_conn)
-    first_proto.address = second_neighbour_conn
-    second_proto.address = first_neighbour_conn
-    first.forwarder.neighbours.add(second_neighbour)
-    second.forwarder.neighbours.add(first_neighbour)
-
-
 class TestMessagesForwarder(TestCase):
 
     def setUp(self) -> None:
@@ -90,6 +87,104 @@ class TestMessagesForwarder(TestCase):
                 "Unsingned message forwarded to next hop"
             )
 
+    def test_networkdata_directions(self) -> None:
+        source, destination = NeignbourMock(), NeignbourMock()
+        requested_by, other = NeignbourMock(), NeignbourMock()
+        self.forwarder.routes[(source, destination)] = (requested_by, destination)
+        nonce = b"\x00"*CHACHA_NONCE_LENGTH
+        msg = NetworkData(source, destination, nonce, 1, b"\x00")
+        msg.sign(source.private_key)
+        self.forwarder.message_callback(other, msg)
+        self.forwarder.frame_callback(
+            other, DEFAULT_CODEC.encode(msg), DEFAULT_CODEC
+        )
+        self.assertNotIn(
+            msg, destination.received,
+            "Message from neighbour which is not on route is forwarded"
+        )
+        self.forwarder.message_callback(requested_by, msg)
+        self.assertEqual(destination.received, [msg])
+
+    def test_networkdata_raw_forwarding(self) -> None:
+        source = NeignbourMock()
+        destination = NeignbourMock()
+        self.forwarder.routes[(source, destination)] = (source, destination)
+        nonce = b"\x00"*CHACHA_NONCE_LENGTH
+        signed = NetworkData(source, destination, nonce, 1, b"\x00")
+        signed.sign(source.private_key)
+        unsigned = NetworkData(source, destination, nonce, 1, b"\x01")
+        unsigned.set_signature(signed.signature)
+        signed_frame = DEFAULT_CODEC.encode(signed)
+        unsigned_frame = DEFAULT_CODEC.encode(unsigned)
+        self.forwarder.frame_callback(source, signed_frame, DEFAULT_CODEC)
+        self.forwarder.frame_callback(source, unsigned_frame, DEFAULT_CODEC)
+        self.assertEqual(
+            destination.raw_received, [signed_frame],
+            "Forwarder does not relay raw frames with valid signature only"
+        )
+        self.assertFalse(
+            destination.received,
+            "Forwarder decodes frames for known route"
+        )
+        self.forwarder.signature_cache = SignatureCache(types=(NetworkData,))
+        for _ in range(2):
+            self.forwarder.frame_callback(source, signed_frame, DEFAULT_CODEC)
+        self.assertEqual(
+            self.forwarder.signature_cache.hits, 1,
+            "Raw frames are verified bypassing signature cache"
+        )
+        self.forwarder.RAW_VERIFY = False
+        self.forwarder.frame_callback(source, unsigned_frame, DEFAULT_CODEC)
+        self.assertIs(
+            destination.raw_received[-1], unsigned_frame,
+            "Forwarder verifies raw frames while RAW_VERIFY is unset"
+        )
+
+    def test_networkdata_raw_fallback(self) -> None:
+        source = NeignbourMock()
+        destination = NeignbourMock()
+        nonce = b"\x00"*CHACHA_NONCE_LENGTH
+        msg = NetworkData(source, destination, nonce, 1, b"\x00")
+        msg.sign(source.private_key)
+        frame = DEFAULT_CODEC.encode(msg)
+        self.forwarder.frame_callback(source, frame, DEFAULT_CODEC)
+        rerr = RouteError(self.router, source, source, destination)
+        rerr.sign(self.router.private_key)
+        self.assertIn(
+            rerr, source.received,
+            "Forwarder does not handle raw frames with unknown route"
+        )
+
+    @as_sync
+    async def test_batch_verification(self) -> None:
+        source = NeignbourMock()
+        destination = NeignbourMock()
+        self.forwarder.routes[(source, destination)] = (source, destination)
+        executor = ThreadPoolExecutor(2)
+        self.forwarder.verifier = BatchVerifier(
+            self.forwarder.dispatch, executor, batch_size=4, max_latency=0.01
+        )
+        nonce = b"\x00"*CHACHA_NONCE_LENGTH
+        messages = []
+        for i in range(10):
+            msg = NetworkData(source, destination, nonce, 1, bytes([i]))
+            msg.sign(source.private_key)
+            messages.append(msg)
+        forged = NetworkData(source, destination, nonce, 1, b"\xff")
+        forged.set_signature(messages[0].signature)
+        for msg in messages[:5] + [forged] + messages[5:]:
+            self.forwarder.message_callback(source, msg)
+        self.assertFalse(
+            destination.received,
+            "Forwarder handles messages before verification"
+        )
+        await wait_for(lambda: len(destination.received) == len(messages))
+        executor.shutdown()
+        self.assertEqual(
+            destination.received, messages,
+            "Verification stage breaks messages order or passes forged ones"
+        )
+
     def test_routeerror_emit(self) -> None:
         source = NeignbourMock()
         destination = NeignbourMock()
@@ -148,6 +243,17 @@ class TestMessagesForwarder(TestCase):
                 neighbour.received.count(rreq), 1,
                 "Forwarder duplicates RouteRequest"
             )
+        cache = self.forwarder.signature_cache
+        assert cache is not None
+        self.assertEqual(
+            cache.hits, 1,
+            "Forwarder verifies duplicated RouteRequest again"
+        )
+        self.assertEqual(self.forwarder.seen_requests.hits, 1)
+        self.assertEqual(
+            len(self.forwarder.pending_requests[destination]), 1,
+            "Duplicated RouteRequest waits for response"
+        )
         # TODO: Decide is this normal that rreq_other_directions handles RReq
         #       coming from rreq_direction
 
@@ -169,7 +275,6 @@ class TestMessagesForwarder(TestCase):
         rrep = RouteResponse(destination, source, rreq_pubkey, rrep_pubkey)
         rrep.sign(destination.private_key)
         self.forwarder.message_callback(rrep_direction, rrep)
-        await asyncio.sleep(0.5)
         self.assertIn(
             rrep, rreq_direction.received,
             "Forwarder does not relay RouteResponse to requester"
@@ -194,16 +299,132 @@ class TestMessagesForwarder(TestCase):
         rrep = RouteResponse(destination, source, rreq_pubkey, rrep_pubkey)
         rrep.sign(destination.private_key)
         self.forwarder.message_callback(rrep_direction, rrep)
-        await asyncio.sleep(0.5)
+        self.assertEqual(
+            rreq_direction.received, [rrep],
+            "RouteResponse is not relayed along request's path"
+        )
         for receiver in rrep_receivers:
-            self.assertIn(
-                rrep, receiver.received,
-                "Forwarder does not relay RouteResponse to requester"
+            self.assertNotIn(
+                rrep, receiver.received, "RouteResponse is flooded"
             )
         self.assertNotIn(
             rrep, rrep_direction.received,
             "RouteResponse forwarded back to sender"
         )
+        self.assertEqual(
+            self.forwarder.routes.get((source, destination)),
+            (rreq_direction, rrep_direction)
+        )
+
+    @as_sync
+    async def test_routeresponse_matching(self) -> None:
+        destination = NeignbourMock()
+        sources = [NeignbourMock() for _ in range(2)]
+        rrep_direction = NeignbourMock()
+        self.forwarder.neighbours.update(sources + [rrep_direction])
+        requests = []
+        for source in sources:
+            rreq_pubkey = X25519PrivateKey.generate().public_key()
+            rreq = RouteRequest(source, destination, rreq_pubkey)
+            rreq.sign(source.private_key)
+            self.forwarder.message_callback(source, rreq)
+            requests.append(rreq)
+        self.assertEqual(
+            rrep_direction.received, requests[:1],
+            "RouteRequest to the same target is flooded twice"
+        )
+        rrep_pubkey = X25519PrivateKey.generate().public_key()
+        first_source, second_source = sources
+        rrep = RouteResponse(
+            destination, first_source, requests[0].public_key, rrep_pubkey
+        )
+        rrep.sign(destination.private_key)
+        self.forwarder.message_callback(rrep_direction, rrep)
+        await asyncio.sleep(0)
+        self.assertEqual(
+            self.forwarder.routes.get((first_source, destination)),
+            (first_source, rrep_direction)
+        )
+        self.assertIsNone(
+            self.forwarder.routes.get((second_source, destination)),
+            "RouteResponse completes request of another requester"
+        )
+        self.assertEqual(len(self.forwarder.pending_requests[destination]), 1)
+        self.assertEqual(
+            rrep_direction.received, requests,
+            "Held RouteRequest is not sent towards found target"
+        )
+        self.assertNotIn(
+            rrep, second_source.received,
+            "RouteResponse is sent to another requester"
+        )
+
+    @as_sync
+    async def test_routeresponse_repeated_request(self) -> None:
+        source = NeignbourMock()
+        destination = NeignbourMock()
+        neighbours = [NeignbourMock() for _ in range(3)]
+        self.forwarder.neighbours.update(neighbours)
+        first_direction, second_direction, rrep_direction = neighbours
+        rreq_pubkey = X25519PrivateKey.generate().public_key()
+        rreq = RouteRequest(source, destination, rreq_pubkey)
+        rreq.sign(source.private_key)
+        self.forwarder.message_callback(first_direction, rreq)
+        # request is repeated after seen requests filter forgot it
+        self.forwarder.seen_requests = SeenFilter()
+        self.forwarder.message_callback(second_direction, rreq)
+        self.assertEqual(len(self.forwarder.pending_requests[destination]), 2)
+        rrep_pubkey = X25519PrivateKey.generate().public_key()
+        rrep = RouteResponse(destination, source, rreq_pubkey, rrep_pubkey)
+        rrep.sign(destination.private_key)
+        self.forwarder.message_callback(rrep_direction, rrep)
+        self.assertEqual(
+            first_direction.received, [rrep],
+            "RouteResponse is not sent back along the first request's path"
+        )
+        self.assertNotIn(rrep, second_direction.received)
+        await asyncio.sleep(0)
+        self.assertNotIn(destination, self.forwarder.pending_requests)
+
+    @as_sync
+    async def test_routerequest_timeout(self) -> None:
+        source = NeignbourMock()
+        destination = NeignbourMock()
+        neighbours = [NeignbourMock() for _ in range(2)]
+        self.forwarder.neighbours.update(neighbours)
+        rreq_direction, rrep_direction = neighbours
+        self.forwarder.RREQ_TIMEOUT = 0.05
+        self.forwarder.seen_requests.ttl = 0.025
+        self.forwarder.timers = TimerWheel(0.01)
+        rreq_pubkey = X25519PrivateKey.generate().public_key()
+        rreq = RouteRequest(source, destination, rreq_pubkey)
+        rreq.sign(source.private_key)
+        self.forwarder.message_callback(rreq_direction, rreq)
+        self.assertEqual(len(self.forwarder.timers), 1)
+        with patch.object(logging.getLogger("asyncio"), "error") as error:
+            await wait_for(
+                lambda: destination not in self.forwarder.pending_requests
+            )
+            gc.collect()
+        self.assertNotIn(
+            destination, self.forwarder.pending_requests,
+            "Expired RouteRequest is kept"
+        )
+        error.assert_not_called()
+        self.forwarder.message_callback(rreq_direction, rreq)
+        self.assertEqual(
+            len(self.forwarder.timers), 1,
+            "RouteRequest repeated after expiration is dropped"
+        )
+        rrep_pubkey = X25519PrivateKey.generate().public_key()
+        rrep = RouteResponse(destination, source, rreq_pubkey, rrep_pubkey)
+        rrep.sign(destination.private_key)
+        self.forwarder.message_callback(rrep_direction, rrep)
+        await asyncio.sleep(0)
+        self.assertEqual(
+            len(self.forwarder.timers), 0,
+            "Timer of answered RouteRequest is not cancelled"
+        )
 
     def test_routeerror_fetch(self) -> None:
         source = NeignbourMock()
@@ -266,6 +487,66 @@ class TestMessagesForwarder(TestCase):
         )
 
 
+class TestIndexedMessagesForwarder(TestMessagesForwarder):
+
+    def setUp(self) -> None:
+        private_key = Ed25519PrivateKey.generate()
+        self.router = RouterMock(
+            private_key, frontend_factory=RecorderFrontend,
+            forwarder_factory=IndexedMessagesForwarder
+        )
+        self.forwarder = self.router.forwarder
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+
+class TestHandshake(TestCase):
+
+    @as_sync
+    async def test_key_pool_refill(self) -> None:
+        pool = KeyPool(low_water=2, high_water=4)
+        first = pool.take()
+        self.assertEqual((pool.hits, pool.misses), (0, 1))
+        await wait_for(lambda: len(pool) == 4)
+        keys = [pool.take() for _ in range(3)]
+        self.assertEqual((pool.hits, pool.misses), (3, 1))
+        public_keys = {key.public_bytes for key in [first, *keys]}
+        self.assertEqual(len(public_keys), 4, "Ephemeral key is reused")
+        await wait_for(lambda: len(pool) == 4)
+        self.assertEqual(len(pool), 4, "Pool is not refilled")
+
+    def test_key_pool_without_loop(self) -> None:
+        pool = KeyPool(low_water=2, high_water=4)
+        pool.take()
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.misses, 1)
+
+    def test_repeated_request(self) -> None:
+        router = get_test_router()
+        neighbour = NeignbourMock()
+        router.forwarder.neighbours.add(neighbour)
+        requester_key = Ed25519PrivateKey.generate()
+        requester = KnownNode(requester_key.public_key())
+        ephemeral = X25519PrivateKey.generate()
+        request = RouteRequest(requester, router, ephemeral.public_key())
+        request.sign(requester_key)
+        router.forwarder.message_callback(neighbour, request)
+        session = router.sessions[requester]
+        # request delayed on another path after forwarder forgot it
+        router.forwarder.seen_requests = SeenFilter()
+        router.forwarder.message_callback(neighbour, request)
+        self.assertIs(router.sessions[requester], session, "Session is reset")
+        responses = neighbour.received
+        self.assertEqual(len(responses), 2)
+        self.assertIs(responses[0], responses[1])
+        stats = router.handshakes.as_dict()
+        self.assertEqual(stats["exchanges"], 1)
+        self.assertEqual(stats["signatures"], 1)
+        self.assertEqual(stats["repeated_requests"], 1)
+        self.assertGreater(stats["exchange_time"], 0)
+        self.assertGreater(stats["signing_time"], 0)
+
+
 class TestRouter(TestCase):
 
     def setUp(self) -> None:
@@ -278,3 +559,121 @@ class TestRouter(TestCase):
 
     def test_init_network(self) -> None:
         pass
+
+    @as_sync
+    async def test_frontend_data(self) -> None:
+        await self.exchange_frontend_data()
+
+    @as_sync
+    async def test_frontend_data_offload(self) -> None:
+        with ThreadPoolExecutor(2) as executor:
+            crypto = CryptoOffload(executor, inline_threshold=6)
+            await self.exchange_frontend_data(crypto)
+        self.assertGreater(crypto.offloaded, 0)
+        self.assertGreater(crypto.inlined, 0)
+
+    async def exchange_frontend_data(
+        self, crypto: CryptoOffload | None = None
+    ) -> None:
+        first, middle, last = routers = [get_test_router() for _ in range(3)]
+        first.crypto = last.crypto = crypto
+        link_routers(first, middle)
+        link_routers(middle, last)
+        requests = []
+        original_propagate = first.forwarder._propagate_rreq
+
+        def propagate(
+            source: Neighbour,
+            rreq: RouteRequest,
+            directions: Optional[Iterable[Neighbour]] = None
+        ) -> None:
+            requests.append(rreq)
+            original_propagate(source, rreq, directions)
+
+        first.forwarder._propagate_rreq = propagate  # type: ignore
+        payloads = [bytes([i])*10 for i in range(5)]
+        for payload in payloads:
+            first.send(FrontendData(first, last, payload))
+        self.assertEqual(len(requests), 1, "Route discovery is not coalesced")
+        self.assertEqual(len(first.pending_data[last]), len(payloads))
+        frontend = last.frontend
+        assert isinstance(frontend, RecorderFrontend)
+        await wait_for(lambda: len(frontend.received) == len(payloads))
+        self.assertEqual(
+            [message.payload for message in frontend.received], payloads,
+            "Data sent before route discovery is lost"
+        )
+        self.assertEqual((first.pending_data, first.halfopened), ({}, {}))
+        first.send(FrontendData(first, last, b"again"))
+        last.send(FrontendData(last, first, b"back"))
+        first_frontend = first.frontend
+        assert isinstance(first_frontend, RecorderFrontend)
+        await wait_for(
+            lambda: bool(first_frontend.received)
+            and len(frontend.received) > len(payloads)
+        )
+        self.assertEqual(frontend.received[-1].payload, b"again")
+        self.assertEqual(
+            [message.payload for message in first_frontend.received], [b"back"]
+        )
+        self.assertEqual(len(requests), 1, "Established route is not reused")
+        for router in routers:
+            self.assertEqual(router.dropped_data, 0)
+
+    @as_sync
+    async def test_frontend_data_rekey(self) -> None:
+        first, last = get_test_router(), get_test_router()
+        link_routers(first, last)
+        frontend = last.frontend
+        assert isinstance(frontend, RecorderFrontend)
+        first_frontend = first.frontend
+        assert isinstance(first_frontend, RecorderFrontend)
+        first.send(FrontendData(first, last, b"first"))
+        await wait_for(lambda: len(frontend.received) == 1)
+        old_session = first.sessions[last]
+        first.sessions.rekey_packets = 1
+        responses: List[Tuple[Neighbour, RouteResponse]] = []
+        # responder has got the request, but initiator has not got response
+        with patch.object(
+            first.forwarder, "handle_rrep",
+            lambda source, response: responses.append((source, response))
+        ):
+            first.send(FrontendData(first, last, b"second"))
+            self.assertIn(last, first.halfopened, "Rekeying is not started")
+            await wait_for(lambda: bool(responses))
+            last.send(FrontendData(last, first, b"window"))
+            await wait_for(lambda: bool(first_frontend.received))
+        first.forwarder.handle_rrep(*responses[0])
+        self.assertNotIn(last, first.halfopened)
+        first.send(FrontendData(first, last, b"third"))
+        await wait_for(lambda: len(frontend.received) == 3)
+        last.send(FrontendData(last, first, b"after"))
+        await wait_for(lambda: len(first_frontend.received) == 2)
+        self.assertEqual(
+            [message.payload for message in frontend.received],
+            [b"first", b"second", b"third"]
+        )
+        self.assertEqual(
+            [message.payload for message in first_frontend.received],
+            [b"window", b"after"],
+            "Data sent by responder during rekeying is lost"
+        )
+        self.assertIsNot(first.sessions[last], old_session)
+        self.assertTrue(last.sessions[first].confirmed)
+        self.assertEqual(first.sessions.rekeyed, 1)
+        self.assertEqual(last.sessions.rekeyed, 1)
+
+    @as_sync
+    async def test_frontend_data_limit(self) -> None:
+        router = get_test_router()
+        router.PENDING_LIMIT = 2
+        router.forwarder.RREQ_TIMEOUT = 0.05
+        destination = NeignbourMock()
+        for i in range(3):
+            router.send(FrontendData(router, destination, bytes([i])))
+        pending = router.pending_data[destination]
+        self.assertEqual([m.payload for m in pending], [b"\x01", b"\x02"])
+        self.assertEqual(router.dropped_data, 1)
+        await wait_for(lambda: not router.pending_data)
+        self.assertEqual((router.pending_data, router.halfopened), ({}, {}))
+        self.assertEqual(router.dropped_data, 3)
@@ -0,0 +1,105 @@
+from unittest import TestCase
+
+from qorp.codecs import CHACHA_NONCE_LENGTH
+from qorp.encryption import ChaCha20Poly1305, Ed25519PrivateKey
+from qorp.messages import NetworkData
+from qorp.nodes import KnownNode
+from qorp.sessions import ReplayWindow, SessionInfo, SessionTable
+from qorp.sessions import nonce_counter
+
+from tests.test_router import get_test_router
+from tests.utils import RecorderFrontend, clock_shift
+
+
+class TestSessions(TestCase):
+
+    def test_nonces(self) -> None:
+        key = ChaCha20Poly1305(ChaCha20Poly1305.generate_key())
+        initiator, responder = SessionInfo(key, initiator=True), SessionInfo(key)
+        nonces = [initiator.next_nonce() for _ in range(3)]
+        nonces += [responder.next_nonce() for _ in range(3)]
+        self.assertEqual(len(set(nonces)), len(nonces), "Nonce is reused")
+        self.assertEqual({len(nonce) for nonce in nonces}, {CHACHA_NONCE_LENGTH})
+        self.assertEqual([nonce_counter(n) for n in nonces], [0, 1, 2]*2)
+
+    def test_replay_window(self) -> None:
+        window = ReplayWindow(size=8)
+        for counter in (0, 2, 1, 10):
+            self.assertTrue(window.check(counter))
+            self.assertTrue(window.accept(counter))
+        for counter in (2, 10, 1):
+            self.assertFalse(window.check(counter), "Replay is not detected")
+            self.assertFalse(window.accept(counter), "Replay is accepted")
+        self.assertTrue(window.accept(3), "Reordered packet is rejected")
+        self.assertFalse(window.accept(2), "Too old packet is accepted")
+        self.assertTrue(window.accept(100))
+        self.assertFalse(window.accept(92))
+        self.assertTrue(window.accept(93))
+
+    def test_router_drops_replay(self) -> None:
+        router = get_test_router()
+        peer_key = Ed25519PrivateKey.generate()
+        peer = KnownNode(peer_key.public_key())
+        key = ChaCha20Poly1305(ChaCha20Poly1305.generate_key())
+        router.sessions[peer] = SessionInfo(key)
+        sender = SessionInfo(key, initiator=True)
+        nonce = sender.next_nonce()
+        payload = key.encrypt(nonce, b"payload", None)
+        data = NetworkData(peer, router, nonce, len(payload), payload)
+        data.sign(peer_key)
+        router.send(data)
+        router.send(data)
+        frontend = router.frontend
+        assert isinstance(frontend, RecorderFrontend)
+        self.assertEqual([m.payload for m in frontend.received], [b"payload"])
+
+    def test_session_table(self) -> None:
+        key = ChaCha20Poly1305(ChaCha20Poly1305.generate_key())
+        nodes = [KnownNode(Ed25519PrivateKey.generate().public_key())
+                 for _ in range(3)]
+        table = SessionTable(capacity=2, ttl=0.05, rekey_packets=2)
+        for node in nodes:
+            table[node] = SessionInfo(key)
+        self.assertNotIn(nodes[0], table, "Least recently used is kept")
+        table[nodes[1]] = session = SessionInfo(key)
+        self.assertFalse(table.needs_rekey(session))
+        session.next_nonce()
+        session.next_nonce()
+        self.assertTrue(table.needs_rekey(session))
+        with clock_shift(0.06):
+            self.assertEqual(table.expire(), 2)
+        self.assertEqual(
+            table.stats, {"live": 0, "evicted": 1, "expired": 2, "rekeyed": 1}
+        )
+        table.rekey_interval = 0
+        self.assertTrue(table.needs_rekey(SessionInfo(key)))
+
+    def test_rekey_grace(self) -> None:
+        node = KnownNode(Ed25519PrivateKey.generate().public_key())
+        table = SessionTable(rekey_grace=0.05)
+        old_key = ChaCha20Poly1305(ChaCha20Poly1305.generate_key())
+        new_key = ChaCha20Poly1305(ChaCha20Poly1305.generate_key())
+        table[node] = old = SessionInfo(old_key)
+        table[node] = new = SessionInfo(new_key)
+        self.assertIs(table.previous(new), old)
+        self.assertIs(
+            table.sending(new), old,
+            "Responder sends with new key before peer has got it"
+        )
+        table.rekey_packets = 1
+        self.assertIs(table.sending(new), old)
+        old.next_nonce()
+        self.assertIs(
+            table.sending(new), new,
+            "Replaced key is used beyond its packets limit"
+        )
+        self.assertFalse(table.needs_rekey(new))
+        table.rekey_packets = None
+        new.confirmed = True
+        self.assertIs(table.sending(new), new)
+        with clock_shift(0.06):
+            self.assertIsNone(
+                table.previous(new), "Replaced key is kept after grace period"
+            )
+        self.assertIsNone(new.previous)
+        self.assertIs(table.sending(SessionInfo(new_key)).key, new_key)
@@ -0,0 +1,91 @@
+from unittest import TestCase
+
+from qorp.simulation import LINK_DOWN, ChurnEvent, LinkConfig, Simulation
+from qorp.simulation import grid, random_geometric, read_edge_list
+from qorp.simulation import scale_free
+
+from tests.test_router import as_sync
+from tests.utils import wait_for
+
+
+class TestSimulation(TestCase):
+
+    def test_topologies(self) -> None:
+        self.assertEqual(len(grid(3, 4)), 2*4 + 3*3)
+        edges = scale_free(50, 2, seed=1)
+        self.assertEqual(len(edges), 2 + 2*(50 - 3))
+        self.assertEqual(edges, scale_free(50, 2, seed=1))
+        self.assertEqual(len(set(edges)), len(edges))
+        geometric = random_geometric(100, 0.2, seed=1)
+        self.assertEqual(geometric, random_geometric(100, 0.2, seed=1))
+        self.assertTrue(all(first < second for first, second in geometric))
+        self.assertEqual(
+            read_edge_list(["# ring", "0 1", "", "1 2  # chord", "2 0"]),
+            [(0, 1), (1, 2), (2, 0)]
+        )
+
+    def test_deterministic_keys(self) -> None:
+        first, second = Simulation(3, [(0, 1)]), Simulation(3, [(0, 1)])
+        self.assertEqual(
+            [router.address for router in first.routers],
+            [router.address for router in second.routers]
+        )
+        self.assertEqual(first.random_pairs(5), second.random_pairs(5))
+        with self.assertRaises(ValueError):
+            Simulation(2, [(0, 1), (0, 1)])
+        with self.assertRaises(ValueError):
+            Simulation(2, [(0, 1), (1, 0)])
+        simulation = Simulation(3, [(1, 0), (1, 2)])
+        self.assertEqual(simulation.report()["links"], 2)
+        simulation.set_link_up(0, 1, False)
+        self.assertEqual(simulation.report()["links_up"], 1)
+
+    @as_sync
+    async def test_discover(self) -> None:
+        simulation = Simulation(
+            9, grid(3, 3), LinkConfig(latency=0.001, bandwidth=1e7),
+            trace_memory=True,
+        )
+        built = simulation.memory
+        assert built is not None
+        result = await simulation.discover([(0, 8), (2, 6)], timeout=5)
+        self.assertEqual(result["delivered"], 2)
+        self.assertGreater(result["convergence"], 0.002)
+        self.assertGreater(result["control_messages"], 0)
+        report = simulation.report()
+        self.assertEqual((report["nodes"], report["links"]), (9, 12))
+        self.assertGreater(report["bytes_per_node"], built / 9)
+        self.assertEqual(report["NetworkData_messages"], 8)
+
+    @as_sync
+    async def test_churn(self) -> None:
+        simulation = Simulation(3, [(0, 1), (1, 2)])
+        result = await simulation.discover([(0, 2)], timeout=5)
+        self.assertEqual(result["delivered"], 1)
+        simulation.schedule([ChurnEvent(0, LINK_DOWN, 1, 2)])
+        await wait_for(lambda: simulation.report()["links_up"] == 1)
+        self.assertEqual(simulation.report()["links_up"], 1)
+        result = await simulation.discover([(0, 2)], timeout=0.1)
+        self.assertEqual(result["delivered"], 0)
+        self.assertEqual(simulation.traffic.lost, 1)
+        simulation.set_node_up(1, False)
+        self.assertEqual(simulation.report()["links_up"], 0)
+        simulation.set_link_up(1, 2, True)
+        self.assertEqual(simulation.report()["links_up"], 0)
+        simulation.set_node_up(1, True)
+        self.assertEqual(simulation.report()["links_up"], 2)
+        result = await simulation.discover([(0, 2)], timeout=5)
+        self.assertEqual(result["delivered"], 1)
+
+    @as_sync
+    async def test_loss(self) -> None:
+        lost = []
+        for _ in range(2):
+            simulation = Simulation(
+                4, [(0, 1), (1, 2), (2, 3), (3, 0)], LinkConfig(loss=0.5),
+                seed=3,
+            )
+            await simulation.discover([(0, 2)], timeout=0.2)
+            lost.append(simulation.traffic.lost)
+        self.assertGreater(lost[0], 0)
+        self.assertEqual(lost[0], lost[1])
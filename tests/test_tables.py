@@ -0,0 +1,94 @@
+from unittest import TestCase
+
+from qorp.nodes import KnownNode, Neighbour
+from qorp.tables import IndexedRouteTable, RouteTable, SeenFilter
+
+from tests.utils import NeignbourMock, clock_shift
+
+
+class TestRouteTable(TestCase):
+
+    def test_limits(self) -> None:
+        nodes = [NeignbourMock() for _ in range(4)]
+        table = RouteTable(capacity=2, ttl=0.05)
+        table.pin((nodes[0], nodes[0]), (nodes[0], nodes[0]))
+        table[(nodes[1], nodes[2])] = (nodes[1], nodes[2])
+        table[(nodes[2], nodes[1])] = (nodes[2], nodes[1])
+        self.assertIsNotNone(table.get((nodes[1], nodes[2])))
+        table[(nodes[1], nodes[3])] = (nodes[1], nodes[3])
+        self.assertNotIn(
+            (nodes[2], nodes[1]), table, "Least recently used route is kept"
+        )
+        self.assertIn((nodes[1], nodes[2]), table)
+        self.assertEqual((len(table), table.evicted), (3, 1))
+        self.assertGreater(table.approximate_bytes, 0)
+        table.discard_pair(nodes[3], nodes[1])
+        self.assertNotIn((nodes[1], nodes[3]), table)
+        with clock_shift(0.06):
+            self.assertEqual(table.expire(), 1)
+        self.assertEqual(
+            list(table), [(nodes[0], nodes[0])], "Pinned route is expired"
+        )
+
+    def test_seen_filter(self) -> None:
+        seen: SeenFilter[int] = SeenFilter(capacity=4, ttl=0.05)
+        self.assertEqual([seen.seen(key) for key in (1, 2, 1)], [False]*2 + [True])
+        for key in range(3, 6):
+            seen.seen(key)
+        self.assertLessEqual(len(seen), 4, "Filter is not bounded")
+        self.assertNotIn(1, seen)
+        with clock_shift(0.1):
+            self.assertFalse(seen.seen(5), "Key is remembered for too long")
+            self.assertEqual(len(seen), 1)
+
+    def test_indexed(self) -> None:
+        nodes = [NeignbourMock() for _ in range(3)]
+        table = IndexedRouteTable(capacity=4)
+        endpoint = KnownNode(nodes[1].public_key)
+        table[(nodes[0], endpoint)] = (nodes[0], nodes[1])
+        table[(nodes[1], nodes[0])] = (nodes[1], nodes[0])
+        directions = table.get((nodes[0], nodes[1]))
+        self.assertEqual(directions, (nodes[0], nodes[1]))
+        assert directions is not None
+        self.assertIs(directions[1], nodes[1], "Direction is not a neighbour")
+        table[(nodes[1], nodes[2])] = (nodes[1], nodes[2])
+        self.assertNotIn(
+            (nodes[1], nodes[0]), table, "Least recently used route is kept"
+        )
+        self.assertEqual((len(table), table.evicted), (2, 1))
+        table.discard_pair(nodes[2], nodes[1])
+        del table[(nodes[0], nodes[1])]
+        self.assertEqual((len(table), len(table._ends)), (0, 0))
+        table[(nodes[2], nodes[0])] = (nodes[2], nodes[0])
+        self.assertEqual(len(table._ends.nodes), 3, "Node ids are not reused")
+        self.assertEqual(list(table), [(nodes[2], nodes[0])])
+
+    def test_indexed_reconnected_neighbour(self) -> None:
+        for table_type in (RouteTable, IndexedRouteTable):
+            table = table_type()
+            nodes = [NeignbourMock() for _ in range(3)]
+            table[(nodes[0], nodes[1])] = (nodes[0], nodes[1])
+            reconnected = Neighbour(nodes[1].public_key)
+            table[(nodes[0], nodes[2])] = (nodes[0], reconnected)
+            directions = table.get((nodes[0], nodes[2]))
+            assert directions is not None
+            self.assertIs(
+                directions[1], reconnected,
+                f"{table_type.__name__} returns stale neighbour"
+            )
+            directions = table.get((nodes[0], nodes[1]))
+            assert directions is not None
+            self.assertIs(directions[1], nodes[1])
+
+    def test_indexed_expiry(self) -> None:
+        nodes = [NeignbourMock() for _ in range(2)]
+        table = IndexedRouteTable(capacity=100, ttl=0.05)
+        table[(nodes[0], nodes[1])] = (nodes[0], nodes[1])
+        with clock_shift(0.06):
+            self.assertIsNotNone(table.get((nodes[0], nodes[1])))
+        with clock_shift(0.2):
+            self.assertIsNone(
+                table.get((nodes[0], nodes[1])), "Idle route is kept"
+            )
+        self.assertEqual((table.expired, table.evicted), (1, 0))
+        self.assertEqual(len(table._ends), 0)
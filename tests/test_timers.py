@@ -0,0 +1,55 @@
+import asyncio
+from functools import partial
+from unittest import TestCase
+
+from typing import List, Tuple
+
+from qorp.timers import Timer, TimerWheel
+
+from tests.utils import wait_for
+
+from tests.test_router import as_sync
+
+
+class TestTimerWheel(TestCase):
+
+    @as_sync
+    async def test_call_later(self) -> None:
+        loop = asyncio.get_running_loop()
+        wheel = TimerWheel(0.01)
+        fired: List[Tuple[float, float]] = []
+
+        def fire(delay: float) -> None:
+            fired.append((delay, loop.time()))
+
+        start = loop.time()
+        for delay in (0.03, 0.01, 0.02):
+            wheel.call_later(delay, partial(fire, delay))
+        cancelled = wheel.call_later(0.02, partial(fire, 0))
+        cancelled.cancel()
+        cancelled.cancel()
+        self.assertEqual(len(wheel), 3)
+        await wait_for(lambda: len(fired) == 3)
+        self.assertEqual([delay for delay, _ in fired], [0.01, 0.02, 0.03])
+        for delay, time in fired:
+            self.assertGreaterEqual(time - start, delay, "Timer fired early")
+        self.assertEqual(len(wheel), 0)
+
+    @as_sync
+    async def test_cancel_in_same_tick(self) -> None:
+        wheel = TimerWheel(0.01)
+        fired: List[str] = []
+        timers: List[Timer] = []
+
+        def first() -> None:
+            fired.append("first")
+            timers[1].cancel()
+
+        timers.append(wheel.call_later(0.01, first))
+        timers.append(wheel.call_later(0.01, lambda: fired.append("second")))
+        wheel.call_later(0.02, lambda: fired.append("third"))
+        await wait_for(lambda: "third" in fired)
+        self.assertEqual(
+            fired, ["first", "third"], "Timer cancelled in the same tick fires"
+        )
+        self.assertEqual(len(wheel), 0)
@@ -0,0 +1,385 @@
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+from unittest import TestCase, skipIf
+
+from typing import Dict, List, Tuple
+
+from qorp.balancing import FlowHash, LeastQueued, LowestRTT, RoundRobin
+from qorp.codecs import CHACHA_NONCE_LENGTH, DEFAULT_CODEC
+from qorp.datagrams import DatagramConnection, PeersTable, UDPProtocol
+from qorp.encryption import Ed25519PrivateKey, X25519PrivateKey
+from qorp.messages import NetworkData, NetworkMessage, RouteRequest
+from qorp.nodes import KnownNode, Neighbour, Node
+from qorp.queues import BULK, DROP_OLDEST, RAISE
+from qorp.streams import StreamConnection, StreamProtocol, TCPProtocol
+from qorp.streams import UnixProtocol
+from qorp.transports import Connection
+
+from tests.utils import TestConnection, TestProtocol, wait_for
+
+from tests.test_router import as_sync
+
+
+private_key = Ed25519PrivateKey.generate()
+node = KnownNode(private_key.public_key())
+
+
+def get_messages(count: int, size: int = 1) -> List[NetworkMessage]:
+    messages: List[NetworkMessage] = []
+    nonce = b"\x00"*CHACHA_NONCE_LENGTH
+    for i in range(count):
+        payload = bytes([i % 256])*size
+        data = NetworkData(node, node, nonce, len(payload), payload)
+        data.sign(private_key)
+        messages.append(data)
+    rreq = RouteRequest(node, node, X25519PrivateKey.generate().public_key())
+    rreq.sign(private_key)
+    messages.append(rreq)
+    return messages
+
+
+class TestStreamTransport(TestCase):
+
+    async def exchange(
+        self, server_proto: StreamProtocol, messages: List[NetworkMessage]  # type: ignore
+    ) -> None:
+        received: List[NetworkMessage] = []
+        accepted: List[StreamConnection] = []
+
+        def on_connection(address: object, connection: Connection) -> None:  # type: ignore
+            assert isinstance(connection, StreamConnection)
+            connection.handler = received.append
+            accepted.append(connection)
+
+        server = server_proto.listen(on_connection)
+        await server.started()
+        client_proto = server_proto
+        if isinstance(server_proto, TCPProtocol):
+            host, port = server.sockets[0].getsockname()[:2]
+            client_proto = TCPProtocol(host, port)
+        client = client_proto.connect()
+        for message in messages:
+            client.send(message)
+        await client.opened()
+        await wait_for(lambda: len(received) == len(messages))
+        self.assertEqual(received, messages, "Messages are lost or reordered")
+        raw_received: List[bytes] = []
+        accepted[0].raw_handler = raw_received.append
+        frame = DEFAULT_CODEC.encode(messages[0])
+        client.send_raw(frame, DEFAULT_CODEC)
+        await client.drain()
+        await wait_for(lambda: bool(raw_received))
+        self.assertEqual(raw_received, [frame], "Raw frame is not delivered")
+        self.assertEqual(client.frames_sent, len(messages) + 1)
+        self.assertEqual(
+            (accepted[0].frames_received, accepted[0].bytes_received),
+            (client.frames_sent, client.bytes_sent)
+        )
+        accepted[0].raw_handler = None
+        client.send_raw(b"\xff"*80, DEFAULT_CODEC)
+        client.send(messages[0])
+        await wait_for(lambda: len(received) == len(messages) + 1)
+        self.assertEqual(
+            received[-1], messages[0], "Message after broken is lost"
+        )
+        self.assertEqual(accepted[0].malformed, 1)
+        self.assertFalse(accepted[0].closed)
+        if isinstance(server_proto, TCPProtocol) and hasattr(socket, "TCP_INFO"):
+            self.assertIsNotNone(client.rtt, "RTT of TCP connection is unknown")
+        client.close()
+        server.close()
+
+    @as_sync
+    async def test_tcp_loopback(self) -> None:
+        await self.exchange(TCPProtocol("127.0.0.1", 0), get_messages(50))
+
+    @as_sync
+    async def test_tcp_large_messages(self) -> None:
+        messages = get_messages(20, size=60000)
+        await self.exchange(TCPProtocol("127.0.0.1", 0), messages)
+
+    @skipIf(sys.platform == "win32", "Unix sockets are not available")
+    @as_sync
+    async def test_unix_loopback(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "qorp.sock")
+            await self.exchange(UnixProtocol(path), get_messages(50))
+
+    @as_sync
+    async def test_connection_refused(self) -> None:
+        connection = TCPProtocol("127.0.0.1", 1).connect()
+        with self.assertRaises(OSError):
+            await connection.opened()
+        self.assertTrue(connection.closed)
+
+
+class TestDatagramTransport(TestCase):
+
+    @as_sync
+    async def test_udp_loopback(self) -> None:
+        received: List[NetworkMessage] = []
+        accepted: List[DatagramConnection] = []
+
+        def on_connection(address: object, connection: Connection) -> None:  # type: ignore
+            assert isinstance(connection, DatagramConnection)
+            connection.handler = received.append
+            accepted.append(connection)
+
+        server = UDPProtocol("127.0.0.1", 0, mtu=1200).listen(on_connection)
+        await server.started()
+        assert server.address is not None
+        host, port = server.address[:2]
+        client = UDPProtocol(host, port, mtu=1200).connect()
+        await client.opened()
+        messages = get_messages(50, size=100)
+        for message in messages:
+            client.send(message)
+        await wait_for(lambda: len(received) == len(messages))
+        self.assertEqual(received, messages, "Messages are lost or reordered")
+        self.assertLess(
+            client.datagrams_sent, len(messages),
+            "Messages are not packed into datagrams"
+        )
+        replies: List[NetworkMessage] = []
+        client.handler = replies.append
+        accepted[0].send(messages[0])
+        await wait_for(lambda: bool(replies))
+        self.assertEqual(replies, messages[:1], "Reply is not delivered")
+        raw_received: List[bytes] = []
+        accepted[0].raw_handler = lambda frame: raw_received.append(bytes(frame))
+        frame = DEFAULT_CODEC.encode(messages[1])
+        client.send_raw(frame, DEFAULT_CODEC)
+        await wait_for(lambda: bool(raw_received))
+        self.assertEqual(raw_received, [frame], "Raw frame is not delivered")
+        client.close()
+        server.close()
+        await wait_for(lambda: accepted[0].closed)
+        self.assertTrue(client.closed)
+        self.assertTrue(accepted[0].closed)
+
+    @as_sync
+    async def test_udp_malformed_and_peers(self) -> None:
+        received: List[NetworkMessage] = []
+        accepted: List[DatagramConnection] = []
+
+        def on_connection(address: object, connection: Connection) -> None:  # type: ignore
+            assert isinstance(connection, DatagramConnection)
+            connection.handler = received.append
+            accepted.append(connection)
+
+        server = UDPProtocol("127.0.0.1", 0).listen(on_connection)
+        server.endpoint.connections = PeersTable(capacity=1)
+        await server.started()
+        assert server.address is not None
+        host, port = server.address[:2]
+        first = UDPProtocol(host, port).connect()
+        await first.opened()
+        messages = get_messages(2, size=10)
+        first.send_raw(b"\xff"*80, DEFAULT_CODEC)
+        first.send(messages[0])
+        self.assertGreater(first.pending, 0, "Unflushed frames are not pending")
+        await wait_for(lambda: bool(received))
+        self.assertEqual(received, messages[:1], "Message after broken is lost")
+        self.assertEqual(accepted[0].malformed, 1)
+        self.assertEqual(first.pending, 0)
+        second = UDPProtocol(host, port).connect()
+        await second.opened()
+        second.send(messages[1])
+        await wait_for(lambda: len(received) == 2)
+        self.assertEqual(len(accepted), 2)
+        self.assertTrue(accepted[0].closed, "Peers are not bounded")
+        first.close()
+        second.close()
+        server.close()
+
+    @as_sync
+    async def test_message_too_long(self) -> None:
+        client = UDPProtocol("127.0.0.1", 9).connect()
+        messages = get_messages(1, size=65500)
+        with self.assertRaises(ValueError):
+            client.send(messages[0])
+        client.close()
+
+
+class CongestedConnection(TestConnection):
+
+    sent: List[NetworkMessage]
+    congested: bool
+    drained: asyncio.Event
+
+    def __init__(self) -> None:
+        super().__init__(TestProtocol(), DEFAULT_CODEC, 0)
+        self.sent = []
+        self.congested = False
+        self.drained = asyncio.Event()
+
+    @property
+    def pending(self) -> int:
+        return 0x10000 if self.congested else 0
+
+    def send(self, message: NetworkMessage) -> None:
+        self.sent.append(message)
+
+    async def drain(self) -> None:
+        await self.drained.wait()
+
+    def relieve(self) -> None:
+        self.congested = False
+        self.drained.set()
+
+
+class TestSendQueue(TestCase):
+
+    def get_neighbour(self) -> Neighbour:
+        neighbour = Neighbour(private_key.public_key())
+        neighbour.connections.append(CongestedConnection())
+        return neighbour
+
+    @as_sync
+    async def test_priority(self) -> None:
+        neighbour = self.get_neighbour()
+        connection = neighbour.connections[0]
+        assert isinstance(connection, CongestedConnection)
+        messages = get_messages(3)
+        neighbour.send(messages[0])
+        self.assertEqual(connection.sent, messages[:1], "Message is delayed")
+        self.assertFalse(neighbour.has_queue, "Queue of idle link is created")
+        connection.congested = True
+        for message in messages[1:]:
+            neighbour.send(message)
+        self.assertTrue(neighbour.has_queue)
+        self.assertEqual(neighbour.queue.depths, (1, 2))
+        connection.relieve()
+        await wait_for(lambda: not neighbour.queue.depth)
+        self.assertEqual(
+            connection.sent, [messages[0], messages[3], messages[1], messages[2]],
+            "Control messages are not sent ahead of data"
+        )
+
+    @as_sync
+    async def test_overflow(self) -> None:
+        neighbour = self.get_neighbour()
+        connection = neighbour.connections[0]
+        assert isinstance(connection, CongestedConnection)
+        connection.congested = True
+        neighbour.queue.maxsize = 2
+        messages = get_messages(3)[:3]
+        for message in messages:
+            neighbour.send(message)
+        self.assertEqual(neighbour.queue.depths, (0, 2))
+        self.assertEqual(neighbour.queue.dropped, 1)
+        neighbour.queue.policy = RAISE
+        with self.assertRaises(asyncio.QueueFull):
+            neighbour.send(messages[2])
+        neighbour.queue.policy = DROP_OLDEST
+        neighbour.send(messages[2])
+        connection.relieve()
+        await wait_for(lambda: not neighbour.queue.depth)
+        self.assertEqual(connection.sent, messages[1:3])
+        self.assertEqual(neighbour.queue.dropped, 2)
+
+    @as_sync
+    async def test_backpressure(self) -> None:
+        neighbour = self.get_neighbour()
+        connection = neighbour.connections[0]
+        assert isinstance(connection, CongestedConnection)
+        connection.congested = True
+        neighbour.queue.maxsize = 1
+        messages = get_messages(2)[:2]
+        await neighbour.queue.put(messages[0], BULK)
+        put = asyncio.ensure_future(neighbour.queue.put(messages[1], BULK))
+        await asyncio.sleep(0.01)
+        self.assertFalse(put.done(), "Producer is not blocked by full queue")
+        connection.relieve()
+        await asyncio.wait_for(put, 1)
+        await wait_for(lambda: not neighbour.queue.depth)
+        self.assertEqual(connection.sent, messages)
+        self.assertEqual(neighbour.queue.dropped, 0)
+
+
+class FailingConnection(CongestedConnection):
+
+    def send(self, message: NetworkMessage) -> None:
+        raise ConnectionResetError("Connection is closed")
+
+
+class TestConnectionSelection(TestCase):
+
+    def get_neighbour(self, count: int) -> Neighbour:
+        neighbour = Neighbour(private_key.public_key())
+        for _ in range(count):
+            neighbour.connections.append(CongestedConnection())
+        return neighbour
+
+    def sent(self, neighbour: Neighbour) -> List[List[NetworkMessage]]:
+        sent = []
+        for connection in neighbour.connections:
+            assert isinstance(connection, CongestedConnection)
+            sent.append(connection.sent)
+        return sent
+
+    def test_round_robin(self) -> None:
+        neighbour = self.get_neighbour(3)
+        neighbour.selector = RoundRobin()
+        messages = get_messages(5)
+        for message in messages:
+            neighbour.send(message)
+        self.assertEqual([len(sent) for sent in self.sent(neighbour)], [2, 2, 2])
+
+    def test_flow_hash(self) -> None:
+        neighbour = self.get_neighbour(4)
+        neighbour.selector = FlowHash()
+        other_key = Ed25519PrivateKey.generate()
+        other = KnownNode(other_key.public_key())
+        messages = get_messages(10)
+        for message in get_messages(10):
+            message.destination = other
+            message.sign(private_key)
+            messages.append(message)
+        for message in messages:
+            neighbour.send(message)
+        frame = DEFAULT_CODEC.encode(messages[0])
+        neighbour.send_raw(frame, DEFAULT_CODEC)
+        connections_of_flows: Dict[Tuple[Node, Node], int] = {}
+        for index, sent in enumerate(self.sent(neighbour)):
+            for m in sent:
+                flow = m.source, m.destination
+                connection = connections_of_flows.setdefault(flow, index)
+                self.assertEqual(connection, index, "Flow is split over connections")
+        for sent in self.sent(neighbour):
+            if messages[0] in sent:
+                self.assertEqual(sent[-1], messages[0], "Raw frame is in other flow")
+
+    def test_least_queued_and_rtt(self) -> None:
+        neighbour = self.get_neighbour(2)
+        first, second = neighbour.connections
+        assert isinstance(first, CongestedConnection)
+        message = get_messages(1)[0]
+        neighbour.selector = LeastQueued()
+        first.congested = True
+        neighbour.send(message)
+        self.assertEqual(self.sent(neighbour), [[], [message]])
+        neighbour.selector = LowestRTT()
+        first.congested = False
+        neighbour.send(message)
+        self.assertEqual(self.sent(neighbour), [[message], [message]])
+        first.update_rtt(0.2)
+        second.update_rtt(0.1)
+        neighbour.send(message)
+        self.assertEqual(self.sent(neighbour), [[message], [message]*2])
+
+    def test_failover(self) -> None:
+        neighbour = self.get_neighbour(1)
+        neighbour.connections.insert(0, FailingConnection())
+        neighbour.selector = RoundRobin()
+        messages = get_messages(3)
+        for message in messages:
+            neighbour.send(message)
+        self.assertEqual(len(neighbour.connections), 1, "Failed link is kept")
+        self.assertEqual(self.sent(neighbour), [messages])
+        neighbour.connections.clear()
+        with self.assertRaises(ConnectionError):
+            neighbour.send(messages[0])
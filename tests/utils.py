@@ -1,19 +1,40 @@
 from __future__ import annotations
 
 import asyncio
+import time
+from contextlib import contextmanager
+from functools import partial
+from unittest.mock import patch
 
-from typing import Callable, List, Union
+from typing import Callable, Iterator, List, Union
 
 from qorp.codecs import MessagesCodec, DEFAULT_CODEC
 from qorp.encryption import Ed25519PrivateKey, Ed25519PublicKey
 from qorp.frontend import Frontend
-from qorp.messages import FrontendData, NetworkMessage
+from qorp.messages import Buffer, FrontendData, NetworkMessage
 from qorp.nodes import Neighbour
 from qorp.router import Router
 from qorp.routing import MessagesForwarder
 from qorp.transports import Protocol, Connection, Server
 
 
+@contextmanager
+def clock_shift(seconds: float) -> Iterator[None]:
+    """
+    Makes `time.monotonic` run `seconds` ahead.
+    """
+    monotonic = time.monotonic
+    with patch("time.monotonic", lambda: monotonic() + seconds):
+        yield
+
+
+async def wait_for(condition: Callable[[], bool], timeout: float = 1) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition() and loop.time() < deadline:
+        await asyncio.sleep(0.01)
+
+
 def echo(message: FrontendData) -> FrontendData:
     echo = FrontendData(
         message.destination,
@@ -26,6 +47,7 @@ def echo(message: FrontendData) -> FrontendData:
 class NeignbourMock(Neighbour):
 
     received: List[NetworkMessage]
+    raw_received: List[Buffer]
 
     def __init__(self, public_key: Ed25519PublicKey | None = None):
         if public_key is None:
@@ -34,10 +56,14 @@ class NeignbourMock(Neighbour):
         super().__init__(public_key)
         self.private_key = private_key
         self.received = []
+        self.raw_received = []
 
     def send(self, message: NetworkMessage) -> None:
         self.received.append(message)
 
+    def send_raw(self, frame: Buffer, codec: MessagesCodec[bytes]) -> None:
+        self.raw_received.append(frame)
+
 
 class RouterMock(Router):
 
@@ -109,9 +135,11 @@ class TestConnection(Connection[TestProtocol, bytes]):
         self.protocol = proto
         self.codec = codec
         self.delay = delay
+        self.receiver: Callable[[NetworkMessage], None] | None = None
 
     def callback(self, message: NetworkMessage) -> None:
-        pass
+        if self.receiver is not None:
+            self.receiver(message)
 
     def send(self, message: NetworkMessage) -> None:
         loop = asyncio.get_running_loop()
@@ -138,3 +166,25 @@ class TestServer(Server[TestProtocol, bytes]):
         connection: Connection[TestProtocol, bytes]
     ) -> None:
         self.callback(address, connection)
+
+
+def link_routers(first: Router, second: Router, delay: float = 0.01) -> None:
+    first_neighbour = Neighbour(first.public_key)
+    first_proto = TestProtocol()
+    first_neighbour_conn = TestConnection(first_proto, DEFAULT_CODEC, delay)
+    first_neighbour.connections.append(first_neighbour_conn)
+    second_neighbour = Neighbour(second.public_key)
+    second_proto = TestProtocol()
+    second_neighbour_conn = TestConnection(second_proto, DEFAULT_CODEC, delay)
+    second_neighbour.connections.append(second_neighbour_conn)
+    first_proto.address = second_neighbour_conn
+    second_proto.address = first_neighbour_conn
+    first.forwarder.neighbours.add(second_neighbour)
+    second.forwarder.neighbours.add(first_neighbour)
+    # messages sent by one router are received by another one
+    first_neighbour_conn.receiver = partial(
+        second.forwarder.message_callback, first_neighbour
+    )
+    second_neighbour_conn.receiver = partial(
+        first.forwarder.message_callback, second_neighbour
+    )